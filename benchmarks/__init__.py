@@ -0,0 +1,3 @@
+"""Standalone benchmarks of model components. Run from the project root, e.g.
+    python -m benchmarks.input_pipeline --data_dir path_to/data
+"""
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""beam_search.py: Chat latency of greedy decoding vs beam search on CPU.
+
+Builds the chat graph of DynamicBot (embedder, encoder, decoder) with
+random weights, for each decoder class and beam width, and times the
+decoding of a batch of random sentences. Responses always run to
+max_seq_len tokens, since untrained models rarely emit EOS.
+
+Example:
+    python -m benchmarks.beam_search --beam_widths 1,4,8 --batch_size 1
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import time
+import numpy as np
+import tensorflow as tf
+from chatbot import components
+from utils import io_utils
+
+flags = tf.app.flags
+flags.DEFINE_string("beam_widths", "1,4,8", "Comma-separated beam widths.")
+flags.DEFINE_string("decoders", "BasicDecoder,AttentionDecoder",
+                    "Comma-separated decoder classes to compare.")
+flags.DEFINE_integer("batch_size", 1, "Sentences decoded per run.")
+flags.DEFINE_integer("vocab_size", 40000, "Vocabulary size.")
+flags.DEFINE_integer("state_size", 512, "Encoder/decoder state size.")
+flags.DEFINE_integer("embed_size", 128, "Word embedding size.")
+flags.DEFINE_integer("max_seq_len", 20, "Maximum response length.")
+flags.DEFINE_integer("num_runs", 20, "Runs timed per configuration.")
+FLAGS = flags.FLAGS
+
+
+def build_chat_graph(decoder_name, beam_width):
+    """Returns (user_input placeholder, response tensor), built the same way
+    as in DynamicBot.build_computation_graph."""
+    user_input = tf.placeholder(tf.int32, [None, None], name='user_input')
+    decoder_inputs = tf.fill([tf.shape(user_input)[0], 1], io_utils.GO_ID)
+    embedder = components.Embedder(FLAGS.vocab_size, FLAGS.embed_size)
+    rnn_params = {'state_size': FLAGS.state_size,
+                  'embed_size': FLAGS.embed_size,
+                  'num_layers': 1,
+                  'dropout_prob': 0.0,
+                  'base_cell': 'GRUCell'}
+
+    with tf.variable_scope('encoder'):
+        encoder = components.BasicEncoder(**rnn_params)
+        encoder_outputs, encoder_state = encoder(embedder(user_input))
+
+    with tf.variable_scope('decoder'):
+        if decoder_name == 'AttentionDecoder':
+            rnn_params['attention_mechanism'] = 'LuongAttention'
+        decoder = getattr(components, decoder_name)(
+            encoder_outputs=encoder_outputs,
+            vocab_size=FLAGS.vocab_size,
+            max_seq_len=FLAGS.max_seq_len,
+            temperature=0.0,
+            beam_width=beam_width,
+            **rnn_params)
+        response, _ = decoder(embedder(decoder_inputs),
+                              initial_state=encoder_state,
+                              is_chatting=True,
+                              loop_embedder=embedder)
+    return user_input, response
+
+
+def time_decoding(decoder_name, beam_width):
+    """Returns the average seconds per batch of responses."""
+    tf.reset_default_graph()
+    with tf.device('/cpu:0'):
+        user_input, response = build_chat_graph(decoder_name, beam_width)
+    sentences = np.random.randint(
+        4, FLAGS.vocab_size, size=[FLAGS.batch_size, FLAGS.max_seq_len])
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(response, feed_dict={user_input: sentences})  # Warm up.
+        start_time = time.time()
+        for _ in range(FLAGS.num_runs):
+            sess.run(response, feed_dict={user_input: sentences})
+    return (time.time() - start_time) / FLAGS.num_runs
+
+
+def main(argv):
+    beam_widths = [int(w) for w in FLAGS.beam_widths.split(',')]
+    print('%-17s %-11s %-12s %s' % (
+        'decoder', 'beam_width', 'latency (s)', 'vs. greedy'))
+    for decoder_name in FLAGS.decoders.split(','):
+        greedy_time = None
+        for beam_width in beam_widths:
+            latency = time_decoding(decoder_name, beam_width)
+            if beam_width == 1:
+                greedy_time = latency
+            print('%-17s %-11d %-12.4f %s' % (
+                decoder_name, beam_width, latency,
+                '%.2fx' % (latency / greedy_time) if greedy_time else '-'))
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""decode_step.py: Per-token chat latency of frozen graphs on CPU.
+
+Builds the chat graph of DynamicBot (embedder, encoder, greedy decoder) with
+random weights, freezes it, and times the decoding of a batch of random
+sentences, for both the former decoding loop (a dynamic_rnn call and a
+growing tf.concat per token) and Decoder.greedy_decode (one cell call per
+token, written to a TensorArray). Untrained models rarely emit EOS, so
+responses run to about max_seq_len tokens.
+
+Example:
+    python -m benchmarks.decode_step --decoders BasicDecoder,AttentionDecoder
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import time
+import types
+import numpy as np
+import tensorflow as tf
+from chatbot import components
+from utils import io_utils
+
+flags = tf.app.flags
+flags.DEFINE_string("decoders", "BasicDecoder,AttentionDecoder",
+                    "Comma-separated decoder classes to compare.")
+flags.DEFINE_integer("batch_size", 1, "Sentences decoded per run.")
+flags.DEFINE_integer("vocab_size", 40000, "Vocabulary size.")
+flags.DEFINE_integer("state_size", 512, "Encoder/decoder state size.")
+flags.DEFINE_integer("embed_size", 128, "Word embedding size.")
+flags.DEFINE_integer("max_seq_len", 20, "Maximum response length.")
+flags.DEFINE_integer("num_runs", 20, "Runs timed per configuration.")
+FLAGS = flags.FLAGS
+
+
+def dynamic_rnn_decode(self, inputs, state, loop_embedder, cell):
+    """The greedy decoding loop used before: each token runs dynamic_rnn on
+    a single timestep, and is concatenated to the response."""
+
+    def step(inputs, state):
+        outputs, state = self.rnn(inputs=inputs, initial_state=state)
+        logits = tf.nn.xw_plus_b(outputs[:, -1, :], *self.get_projection_tensors())
+        return self.sample(logits), state
+
+    def body(response, state, finished):
+        tf.get_variable_scope().reuse_variables()
+        next_ids, state = step(loop_embedder(response[:, -1:], reuse=True),
+                               state)
+        next_ids = tf.where(finished, tf.fill(tf.shape(next_ids),
+                                              tf.to_int64(io_utils.PAD_ID)),
+                            next_ids)
+        finished = tf.logical_or(finished,
+                                 tf.equal(next_ids, io_utils.EOS_ID))
+        response = tf.concat([response, tf.expand_dims(next_ids, 1)], axis=1)
+        return response, state, finished
+
+    def cond(response, state, finished):
+        return tf.logical_and(
+            tf.logical_not(tf.reduce_all(finished)),
+            tf.less_equal(tf.shape(response)[1], self.max_seq_len))
+
+    next_ids, state = step(tf.expand_dims(inputs, 1), state)
+    response = tf.expand_dims(next_ids, 1)
+    finished = tf.equal(next_ids, io_utils.EOS_ID)
+    tf.get_variable_scope().reuse_variables()
+    response, _, _ = tf.while_loop(
+        cond, body, (response, state, finished),
+        shape_invariants=(tf.TensorShape([None, None]),
+                          cell.shape,
+                          tf.TensorShape([None])),
+        back_prop=False)
+    return response
+
+
+def build_frozen_graph(decoder_name, legacy):
+    """Returns the frozen GraphDef of the chat graph, built the same way as
+    in DynamicBot.build_computation_graph, with inputs 'user_input' and
+    outputs 'outputs'."""
+    tf.reset_default_graph()
+    user_input = tf.placeholder(tf.int32, [None, None], name='user_input')
+    decoder_inputs = tf.fill([tf.shape(user_input)[0], 1], io_utils.GO_ID)
+    embedder = components.Embedder(FLAGS.vocab_size, FLAGS.embed_size)
+    rnn_params = {'state_size': FLAGS.state_size,
+                  'embed_size': FLAGS.embed_size,
+                  'num_layers': 1,
+                  'dropout_prob': 0.0,
+                  'base_cell': 'GRUCell'}
+
+    with tf.variable_scope('encoder'):
+        encoder = components.BasicEncoder(**rnn_params)
+        encoder_outputs, encoder_state = encoder(embedder(user_input))
+
+    with tf.variable_scope('decoder'):
+        if decoder_name == 'AttentionDecoder':
+            rnn_params['attention_mechanism'] = 'LuongAttention'
+        decoder = getattr(components, decoder_name)(
+            encoder_outputs=encoder_outputs,
+            vocab_size=FLAGS.vocab_size,
+            max_seq_len=FLAGS.max_seq_len,
+            temperature=0.0,
+            **rnn_params)
+        if legacy:
+            decoder.greedy_decode = types.MethodType(dynamic_rnn_decode, decoder)
+        response, _ = decoder(embedder(decoder_inputs),
+                              initial_state=encoder_state,
+                              is_chatting=True,
+                              loop_embedder=embedder)
+    tf.identity(response, name='outputs')
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        return tf.graph_util.convert_variables_to_constants(
+            sess, sess.graph_def, ['outputs'])
+
+
+def time_decoding(decoder_name, legacy):
+    """Returns the average seconds per response token."""
+    graph_def = build_frozen_graph(decoder_name, legacy)
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+    sentences = np.random.randint(
+        4, FLAGS.vocab_size, size=[FLAGS.batch_size, FLAGS.max_seq_len])
+    feed_dict = {'user_input:0': sentences}
+
+    config = tf.ConfigProto(device_count={'GPU': 0})
+    with tf.Session(graph=graph, config=config) as sess:
+        sess.run('outputs:0', feed_dict=feed_dict)  # Warm up.
+        num_tokens = 0
+        start_time = time.time()
+        for _ in range(FLAGS.num_runs):
+            num_tokens += sess.run('outputs:0', feed_dict=feed_dict).shape[1]
+    return (time.time() - start_time) / num_tokens
+
+
+def main(argv):
+    print('%-17s %-18s %-18s %s' % (
+        'decoder', 'dynamic_rnn (ms)', 'cell step (ms)', 'speedup'))
+    for decoder_name in FLAGS.decoders.split(','):
+        legacy_time = time_decoding(decoder_name, legacy=True)
+        step_time = time_decoding(decoder_name, legacy=False)
+        print('%-17s %-18.3f %-18.3f %.2fx' % (
+            decoder_name, 1000 * legacy_time, 1000 * step_time,
+            legacy_time / step_time))
+
+
+if __name__ == '__main__':
+    tf.app.run()
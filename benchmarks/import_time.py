@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""import_time.py: Cold-start time of each entry point.
+
+Each entry point is run in a fresh interpreter, several times, and the
+median wall time is reported along with whether tensorflow and pandas ended
+up imported. Config parsing, tokenization and the web app should not import
+either of them.
+
+Example:
+    python -m benchmarks.import_time --repeats 5
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Name -> (working directory, statements run in a fresh interpreter).
+ENTRY_POINTS = {
+    'parse_config': (PROJECT_ROOT, [
+        "from utils import io_utils",
+        "io_utils.parse_config(config_path='configs/example_cornell.yml')"]),
+    'vocab': (PROJECT_ROOT, [
+        "from utils import vocab",
+        "vocab.Vocabulary.load('tests/test_data/vocab121.txt')"
+        ".encode_batch(['hi there', 'how are you?'])"]),
+    'import chatbot, data': (PROJECT_ROOT, [
+        "import chatbot, data"]),
+    'main.py --help': (PROJECT_ROOT, [
+        "import sys; sys.argv = ['main.py', '--help']",
+        "import runpy; runpy.run_path('main.py', run_name='__main__')"]),
+    'web app': (os.path.join(PROJECT_ROOT, 'webpage'), [
+        "from deepchat import create_app",
+        "create_app('testing')"]),
+}
+
+# Appended to the statements: reports the time and heavy imports as json.
+_REPORT = """
+import json, sys, time
+print(json.dumps({'seconds': time.perf_counter() - _start,
+                  'tensorflow': 'tensorflow' in sys.modules,
+                  'pandas': 'pandas' in sys.modules}))
+"""
+
+
+def time_entry_point(cwd, statements):
+    """Returns the report of one cold run, or None if it failed."""
+    code = "\n".join(["import time; _start = time.perf_counter()",
+                      "try:"]
+                     + ["    " + s for s in statements]
+                     + ["except SystemExit:", "    pass", _REPORT])
+    proc = subprocess.run([sys.executable, '-c', code], cwd=cwd,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        print(proc.stderr.strip().splitlines()[-1], file=sys.stderr)
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='Cold runs per entry point.')
+    args = parser.parse_args()
+
+    print('%-22s %10s %12s %8s' % ('entry point', 'median (s)',
+                                   'tensorflow', 'pandas'))
+    for name, (cwd, statements) in ENTRY_POINTS.items():
+        reports = [time_entry_point(cwd, statements)
+                   for _ in range(args.repeats)]
+        if None in reports:
+            print('%-22s %10s' % (name, 'failed'))
+            continue
+        seconds = sorted(r['seconds'] for r in reports)[len(reports) // 2]
+        print('%-22s %10.3f %12s %8s' % (name, seconds,
+                                          reports[0]['tensorflow'],
+                                          reports[0]['pandas']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""input_pipeline.py: Throughput of the input pipeline alone (no model).
+
+For each combination of pipeline class, capacity, number of threads and
+bucket boundaries, builds a fresh pipeline over the training tfrecords and
+reports examples/sec, batches/sec and the fraction of padding tokens in the
+batches. Compare examples/sec to batch_size / (step time) of DynamicBot.train
+to see whether training is input-bound.
+
+Example:
+    python -m benchmarks.input_pipeline \
+        --data_dir tests/test_data --vocab_size 121 --max_seq_len 15 \
+        --capacities 1000,10000 --num_threads 1,4 --boundaries "8,16,32;data"
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import time
+import itertools
+import numpy as np
+import tensorflow as tf
+import data
+from chatbot import components
+
+flags = tf.app.flags
+flags.DEFINE_string("dataset", "TestData", "Name of the dataset class.")
+flags.DEFINE_string("data_dir", None, "Directory containing the dataset.")
+flags.DEFINE_integer("vocab_size", 40000, "Dataset vocabulary size.")
+flags.DEFINE_integer("max_seq_len", 10, "Dataset maximum sentence length.")
+flags.DEFINE_integer("batch_size", 256, "Examples per batch.")
+flags.DEFINE_integer("num_batches", 200, "Batches timed per configuration.")
+flags.DEFINE_integer("warmup_batches", 20, "Batches run before timing.")
+flags.DEFINE_string("pipelines", "InputPipeline,DataPipeline",
+                    "Comma-separated pipeline classes to compare.")
+flags.DEFINE_string("capacities", "1000,10000",
+                    "Comma-separated input capacities to compare.")
+flags.DEFINE_string("num_threads", "1,2,4",
+                    "Comma-separated numbers of reader threads to compare.")
+flags.DEFINE_string("boundaries", "8,16,32;data",
+                    "Semicolon-separated bucket boundaries to compare. "
+                    "'data' uses the ones derived by the dataset.")
+FLAGS = flags.FLAGS
+
+
+def run_config(dataset, pipeline_class, capacity, num_threads, boundaries):
+    """Returns (examples/sec, batches/sec, padding fraction) of a pipeline."""
+
+    tf.reset_default_graph()
+    pipeline = pipeline_class(
+        file_paths=dataset.paths,
+        batch_size=FLAGS.batch_size,
+        capacity=capacity,
+        bucket_boundaries=boundaries,
+        num_threads=num_threads)
+    batch = [pipeline.train_batches['encoder_sequence'],
+             pipeline.train_batches['decoder_sequence']]
+
+    with tf.Session() as sess:
+        coord = tf.train.Coordinator()
+        threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+        for _ in range(FLAGS.warmup_batches):
+            sess.run(batch)
+
+        num_examples = num_tokens = num_padded = 0
+        start_time = time.time()
+        for _ in range(FLAGS.num_batches):
+            encoder_batch, decoder_batch = sess.run(batch)
+            num_examples += len(encoder_batch)
+            for b in (encoder_batch, decoder_batch):
+                num_tokens += np.count_nonzero(b)
+                num_padded += b.size
+        elapsed = time.time() - start_time
+
+        coord.request_stop()
+        coord.join(threads)
+    return (num_examples / elapsed,
+            FLAGS.num_batches / elapsed,
+            1.0 - num_tokens / num_padded)
+
+
+def main(argv):
+    dataset_class = getattr(data, FLAGS.dataset)
+    dataset = dataset_class({'data_dir': FLAGS.data_dir,
+                             'vocab_size': FLAGS.vocab_size,
+                             'max_seq_len': FLAGS.max_seq_len})
+
+    boundary_choices = []
+    for choice in FLAGS.boundaries.split(';'):
+        if choice == 'data':
+            boundary_choices.append(dataset.bucket_boundaries)
+        else:
+            boundary_choices.append([int(b) for b in choice.split(',')])
+
+    configs = itertools.product(
+        FLAGS.pipelines.split(','),
+        [int(c) for c in FLAGS.capacities.split(',')],
+        [int(n) for n in FLAGS.num_threads.split(',')],
+        boundary_choices)
+
+    print('%-14s %-9s %-8s %-10s %-10s %-8s %s' % (
+        'pipeline', 'capacity', 'threads', 'examples/s', 'batches/s',
+        'padding', 'boundaries'))
+    for name, capacity, num_threads, boundaries in configs:
+        examples_per_sec, batches_per_sec, padding = run_config(
+            dataset, getattr(components, name), capacity, num_threads,
+            boundaries)
+        print('%-14s %-9d %-8d %-10.1f %-10.2f %-8.3f %s' % (
+            name, capacity, num_threads, examples_per_sec, batches_per_sec,
+            padding, boundaries))
+
+
+if __name__ == '__main__':
+    tf.app.run()
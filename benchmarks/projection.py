@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""projection.py: Decoder output projection, per-timestep map_fn vs fused.
+
+Times a forward + backward pass of the projection of decoder outputs
+[batch_size, seq_len, state_size] to [batch_size, seq_len, vocab_size],
+followed by the training loss, for both the former tf.map_fn projection
+and Decoder.apply_projection (one matmul over [batch*time, state]).
+
+Example:
+    python -m benchmarks.projection --vocab_sizes 10000,40000,100000
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import time
+import numpy as np
+import tensorflow as tf
+from chatbot.components.decoders import Decoder
+
+flags = tf.app.flags
+flags.DEFINE_string("vocab_sizes", "10000,40000,100000",
+                    "Comma-separated vocabulary sizes to compare.")
+flags.DEFINE_integer("batch_size", 256, "Examples per batch.")
+flags.DEFINE_integer("seq_len", 20, "Decoder timesteps per example.")
+flags.DEFINE_integer("state_size", 512, "Decoder state size.")
+flags.DEFINE_integer("num_steps", 20, "Steps timed per configuration.")
+FLAGS = flags.FLAGS
+
+
+def map_fn_projection(outputs, w, b):
+    """The projection used before fusing: one matmul per timestep."""
+    seq_len = tf.shape(outputs)[1]
+    st_size = tf.shape(outputs)[2]
+    time_major_outputs = tf.reshape(outputs, [seq_len, -1, st_size])
+    projected = tf.map_fn(lambda batch: tf.matmul(batch, w) + b,
+                          time_major_outputs)
+    return tf.reshape(projected, [-1, seq_len, w.get_shape()[1].value])
+
+
+def time_projection(vocab_size, fused):
+    """Returns the average seconds per forward + backward step."""
+    tf.reset_default_graph()
+    outputs = tf.Variable(tf.random_normal(
+        [FLAGS.batch_size, FLAGS.seq_len, FLAGS.state_size]))
+    labels = tf.constant(np.random.randint(
+        vocab_size, size=[FLAGS.batch_size, FLAGS.seq_len]))
+
+    decoder = Decoder(base_cell='GRUCell',
+                      encoder_outputs=None,
+                      state_size=FLAGS.state_size,
+                      vocab_size=vocab_size,
+                      embed_size=32,
+                      dropout_prob=0.0,
+                      num_layers=1,
+                      temperature=0.0,
+                      max_seq_len=FLAGS.seq_len)
+    if fused:
+        logits = decoder.apply_projection(outputs)
+    else:
+        logits = map_fn_projection(outputs, *decoder.get_projection_tensors())
+    loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
+    train_op = tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(train_op)  # Warm up.
+        start_time = time.time()
+        for _ in range(FLAGS.num_steps):
+            sess.run(train_op)
+    return (time.time() - start_time) / FLAGS.num_steps
+
+
+def main(argv):
+    print('%-11s %-14s %-14s %s' % (
+        'vocab_size', 'map_fn (s)', 'fused (s)', 'speedup'))
+    for vocab_size in [int(v) for v in FLAGS.vocab_sizes.split(',')]:
+        map_fn_time = time_projection(vocab_size, fused=False)
+        fused_time = time_projection(vocab_size, fused=True)
+        print('%-11d %-14.4f %-14.4f %.2fx' % (
+            vocab_size, map_fn_time, fused_time, map_fn_time / fused_time))
+
+
+if __name__ == '__main__':
+    tf.app.run()
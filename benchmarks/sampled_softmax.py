@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""sampled_softmax.py: Training-step time of the full vs sampled softmax loss.
+
+Times a forward + backward pass of the decoder loss, given decoder outputs
+[batch_size, seq_len, state_size], for:
+    - full:    Decoder.apply_projection + tf.losses.sparse_softmax_cross_entropy
+    - sampled: bot_ops.dynamic_sampled_softmax_loss
+    - scratch: bot_ops.dynamic_sampled_softmax_loss(from_scratch=True)
+
+Example:
+    python -m benchmarks.sampled_softmax --vocab_sizes 10000,40000,100000
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import time
+import numpy as np
+import tensorflow as tf
+from chatbot.components import bot_ops
+from chatbot.components.decoders import Decoder
+from utils import io_utils
+
+flags = tf.app.flags
+flags.DEFINE_string("vocab_sizes", "10000,40000,100000",
+                    "Comma-separated vocabulary sizes to compare.")
+flags.DEFINE_integer("batch_size", 256, "Examples per batch.")
+flags.DEFINE_integer("seq_len", 20, "Decoder timesteps per example.")
+flags.DEFINE_integer("state_size", 512, "Decoder state size.")
+flags.DEFINE_integer("num_samples", 512, "Sampled classes per batch.")
+flags.DEFINE_integer("num_steps", 20, "Steps timed per configuration.")
+FLAGS = flags.FLAGS
+
+LOSSES = ['full', 'sampled', 'scratch']
+
+
+def time_loss(vocab_size, loss_name):
+    """Returns the average seconds per forward + backward step."""
+    tf.reset_default_graph()
+    outputs = tf.Variable(tf.random_normal(
+        [FLAGS.batch_size, FLAGS.seq_len, FLAGS.state_size]))
+    # Labels are padded past a random length, as in real batches.
+    labels = np.random.randint(4, vocab_size,
+                               size=[FLAGS.batch_size, FLAGS.seq_len])
+    lengths = np.random.randint(1, FLAGS.seq_len + 1, size=FLAGS.batch_size)
+    labels[np.arange(FLAGS.seq_len) >= lengths[:, None]] = io_utils.PAD_ID
+    labels = tf.constant(labels)
+    weights = tf.to_float(labels > 0)
+
+    decoder = Decoder(base_cell='GRUCell',
+                      encoder_outputs=None,
+                      state_size=FLAGS.state_size,
+                      vocab_size=vocab_size,
+                      embed_size=32,
+                      dropout_prob=0.0,
+                      num_layers=1,
+                      temperature=0.0,
+                      max_seq_len=FLAGS.seq_len)
+    if loss_name == 'full':
+        loss = tf.losses.sparse_softmax_cross_entropy(
+            labels=labels,
+            logits=decoder.apply_projection(outputs),
+            weights=weights)
+    else:
+        loss = bot_ops.dynamic_sampled_softmax_loss(
+            labels, outputs, decoder.get_projection_tensors(), vocab_size,
+            from_scratch=(loss_name == 'scratch'),
+            num_samples=FLAGS.num_samples,
+            weights=weights)
+    train_op = tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(train_op)  # Warm up.
+        start_time = time.time()
+        for _ in range(FLAGS.num_steps):
+            sess.run(train_op)
+    return (time.time() - start_time) / FLAGS.num_steps
+
+
+def main(argv):
+    print(('%-11s' + ' %-12s' * len(LOSSES)) % (
+        ('vocab_size',) + tuple(name + ' (s)' for name in LOSSES)))
+    for vocab_size in [int(v) for v in FLAGS.vocab_sizes.split(',')]:
+        times = [time_loss(vocab_size, name) for name in LOSSES]
+        print(('%-11d' + ' %-12.4f' * len(LOSSES)) % ((vocab_size,) + tuple(times)))
+
+
+if __name__ == '__main__':
+    tf.app.run()
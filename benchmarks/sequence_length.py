@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""sequence_length.py: Training step time with and without sequence lengths.
+
+For each bucket, builds random batches the way InputPipeline does (lengths
+drawn from the bucket, padded to the longest sequence of the batch) and
+times a forward + backward step of the encoder, decoder and loss, first
+running the RNNs over the full padded batches, then passing the true
+lengths (so the encoder state, decoder outputs and attention stop at each
+sequence's end).
+
+Example:
+    python -m benchmarks.sequence_length --bucket_boundaries 8,16,32
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import time
+import numpy as np
+import tensorflow as tf
+from chatbot import components
+
+flags = tf.app.flags
+flags.DEFINE_string("bucket_boundaries", "8,16,32",
+                    "Comma-separated upper length boundaries of the buckets.")
+flags.DEFINE_string("decoder", "AttentionDecoder", "Decoder class to time.")
+flags.DEFINE_integer("batch_size", 64, "Examples per batch.")
+flags.DEFINE_integer("vocab_size", 10000, "Vocabulary size.")
+flags.DEFINE_integer("state_size", 512, "Encoder/decoder state size.")
+flags.DEFINE_integer("embed_size", 128, "Word embedding size.")
+flags.DEFINE_integer("num_steps", 20, "Steps timed per configuration.")
+FLAGS = flags.FLAGS
+
+
+def random_batch(low, high):
+    """Returns (padded [batch_size, max_len] ids, [batch_size] lengths), with
+    lengths drawn uniformly from [low, high)."""
+    lengths = np.random.randint(low, high, size=FLAGS.batch_size)
+    batch = np.zeros([FLAGS.batch_size, lengths.max()], dtype=np.int32)
+    for i, length in enumerate(lengths):
+        batch[i, :length] = np.random.randint(4, FLAGS.vocab_size, size=length)
+    return batch, lengths.astype(np.int32)
+
+
+def build_train_op(use_lengths):
+    """Returns (placeholders, train_op), built the same way as in
+    DynamicBot.build_computation_graph and compile."""
+    encoder_inputs = tf.placeholder(tf.int32, [None, None])
+    decoder_inputs = tf.placeholder(tf.int32, [None, None])
+    encoder_lengths = tf.placeholder(tf.int32, [None])
+    decoder_lengths = tf.placeholder(tf.int32, [None])
+    placeholders = (encoder_inputs, decoder_inputs,
+                    encoder_lengths, decoder_lengths)
+    if not use_lengths:
+        encoder_lengths = decoder_lengths = None
+
+    embedder = components.Embedder(FLAGS.vocab_size, FLAGS.embed_size)
+    rnn_params = {'state_size': FLAGS.state_size,
+                  'embed_size': FLAGS.embed_size,
+                  'num_layers': 1,
+                  'dropout_prob': 0.0,
+                  'base_cell': 'GRUCell'}
+
+    with tf.variable_scope('encoder'):
+        encoder = components.BasicEncoder(**rnn_params)
+        encoder_outputs, encoder_state = encoder(
+            embedder(encoder_inputs), sequence_length=encoder_lengths)
+
+    with tf.variable_scope('decoder'):
+        if FLAGS.decoder == 'AttentionDecoder':
+            rnn_params['attention_mechanism'] = 'LuongAttention'
+        decoder = getattr(components, FLAGS.decoder)(
+            encoder_outputs=encoder_outputs,
+            encoder_sequence_length=encoder_lengths,
+            vocab_size=FLAGS.vocab_size,
+            max_seq_len=max(boundaries()),
+            temperature=0.0,
+            **rnn_params)
+        outputs, _ = decoder(embedder(decoder_inputs),
+                             initial_state=encoder_state,
+                             sequence_length=decoder_lengths)
+
+    target_labels = decoder_inputs[:, 1:]
+    target_weights = tf.cast(target_labels > 0, tf.float32)
+    loss = tf.losses.sparse_softmax_cross_entropy(
+        labels=target_labels,
+        logits=decoder.apply_projection(outputs)[:, :-1, :],
+        weights=target_weights)
+    return placeholders, tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+
+
+def time_bucket(low, high, use_lengths):
+    """Returns the average seconds per training step on batches of the
+    bucket [low, high)."""
+    tf.reset_default_graph()
+    placeholders, train_op = build_train_op(use_lengths)
+    feeds = []
+    for _ in range(FLAGS.num_steps + 1):
+        encoder_batch, encoder_lengths = random_batch(low, high)
+        decoder_batch, decoder_lengths = random_batch(low, high)
+        feeds.append(dict(zip(placeholders, (encoder_batch, decoder_batch,
+                                             encoder_lengths, decoder_lengths))))
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(train_op, feed_dict=feeds[0])  # Warm up.
+        start_time = time.time()
+        for feed in feeds[1:]:
+            sess.run(train_op, feed_dict=feed)
+    return (time.time() - start_time) / FLAGS.num_steps
+
+
+def boundaries():
+    return [int(b) for b in FLAGS.bucket_boundaries.split(',')]
+
+
+def main(argv):
+    print('%-10s %-14s %-14s %s' % (
+        'bucket', 'padded (s)', 'lengths (s)', 'speedup'))
+    low = 2
+    for high in boundaries():
+        padded_time = time_bucket(low, high, use_lengths=False)
+        lengths_time = time_bucket(low, high, use_lengths=True)
+        print('%-10s %-14.4f %-14.4f %.2fx' % (
+            '[%d, %d)' % (low, high), padded_time, lengths_time,
+            padded_time / lengths_time))
+        low = high
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""worker_pool.py: Chat throughput of the web bots per workers x threads.
+
+Serves a frozen bot of the webpage (webpage/deepchat/static/assets/
+frozen_models/<model>) the way the web app does -- a BatchingWorker in front
+of either a single in-process FrozenBot (0 workers) or a WorkerPool -- and
+has concurrent clients send it random sentences for a fixed time. Each
+configuration sets the session thread pools of every bot to
+intra_op_threads = threads and inter_op_threads = 1, and configurations
+that would need more threads than cores are skipped.
+
+The best configuration gives the BOT_WORKERS, BOT_INTRA_OP_THREADS and
+BOT_INTER_OP_THREADS settings of the web app (see webpage/config.py).
+The response cache is disabled, so every sentence runs the model.
+
+Example:
+    python -m benchmarks.worker_pool --model cornell --workers 0,1,2,4 \
+        --threads 1,2,4 --pin
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from functools import partial
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'webpage'))
+
+from deepchat import web_bot
+from deepchat.batching import BatchingWorker
+from deepchat.worker_pool import WorkerPool, split_cpus
+
+SENTENCES = ["hi", "how are you?", "what's your name?", "where are you from?",
+             "do you like movies?", "tell me a joke.", "what time is it?",
+             "i don't know what to say.", "good night.", "why not?"]
+
+
+def load_server(args, num_workers, num_threads):
+    """Returns the bot and the BatchingWorker serving it."""
+    load_bot = partial(web_bot.FrozenBot,
+                       cache_size=0,
+                       runtime=args.runtime,
+                       intra_op_threads=num_threads,
+                       inter_op_threads=1)
+    if num_workers == 0:
+        bot = load_bot(args.model)
+    else:
+        cpu_sets = split_cpus(num_workers) if args.pin else None
+        bot = WorkerPool(args.model, load_bot, num_workers=num_workers,
+                         cpu_sets=cpu_sets)
+    worker = BatchingWorker(bot.respond_batch,
+                            max_batch_size=args.max_batch_size,
+                            max_wait_ms=args.max_wait_ms,
+                            num_threads=getattr(bot, 'concurrency', 1))
+    return bot, worker
+
+
+def run_clients(worker, num_clients, seconds):
+    """Returns the latencies (in seconds) of the requests answered while
+    num_clients clients send requests for the given time."""
+    deadline = time.time() + seconds
+    latencies = [[] for _ in range(num_clients)]
+
+    def client(i):
+        rng = random.Random(i)
+        while time.time() < deadline:
+            start_time = time.time()
+            worker(rng.choice(SENTENCES))
+            latencies[i].append(time.time() - start_time)
+
+    threads = [threading.Thread(target=client, args=(i,))
+               for i in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(sum(latencies, []))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--model', default='cornell',
+                        help='Frozen model directory of the webpage.')
+    parser.add_argument('--runtime', default='tensorflow',
+                        choices=['tensorflow', 'numpy'])
+    parser.add_argument('--workers', default='0,1,2,4',
+                        help='Comma-separated worker counts (0 = serve '
+                             'from this process).')
+    parser.add_argument('--threads', default='1,2,4',
+                        help='Comma-separated intra-op thread counts.')
+    parser.add_argument('--cores', type=int,
+                        default=len(os.sched_getaffinity(0)),
+                        help='Cores available to the bots.')
+    parser.add_argument('--pin', action='store_true',
+                        help='Pin each worker to its own cores.')
+    parser.add_argument('--clients', type=int, default=32,
+                        help='Concurrent clients sending requests.')
+    parser.add_argument('--seconds', type=float, default=10.,
+                        help='Duration of each measurement.')
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    parser.add_argument('--max_wait_ms', type=float, default=5.)
+    args = parser.parse_args()
+
+    print('%-8s %-8s %12s %10s %10s' % ('workers', 'threads', 'responses/s',
+                                        'p50 (ms)', 'p95 (ms)'))
+    results = []
+    for num_workers in [int(w) for w in args.workers.split(',')]:
+        for num_threads in [int(t) for t in args.threads.split(',')]:
+            if max(num_workers, 1) * num_threads > args.cores:
+                continue
+            bot, worker = load_server(args, num_workers, num_threads)
+            run_clients(worker, args.clients, 1.)  # Warm up.
+            latencies = run_clients(worker, args.clients, args.seconds)
+            worker.close()
+            bot.freeze()
+
+            throughput = len(latencies) / args.seconds
+            results.append((throughput, num_workers, num_threads))
+            print('%-8d %-8d %12.1f %10.1f %10.1f' % (
+                num_workers, num_threads, throughput,
+                1000 * latencies[len(latencies) // 2],
+                1000 * latencies[int(0.95 * (len(latencies) - 1))]))
+
+    if results:
+        throughput, num_workers, num_threads = max(results)
+        print('\nBest for %d cores: BOT_WORKERS=%d BOT_INTRA_OP_THREADS=%d '
+              'BOT_INTER_OP_THREADS=1 (%.1f responses/s)' % (
+                  args.cores, num_workers, num_threads, throughput))
+
+
+if __name__ == '__main__':
+    main()
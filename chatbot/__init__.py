@@ -1,10 +1,39 @@
+"""Models and their components are imported on first access (PEP 562), so
+that lightweight users of the package (e.g. chatbot.globals, via config
+parsing) don't pay for importing tensorflow.
+"""
+
+import importlib
 from chatbot import globals
-from chatbot.components.base._rnn import  *
-from chatbot.components.bot_ops import dynamic_sampled_softmax_loss
-from chatbot.components.decoders import *
-from chatbot.components.embedder import *
-from chatbot.components.encoders import *
-from chatbot.dynamic_models import DynamicBot
-from chatbot.legacy.legacy_models import ChatBot, SimpleBot
+
+# Attributes of the package, and the module each is imported from.
+_LAZY_ATTRS = {
+    'DynamicBot': 'chatbot.dynamic_models',
+    'ChatBot': 'chatbot.legacy.legacy_models',
+    'SimpleBot': 'chatbot.legacy.legacy_models',
+    'dynamic_sampled_softmax_loss': 'chatbot.components.bot_ops',
+}
+# Modules whose public names are also attributes of the package.
+_STAR_MODULES = ['chatbot.components.base._rnn',
+                 'chatbot.components.decoders',
+                 'chatbot.components.embedder',
+                 'chatbot.components.encoders']
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    try:
+        return importlib.import_module(__name__ + '.' + name)
+    except ModuleNotFoundError as e:
+        if e.name != __name__ + '.' + name:
+            raise
+    if not name.startswith('_'):
+        for module_name in _STAR_MODULES:
+            module = importlib.import_module(module_name)
+            if name in getattr(module, '__all__', vars(module)):
+                return getattr(module, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 
 __all__ = ['Chatbot, SimpleBot', 'DynamicBot']
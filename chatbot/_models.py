@@ -9,12 +9,14 @@ import copy
 import yaml
 import random
 import subprocess
+from pydoc import locate
 
 import numpy as np
 import tensorflow as tf
 from tensorflow.contrib.tensorboard.plugins import projector
 from tensorflow.python.client import device_lib
 from utils import io_utils
+from utils import graph_optimizer
 from chatbot.components import *
 from chatbot.globals import DEFAULT_FULL_CONFIG, OPTIMIZERS
 
@@ -53,12 +55,9 @@ class Model(object):
         # Configure gpu options if we are using one.
         if gpu_found():
             self.log.info("GPU Found. Setting allow_growth to True.")
-            gpu_config = tf.ConfigProto()
-            gpu_config.gpu_options.allow_growth = True
-            self.sess = tf.Session(config=gpu_config)
         else:
             self.log.warning("GPU not found. Not recommended for training.")
-            self.sess = tf.Session()
+        self.sess = tf.Session(config=self.session_config())
 
         with self.graph.name_scope(tf.GraphKeys.SUMMARIES):
             self.global_step = tf.Variable(initial_value=0, trainable=False)
@@ -74,6 +73,17 @@ class Model(object):
         self.train_op = None
         self.saver = None
 
+    def session_config(self):
+        """Returns the ConfigProto of the sessions of this model: the sizes
+        of its thread pools (see intra_op_threads and inter_op_threads), and
+        allow_growth when a GPU is found."""
+        config = tf.ConfigProto(
+            intra_op_parallelism_threads=self.intra_op_threads,
+            inter_op_parallelism_threads=self.inter_op_threads)
+        if gpu_found():
+            config.gpu_options.allow_growth = True
+        return config
+
     def compile(self):
         """ Configure training process and initialize model. Inspired by Keras.
 
@@ -190,6 +200,14 @@ class Model(object):
         print("%d ops in the final graph." % len(output_graph_def.node))
         subprocess.call(['cp', self.dataset.paths['vocab'], self.ckpt_dir])
 
+        # Also export a graph optimized for deployment (optimized_model.pb).
+        # Only chat graphs are fed by user input; training graphs are fed
+        # by the input pipeline.
+        if self.is_chatting:
+            graph_optimizer.export_optimized(self.ckpt_dir,
+                                             quantize=self.quantize_weights,
+                                             vocab_size=self.vocab_size)
+
     def __getattr__(self, name):
         if name == 'params':
             camel_case = self.data_name.title().replace('_', '')
@@ -255,7 +273,7 @@ class BucketModel(Model):
         params = tf.trainable_variables()
         # train_op will store the parameter (S)GD train_op.
         self.apply_gradients = []
-        optimizer = OPTIMIZERS[self.optimizer](self.learning_rate)
+        optimizer = locate(OPTIMIZERS[self.optimizer])(self.learning_rate)
         for b in range(len(self.buckets)):
             gradients = tf.gradients(self.losses[b], params)
             # Gradient clipping is actually extremely simple, it basically just
@@ -1,9 +1,10 @@
 from chatbot.components.embedder import Embedder
-from chatbot.components.input_pipeline import InputPipeline
+from chatbot.components.input_pipeline import InputPipeline, DataPipeline
 from chatbot.components.encoders import BasicEncoder, BidirectionalEncoder
 from chatbot.components.decoders import BasicDecoder, AttentionDecoder
 
 __all__ = ["InputPipeline",
+           "DataPipeline",
            "Embedder",
            "BasicEncoder",
            "BidirectionalEncoder",
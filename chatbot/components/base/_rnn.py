@@ -166,6 +166,7 @@ class SimpleAttentionWrapper(RNNCell):
                  cell,
                  attention_mechanism,
                  initial_cell_state=None,
+                 memory_sequence_length=None,
                  name=None):
         """Construct the wrapper.
         
@@ -180,6 +181,9 @@ class SimpleAttentionWrapper(RNNCell):
             attention_mechanism: instance of tf AttentionMechanism.
             initial_cell_state: The initial state value to use for the cell when
                 the user calls `zero_state()`.
+            memory_sequence_length: (optional) Tensor with shape [batch_size]
+                of the true length of each sequence in the attention memory.
+                Alignment scores past the end of each sequence are masked.
             name: Name to use when creating ops.
         """
 
@@ -198,6 +202,7 @@ class SimpleAttentionWrapper(RNNCell):
 
         self._cell = cell
         self._attention_mechanism = attention_mechanism
+        self._memory_sequence_length = memory_sequence_length
         with tf.name_scope(name, "AttentionWrapperInit"):
             if initial_cell_state is None:
                 self._initial_cell_state = None
@@ -273,6 +278,12 @@ class SimpleAttentionWrapper(RNNCell):
         # 2. (align) Compute the normalized alignment scores. [B, L_enc].
         # where L_enc is the max seq len in the encoder outputs for the (B)atch.
         score = self._attention_mechanism(cell_output)
+        if self._memory_sequence_length is not None:
+            # Padded positions get (nearly) zero weight.
+            mask = tf.sequence_mask(self._memory_sequence_length,
+                                    maxlen=tf.shape(score)[1])
+            score = tf.where(mask, score,
+                             tf.fill(tf.shape(score), score.dtype.min))
         alignments = tf.nn.softmax(score)
 
         # Reshape from [B, L_enc] to [B, 1, L_enc]
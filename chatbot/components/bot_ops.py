@@ -7,39 +7,59 @@ from tensorflow.python.util import nest
 
 
 def dynamic_sampled_softmax_loss(labels, logits, output_projection, vocab_size,
-                                 from_scratch=False, num_samples=512, name=None):
+                                 from_scratch=False, num_samples=512,
+                                 weights=None, name=None):
     """Sampled softmax loss function able to accept 3D Tensors as input,
        as opposed to the official TensorFlow support for <= 2D. This is
        dynamic because it can be applied across variable-length sequences,
        which are unspecified at initialization with size 'None'.
 
+       The [batch_size, None] timesteps are flattened and computed together,
+       with one set of num_samples candidates drawn for the whole batch.
+
        Args:
         labels: 2D integer tensor of shape [batch_size, None] containing
             the word ID labels for each individual rnn state from logits.
         logits: 3D float tensor of shape [batch_size, None, state_size] as
             ouput by a DynamicDecoder instance.
-        from_scratch: (bool) Whether to use the version I wrote from scratch, or to use
-                      the version I wrote that applies map_fn(sampled_softmax) across timeslices, which
-                      is probably less efficient. (Currently testing)
-        num
+        output_projection: (tuple) returned by Decoder.get_projection_tensors.
+        vocab_size: total number of classes.
+        from_scratch: (bool) Whether to use the version I wrote from scratch,
+            or the one built on tf.nn.sampled_softmax_loss.
+        num_samples: number of classes out of vocab_size sampled per batch.
+        weights: (optional) tensor of shape [batch_size, None]; timesteps
+            with weight 0 (e.g. PAD targets) don't contribute to the loss.
         Returns:
-            loss as a scalar Tensor, computed as the mean over all batches and sequences.
+            loss as a scalar Tensor, computed as the weighted mean over all
+            batches and sequences.
     """
 
     if from_scratch:
         return _dynamic_sampled_from_scratch(labels, logits, output_projection, vocab_size,
-                                             num_samples=num_samples, name=name)
+                                             num_samples=num_samples,
+                                             weights=weights, name=name)
     else:
-        return _dynamic_sampled_map(labels, logits, output_projection, vocab_size,
-                                    num_samples=num_samples, name=name)
+        return _dynamic_sampled_builtin(labels, logits, output_projection, vocab_size,
+                                        num_samples=num_samples,
+                                        weights=weights, name=name)
+
+
+def _flatten_time(labels, logits, weights):
+    """Reshapes [batch_size, None(, state_size)] tensors into 
+    [batch_size * None(, state_size)] ones, and fills in default weights."""
+    state_size = tf.shape(logits)[2]
+    flat_logits = tf.reshape(logits, [-1, state_size])
+    flat_labels = tf.reshape(tf.cast(labels, tf.int64), [-1])
+    if weights is None:
+        flat_weights = tf.ones_like(flat_labels, dtype=tf.float32)
+    else:
+        flat_weights = tf.reshape(tf.to_float(weights), [-1])
+    return flat_labels, flat_logits, flat_weights
 
 
-def _dynamic_sampled_map(labels, logits, output_projection, vocab_size,
-                                 num_samples=512, name=None):
-    """Sampled softmax loss function able to accept 3D Tensors as input,
-       as opposed to the official TensorFlow support for <= 2D. This is
-       dynamic because it can be applied across variable-length sequences,
-       which are unspecified at initialization with size 'None'.
+def _dynamic_sampled_builtin(labels, logits, output_projection, vocab_size,
+                             num_samples=512, weights=None, name=None):
+    """Applies tf.nn.sampled_softmax_loss to all flattened timesteps at once.
 
        Args:
            labels: 2D integer tensor of shape [batch_size, None] containing
@@ -48,39 +68,27 @@ def _dynamic_sampled_map(labels, logits, output_projection, vocab_size,
                 ouput by a DynamicDecoder instance.
 
         Returns:
-            loss as a scalar Tensor, computed as the mean over all batches and sequences.
+            loss as a scalar Tensor, computed as the weighted mean over all
+            batches and sequences.
     """
     with tf.name_scope(name, "dynamic_sampled_softmax_loss", [labels, logits, output_projection]):
-        seq_len = tf.shape(logits)[1]
-        st_size = tf.shape(logits)[2]
-        time_major_outputs = tf.reshape(logits, [seq_len, -1, st_size])
-        time_major_labels = tf.reshape(labels, [seq_len, -1])
-        # Reshape is apparently faster (dynamic) than transpose.
-        w_t = tf.reshape(output_projection[0], [vocab_size, -1])
+        labels, logits, weights = _flatten_time(labels, logits, weights)
+        # sampled_softmax_loss wants the projection as [vocab_size, state_size].
+        w_t = tf.transpose(output_projection[0])
         b = output_projection[1]
-        def sampled_loss(elem):
-            logits, lab = elem
-            lab = tf.reshape(lab, [-1, 1])
-            # TODO: Figure out how this accurately gets loss without requiring weights,
-            # like sparse_softmax_cross_entropy requires.
-            return tf.reduce_mean(
-                tf.nn.sampled_softmax_loss(
-                    weights=w_t,
-                    biases=b,
-                    labels=lab,
-                    inputs=logits,
-                    num_sampled=num_samples,
-                    num_classes=vocab_size,
-                    partition_strategy='div'))
-        batch_losses = tf.map_fn(sampled_loss,
-                                 (time_major_outputs, time_major_labels),
-                                 dtype=tf.float32)
-        loss = tf.reduce_mean(batch_losses)
-    return loss
+        losses = tf.nn.sampled_softmax_loss(
+            weights=w_t,
+            biases=b,
+            labels=tf.expand_dims(labels, -1),
+            inputs=logits,
+            num_sampled=num_samples,
+            num_classes=vocab_size,
+            partition_strategy='div')
+        return tf.losses.compute_weighted_loss(losses, weights)
 
 
 def _dynamic_sampled_from_scratch(labels, logits, output_projection, vocab_size,
-                                  num_samples, name=None):
+                                  num_samples, weights=None, name=None):
     """Note: I closely follow the notation from Tensorflow's Candidate Sampling reference.
        - Link: https://www.tensorflow.org/extras/candidate_sampling.pdf
 
@@ -93,56 +101,40 @@ def _dynamic_sampled_from_scratch(labels, logits, output_projection, vocab_size,
             - In this project, usually is the decoder batch output sequence (NOT projected).
         num_samples: number of classes out of vocab_size possible to use.
         vocab_size: total number of classes.
+        weights: (optional) 2D float Tensor [batch_size, None].
     """
     with tf.name_scope(name, "dynamic_sampled_from_scratch", [labels, logits, output_projection]):
-        batch_size, seq_len, state_size  = tf.unstack(tf.shape(logits))
-        time_major_outputs  = tf.reshape(logits, [seq_len, batch_size, state_size])
-        time_major_labels   = tf.reshape(labels, [seq_len, batch_size])
-
-        weights = tf.transpose(output_projection[0])
-        biases = output_projection[1]
-        def sampled_loss_single_timestep(args):
-            """
-            Args: 2-tuple (because map_fn below)
-                targets: 1D tensor (sighs loudly) of shape [batch_size]
-                logits: 2D tensor (sighs intensify) of shape [batch_size, state_size].
-            """
-            logits, targets = args
-            with tf.name_scope("compute_sampled_logits", [weights, biases, logits, targets]):
-                targets = tf.cast(targets, tf.int64)
-                sampled_values = tf.nn.log_uniform_candidate_sampler(
-                    true_classes=tf.expand_dims(targets, -1),
-                    num_true=1,
-                    num_sampled=num_samples,
-                    unique=True,
-                    range_max=vocab_size)
-                S, Q_true, Q_samp = (tf.stop_gradient(s) for s in sampled_values)
-
-                # Get concatenated 1D tensor of shape [batch_size * None + num_samples],
-                all_ids = tf.concat([targets, S], 0)
-                _W = tf.nn.embedding_lookup(weights, all_ids, partition_strategy='div')
-                _b = tf.nn.embedding_lookup(biases, all_ids)
-
-                W = {'targets': tf.slice(_W, begin=[0, 0], size=[batch_size, state_size]),
-                     'samples': tf.slice(_W, begin=[batch_size, 0], size=[num_samples, state_size])}
-                b = {'targets': tf.slice(_b, begin=[0], size=[batch_size]),
-                     'samples': tf.slice(_b, begin=[batch_size], size=[num_samples])}
-
-                true_logits  = tf.reduce_sum(tf.multiply(logits, W['targets']), 1)
-                true_logits += b['targets'] - tf.log(Q_true)
-
-                sampled_logits  = tf.matmul(logits, W['samples'], transpose_b=True)
-                sampled_logits += b['samples'] - tf.log(Q_samp)
-
-                F = tf.concat([true_logits, sampled_logits], 1)
-                def fn(s_i): return tf.where(targets == s_i, tf.ones_like(targets), tf.zeros_like(targets))
-                sample_labels = tf.transpose(tf.map_fn(fn, S))
-                out_targets = tf.concat([tf.ones_like(true_logits, dtype=tf.int64), sample_labels], 1)
-            return tf.losses.softmax_cross_entropy(out_targets, logits=F)
-
-        return tf.reduce_mean(tf.map_fn(sampled_loss_single_timestep,
-                                        (time_major_outputs, time_major_labels),
-                                        dtype=tf.float32))
+        targets, logits, weights = _flatten_time(labels, logits, weights)
+        W, b = output_projection
+
+        with tf.name_scope("compute_sampled_logits", [W, b, logits, targets]):
+            sampled_values = tf.nn.log_uniform_candidate_sampler(
+                true_classes=tf.expand_dims(targets, -1),
+                num_true=1,
+                num_sampled=num_samples,
+                unique=True,
+                range_max=vocab_size)
+            S, Q_true, Q_samp = (tf.stop_gradient(s) for s in sampled_values)
+
+            # True logits: [batch_size * None].
+            W_t = tf.transpose(W)
+            true_logits  = tf.reduce_sum(
+                tf.multiply(logits, tf.gather(W_t, targets)), 1)
+            true_logits += tf.gather(b, targets) - tf.log(tf.squeeze(Q_true, 1))
+
+            # Sampled logits: [batch_size * None, num_samples].
+            sampled_logits  = tf.matmul(logits, tf.gather(W_t, S), transpose_b=True)
+            sampled_logits += tf.gather(b, S) - tf.log(Q_samp)
+
+            # Remove 'accidental hits': samples equal to the true target.
+            hits = tf.equal(tf.expand_dims(targets, 1), tf.expand_dims(S, 0))
+            sampled_logits += tf.to_float(hits) * -1e9
+
+            F = tf.concat([tf.expand_dims(true_logits, 1), sampled_logits], 1)
+        # The true class is always at index 0 of F.
+        losses = tf.nn.sparse_softmax_cross_entropy_with_logits(
+            labels=tf.zeros_like(targets), logits=F)
+        return tf.losses.compute_weighted_loss(losses, weights)
 
 
 def cross_entropy_sequence_loss(logits, labels, weights):
@@ -162,6 +154,34 @@ def cross_entropy_sequence_loss(logits, labels, weights):
         return tf.reduce_sum(losses) / tf.reduce_sum(weights)
 
 
+def tile_beams(tensor, beam_width):
+    """Repeats each batch element of tensor beam_width times, in place.
+
+    Args:
+        tensor: Tensor of shape [batch_size, ...].
+        beam_width: number of copies of each batch element.
+
+    Returns:
+        Tensor of shape [batch_size * beam_width, ...], where rows
+        i * beam_width to (i + 1) * beam_width - 1 are copies of row i.
+    """
+    with tf.name_scope('tile_beams', values=[tensor]):
+        tensor = tf.convert_to_tensor(tensor)
+        multiples = tf.concat([[1, beam_width],
+                               tf.ones([tf.rank(tensor) - 1], tf.int32)], 0)
+        tiled = tf.tile(tf.expand_dims(tensor, 1), multiples)
+        shape = tf.concat([[-1], tf.shape(tensor)[1:]], 0)
+        tiled = tf.reshape(tiled, shape)
+        tiled.set_shape([None] + tensor.get_shape().as_list()[1:])
+    return tiled
+
+
+def length_penalty(lengths, alpha):
+    """Length penalty of Wu et al., 2016 (GNMT): ((5 + |Y|) / 6) ** alpha.
+    Beam scores are divided by it, so alpha > 0 favors longer responses."""
+    return tf.pow((5. + tf.to_float(lengths)) / 6., alpha)
+
+
 def dot_prod(x, y):
     return tf.reduce_sum(tf.multiply(x, y))
 
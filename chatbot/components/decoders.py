@@ -1,6 +1,7 @@
 import logging
 import tensorflow as tf
 import sys
+from tensorflow.python.util import nest
 
 # Required due to TensorFlow's unreliable naming across versions . . .
 try:
@@ -13,8 +14,10 @@ except ImportError:
 
 from tensorflow.contrib.seq2seq import BahdanauAttention, LuongAttention
 from tensorflow.contrib.rnn import LSTMStateTuple, LSTMCell
+from chatbot.components import bot_ops
 from chatbot.components.base._rnn import RNN, SimpleAttentionWrapper
 from utils import io_utils
+from utils.numpy_bot import GREEDY_TEMPERATURE
 
 
 class Decoder(RNN):
@@ -33,7 +36,10 @@ class Decoder(RNN):
                  num_layers,
                  temperature,
                  max_seq_len,
-                 state_wrapper=None):
+                 beam_width=1,
+                 length_penalty=0.0,
+                 state_wrapper=None,
+                 encoder_sequence_length=None):
         """
         Args:
             base_cell: (str) name of RNNCell class for underlying cell.
@@ -49,11 +55,21 @@ class Decoder(RNN):
                     outputs, interpreting the softmax outputs as from a
                     multinomial (probability) distribution.
                   - t -> inf: outputs approach uniform random distribution.
+            max_seq_len: maximum length of responses when chatting.
+            beam_width: number of hypotheses kept by beam search when
+                chatting. If 1, responses are sampled greedily (according
+                to temperature) instead.
+            length_penalty: (float) alpha of the beam search length penalty.
+                0 ranks hypotheses by log probability alone; larger values
+                favor longer responses.
             state_wrapper: allow states to store their wrapper class. See the
                 wrapper method docstring below for more info.
+            encoder_sequence_length: (optional) Tensor with shape [batch_size]
+                of the true length of each sequence in encoder_outputs.
         """
 
         self.encoder_outputs = encoder_outputs
+        self.encoder_sequence_length = encoder_sequence_length
         if state_wrapper is None and base_cell == 'LSTMCell':
             state_wrapper = LSTMStateTuple
 
@@ -68,6 +84,8 @@ class Decoder(RNN):
         self.temperature = temperature
         self.vocab_size = vocab_size
         self.max_seq_len = max_seq_len
+        self.beam_width = beam_width
+        self.length_penalty = length_penalty
         with tf.variable_scope('projection_tensors'):
             w = tf.get_variable(
                 name="w",
@@ -86,7 +104,8 @@ class Decoder(RNN):
                  is_chatting,
                  loop_embedder,
                  cell,
-                 initial_state=None):
+                 initial_state=None,
+                 sequence_length=None):
         """Run the inputs on the decoder.
 
         If we are chatting, then conduct dynamic sampling, which is the process
@@ -103,6 +122,10 @@ class Decoder(RNN):
             loop_embedder: required if is_chatting==True.
                            Embedder instance needed to feed decoder outputs
                            as next inputs.
+            sequence_length: (optional) Tensor with shape [batch_size] of the
+                true length of each sequence in inputs. Only used for
+                training: the cell is not run on padding, and outputs there
+                are zero. Ignored when chatting.
 
         Returns:
             outputs: if not chatting, tensor of shape
@@ -112,51 +135,93 @@ class Decoder(RNN):
                 [batch_size, state_size]. Otherwise, None.
         """
 
-        self.rnn = tf.make_template('decoder_rnn',
-                                    tf.nn.dynamic_rnn,
-                                    cell=cell,
-                                    dtype=tf.float32)
-
-        outputs, state = self.rnn(inputs=inputs,
-                                  initial_state=initial_state)
+        def run_cell(inputs, initial_state, sequence_length=None,
+                     single_step=False):
+            """Runs cell over inputs [batch_size, max_time, embed_size] with
+            dynamic_rnn or, if single_step, once on inputs [batch_size,
+            embed_size]. Calling the cell in the same 'rnn' scope as
+            dynamic_rnn does means both share the same variables."""
+            if single_step:
+                with tf.variable_scope('rnn'):
+                    return cell(inputs, initial_state)
+            return tf.nn.dynamic_rnn(cell, inputs,
+                                     initial_state=initial_state,
+                                     sequence_length=sequence_length,
+                                     dtype=tf.float32)
+
+        self.rnn = tf.make_template('decoder_rnn', run_cell)
 
         if not is_chatting:
-            return outputs, state
+            return self.rnn(inputs=inputs,
+                            initial_state=initial_state,
+                            sequence_length=sequence_length)
 
         if loop_embedder is None:
             raise ValueError(
                 "Loop function required to feed outputs as inputs.")
 
-        def body(response, state):
-            """Input callable for tf.while_loop. See below."""
-            tf.get_variable_scope().reuse_variables()
-            decoder_input = loop_embedder(tf.reshape(response[-1], (1, 1)),
-                                          reuse=True)
+        use_beams = self.beam_width > 1
+        if use_beams:
+            # Decode all beams of all sentences as one larger batch.
+            inputs = bot_ops.tile_beams(inputs, self.beam_width)
+            if initial_state is not None:
+                initial_state = nest.map_structure(
+                    lambda s: bot_ops.tile_beams(s, self.beam_width),
+                    initial_state)
+
+        # When chatting, inputs only hold the (embedded) GO_ID of each row.
+        inputs = inputs[:, 0, :]
+        if initial_state is None:
+            initial_state = cell.zero_state(tf.shape(inputs)[0], tf.float32)
+
+        if use_beams:
+            return self.beam_search(
+                inputs, initial_state, loop_embedder, cell), None
+        return self.greedy_decode(
+            inputs, initial_state, loop_embedder, cell), None
+
+    def greedy_decode(self, inputs, state, loop_embedder, cell):
+        """Decodes responses one token at a time, each sampled (according
+        to temperature) from the projected output of a single cell step.
 
-            outputs, state = self.rnn(inputs=decoder_input,
-                                      initial_state=state,
-                                      sequence_length=[1])
+        Args:
+            inputs: embedded GO_ID inputs, of shape [batch_size, embed_size].
+            state: decoder state to start from.
+            loop_embedder: Embedder instance needed to feed decoder outputs
+                as next inputs.
+            cell: the decoder cell, for the while_loop shape invariants.
+
+        Returns:
+            Tensor of shape [batch_size, max_time] with the response IDs,
+            padded with PAD_ID after EOS_ID.
+        """
 
-            next_id = self.sample(self.apply_projection(outputs))
-            response = tf.concat([response, tf.stack([next_id])], axis=0)
-            return response, state
+        # Responses have at most max_seq_len + 1 tokens (EOS_ID included).
+        max_steps = self.max_seq_len + 1
+        pad_ids = tf.fill([tf.shape(inputs)[0]], tf.to_int64(io_utils.PAD_ID))
 
-        def cond(response, s):
+        def body(time, inputs, state, finished, response):
+            """Input callable for tf.while_loop. See below."""
+            outputs, state = self.rnn(inputs=inputs,
+                                      initial_state=state,
+                                      single_step=True)
+            next_ids = self.sample(tf.nn.xw_plus_b(outputs, *self._projection))
+            # Sequences that already emitted EOS are padded from then on.
+            next_ids = tf.where(finished, pad_ids, next_ids)
+            finished = tf.logical_or(finished,
+                                     tf.equal(next_ids, io_utils.EOS_ID))
+            response = response.write(time, next_ids)
+            # Reuse the embeddings of the inputs (only after the first call
+            # of self.rnn, which creates the cell variables).
+            tf.get_variable_scope().reuse_variables()
+            inputs = loop_embedder(tf.expand_dims(next_ids, 1), reuse=True)
+            return time + 1, inputs[:, 0, :], state, finished, response
+
+        def cond(time, inputs, state, finished, response):
             """Input callable for tf.while_loop. See below."""
             return tf.logical_and(
-                tf.not_equal(response[-1], io_utils.EOS_ID),
-                tf.less_equal(tf.size(response), self.max_seq_len))
-
-        # Project to full output state during inference time.
-        # Note: "outputs" at this point, at this exact line, is technically just
-        # a single output: the bot's first response token.
-        outputs = self.apply_projection(outputs)
-        # Begin the process of building the list of output tokens.
-        response = tf.stack([self.sample(outputs)])
-        # Reshape is needed so the while_loop ahead knows the shape of response.
-        # The comma after the 1 is intentional, it forces tf to believe us.
-        response = tf.reshape(response, [1,], name='response')
-        tf.get_variable_scope().reuse_variables()
+                tf.logical_not(tf.reduce_all(finished)),
+                tf.less(time, max_steps))
 
         # ============== BEHOLD: The tensorflow while loop. ==================
         # This allows us to sample dynamically. It also makes me happy!
@@ -165,14 +230,156 @@ class Decoder(RNN):
         # -- 'body': callable returning a tuple of tensors of same
         #            arity as loop_vars.
         # -- 'loop_vars': tuple of tensors that is passed to 'cond' and 'body'.
-        response, _ = tf.while_loop(
-            cond, body, (response, state),
-            shape_invariants=(tf.TensorShape([None]), cell.shape),
-            back_prop=False)
-        # =============== FAREWELL: The tensorflow while loop. =================
+        # Each step writes its [batch_size] token IDs to the time'th element
+        # of the preallocated response TensorArray.
+        with tf.name_scope('greedy_decode'):
+            time, _, _, _, response = tf.while_loop(
+                cond, body,
+                (tf.constant(0),
+                 inputs,
+                 state,
+                 tf.zeros(tf.shape(pad_ids), tf.bool),
+                 tf.TensorArray(tf.int64, size=max_steps)),
+                shape_invariants=(tf.TensorShape([]),
+                                  tf.TensorShape([None, self.embed_size]),
+                                  cell.shape,
+                                  tf.TensorShape([None]),
+                                  tf.TensorShape(None)),
+                back_prop=False)
+            # =============== FAREWELL: The tensorflow while loop. =============
+            return tf.transpose(response.gather(tf.range(time)), name='response')
+
+    def beam_search(self, inputs, state, loop_embedder, cell):
+        """Decodes responses with beam search, keeping beam_width hypotheses
+        (beams) per input sentence.
+
+        All tensors hold the beams of a batch as [batch_size * beam_width]
+        rows, so each step extends every beam of every sentence at once.
+        Each step only records the selected words and the rows (beams) they
+        extend; the responses are traced back from the best beams at the end.
 
-        outputs = tf.expand_dims(response, 0)
-        return outputs, None
+        Args:
+            inputs: embedded GO_ID inputs, of shape
+                [batch_size * beam_width, embed_size].
+            state: decoder state to start from.
+            loop_embedder: Embedder instance needed to feed decoder outputs
+                as next inputs.
+            cell: the decoder cell, for the while_loop shape invariants.
+
+        Returns:
+            Tensor of shape [batch_size, max_time] with the response IDs of
+            the best beam of each sentence, padded with PAD_ID after EOS_ID.
+        """
+
+        beam_width = self.beam_width
+        vocab_size = self.vocab_size
+        max_steps = self.max_seq_len + 1
+        batch_size = tf.shape(inputs)[0] // beam_width
+        # Offset of the first beam of each sentence in the flattened rows.
+        batch_offsets = tf.expand_dims(tf.range(batch_size) * beam_width, 1)
+        # Finished beams can only be extended with PAD_ID, at no cost.
+        pad_only = tf.one_hot(io_utils.PAD_ID, vocab_size,
+                              on_value=0., off_value=-1e9)
+
+        def gather_rows(tensor, rows):
+            # Scalars (e.g. the time of an AttentionWrapperState) are shared.
+            if tensor.get_shape().ndims == 0:
+                return tensor
+            return tf.gather(tensor, rows)
+
+        def body(time, inputs, state, scores, finished, lengths,
+                 word_ids_array, rows_array):
+            """Extends each beam by each word, and keeps the best beam_width
+            extensions of each sentence."""
+            outputs, state = self.rnn(inputs=inputs,
+                                      initial_state=state,
+                                      single_step=True)
+            log_probs = tf.nn.log_softmax(
+                tf.nn.xw_plus_b(outputs, *self._projection))
+            done = tf.expand_dims(tf.to_float(finished), 1)
+            log_probs = (1. - done) * log_probs + done * pad_only
+
+            # Scores of all extensions: [batch_size * beam_width, vocab_size].
+            total = tf.expand_dims(scores, 1) + log_probs
+            lengths += tf.to_int32(tf.logical_not(finished))
+            normalized = total / tf.expand_dims(
+                bot_ops.length_penalty(lengths, self.length_penalty), 1)
+            _, top_ids = tf.nn.top_k(
+                tf.reshape(normalized, [batch_size, beam_width * vocab_size]),
+                k=beam_width)
+
+            # Row (beam) each selected extension comes from, and its word.
+            rows = tf.reshape(top_ids // vocab_size + batch_offsets, [-1])
+            word_ids = tf.reshape(top_ids % vocab_size, [-1])
+
+            scores = tf.gather(tf.reshape(total, [-1]), rows * vocab_size + word_ids)
+            state = nest.map_structure(lambda s: gather_rows(s, rows), state)
+            word_ids = tf.to_int64(word_ids)
+            finished = tf.logical_or(tf.gather(finished, rows),
+                                     tf.equal(word_ids, io_utils.EOS_ID))
+            lengths = tf.gather(lengths, rows)
+            word_ids_array = word_ids_array.write(time, word_ids)
+            rows_array = rows_array.write(time, rows)
+            tf.get_variable_scope().reuse_variables()
+            inputs = loop_embedder(tf.expand_dims(word_ids, 1), reuse=True)
+            return (time + 1, inputs[:, 0, :], state, scores, finished,
+                    lengths, word_ids_array, rows_array)
+
+        def cond(time, inputs, state, scores, finished, *_):
+            """Input callable for tf.while_loop."""
+            return tf.logical_and(
+                tf.logical_not(tf.reduce_all(finished)),
+                tf.less(time, max_steps))
+
+        def trace_back(time, rows, response):
+            """Input callable for tf.while_loop: prepends the words of rows
+            to response, and moves rows to the beams they extended."""
+            time -= 1
+            response = response.write(
+                time, tf.gather(word_ids_array.read(time), rows))
+            return time, tf.gather(rows_array.read(time), rows), response
+
+        with tf.name_scope('beam_search'):
+            num_rows = batch_size * beam_width
+            # All beams of a sentence start out identical, so only the first
+            # is allowed to be extended at the first step.
+            scores = tf.tile(
+                tf.concat([[0.], tf.fill([beam_width - 1], -1e9)], 0),
+                [batch_size])
+
+            num_steps, _, _, scores, _, lengths, word_ids_array, rows_array = \
+                tf.while_loop(
+                    cond, body,
+                    (tf.constant(0),
+                     inputs,
+                     state,
+                     scores,
+                     tf.zeros([num_rows], tf.bool),
+                     tf.zeros([num_rows], tf.int32),
+                     tf.TensorArray(tf.int64, size=max_steps),
+                     tf.TensorArray(tf.int32, size=max_steps)),
+                    shape_invariants=(tf.TensorShape([]),
+                                      tf.TensorShape([None, self.embed_size]),
+                                      cell.shape,
+                                      tf.TensorShape([None]),
+                                      tf.TensorShape([None]),
+                                      tf.TensorShape([None]),
+                                      tf.TensorShape(None),
+                                      tf.TensorShape(None)),
+                    back_prop=False)
+
+            # Pick the beam with the best length-normalized score.
+            normalized = scores / bot_ops.length_penalty(lengths, self.length_penalty)
+            best = tf.to_int32(tf.argmax(
+                tf.reshape(normalized, [batch_size, beam_width]), axis=1))
+
+            _, _, response = tf.while_loop(
+                lambda time, *_: time > 0, trace_back,
+                (num_steps,
+                 best + batch_offsets[:, 0],
+                 tf.TensorArray(tf.int64, size=num_steps)),
+                back_prop=False)
+            return tf.transpose(response.stack())
 
     def apply_projection(self, outputs, scope=None):
         """Defines & applies the affine transformation from state space
@@ -189,47 +396,32 @@ class Decoder(RNN):
         """
 
         with tf.variable_scope(scope, "proj_scope", [outputs]):
-
-            # Swap 1st and 2nd indices to match expected input of map_fn.
+            w, b = self._projection
             seq_len = tf.shape(outputs)[1]
             st_size = tf.shape(outputs)[2]
-            time_major_outputs = tf.reshape(outputs, [seq_len, -1, st_size])
-
-            # Project batch at single timestep from state space to output space.
-            def proj_op(batch):
-                return tf.matmul(batch, self._projection[0]) + self._projection[1]
-
-            # Get projected output states;
-            # 3D Tensor with shape [batch_size, seq_len, ouput_size].
-            projected_state = tf.map_fn(proj_op, time_major_outputs)
+            # Project all [batch_size * seq_len] outputs with a single matmul.
+            projected_state = tf.nn.xw_plus_b(
+                tf.reshape(outputs, [-1, st_size]), w, b)
         return tf.reshape(projected_state, [-1, seq_len, self.vocab_size])
 
-    def sample(self, projected_output):
-        """Return integer ID tensor representing the sampled word.
+    def sample(self, logits):
+        """Return integer ID tensor representing the sampled words.
         
         Args:
-            projected_output: Tensor [1, 1, state_size], representing a single
-                decoder timestep output. 
+            logits: Tensor [batch_size, vocab_size] of the projected output
+                of a single decoding step.
+
+        Returns:
+            Tensor of shape [batch_size] with one sampled word ID per sequence.
         """
-        # TODO: We really need a tf.control_dependencies check here (for rank).
-        with tf.name_scope('decoder_sampler', values=[projected_output]):
-
-            # Protect against extra size-1 dimensions; grab the 1D tensor
-            # of size state_size.
-            logits = tf.squeeze(projected_output)
-            if self.temperature < 0.02:
-                return tf.argmax(logits, axis=0)
-
-            # Convert logits to probability distribution.
-            probabilities = tf.div(logits, self.temperature)
-            projected_output = tf.div(
-                tf.exp(probabilities),
-                tf.reduce_sum(tf.exp(probabilities), axis=-1))
-
-            # Sample 1 time from the probability distribution.
-            sample_ID = tf.squeeze(
-                tf.multinomial(tf.expand_dims(probabilities, 0), 1))
-        return sample_ID
+        with tf.name_scope('decoder_sampler', values=[logits]):
+
+            if self.temperature < GREEDY_TEMPERATURE:
+                return tf.argmax(logits, axis=-1)
+
+            # Sample 1 time from each probability distribution over outputs.
+            return tf.squeeze(
+                tf.multinomial(tf.div(logits, self.temperature), 1), axis=1)
 
     def get_projection_tensors(self):
         """Returns the tuple (w, b) that decoder uses for projecting.
@@ -246,14 +438,16 @@ class BasicDecoder(Decoder):
                  initial_state=None,
                  is_chatting=False,
                  loop_embedder=None,
-                 cell=None):
+                 cell=None,
+                 sequence_length=None):
 
         return super(BasicDecoder, self).__call__(
             inputs=inputs,
             initial_state=initial_state,
             is_chatting=is_chatting,
             loop_embedder=loop_embedder,
-            cell=self.get_cell('decoder_cell'))
+            cell=self.get_cell('decoder_cell'),
+            sequence_length=sequence_length)
 
 
 class AttentionDecoder(Decoder):
@@ -276,10 +470,16 @@ class AttentionDecoder(Decoder):
                  dropout_prob=1.0,
                  num_layers=2,
                  temperature=0.0,
-                 max_seq_len=50):
+                 max_seq_len=50,
+                 beam_width=1,
+                 length_penalty=0.0,
+                 encoder_sequence_length=None):
         """We need to explicitly call the constructor now, so we can:
            - Specify we need the state wrapped in AttentionWrapperState.
            - Specify our attention mechanism (will allow customization soon).
+
+        If encoder_sequence_length is given, the padding of encoder_outputs
+        is masked out of the attention.
         """
 
         super(AttentionDecoder, self).__init__(
@@ -292,11 +492,23 @@ class AttentionDecoder(Decoder):
             num_layers=num_layers,
             temperature=temperature,
             max_seq_len=max_seq_len,
-            state_wrapper=AttentionWrapperState)
-
+            beam_width=beam_width,
+            length_penalty=length_penalty,
+            state_wrapper=AttentionWrapperState,
+            encoder_sequence_length=encoder_sequence_length)
+
+        # Each beam attends over its own copy of the encoder outputs.
+        if beam_width > 1:
+            encoder_outputs = bot_ops.tile_beams(encoder_outputs, beam_width)
+            if encoder_sequence_length is not None:
+                encoder_sequence_length = bot_ops.tile_beams(
+                    encoder_sequence_length, beam_width)
+        self.memory_sequence_length = encoder_sequence_length
         _mechanism = getattr(tf.contrib.seq2seq, attention_mechanism)
-        self.attention_mechanism = _mechanism(num_units=state_size,
-                                              memory=encoder_outputs)
+        self.attention_mechanism = _mechanism(
+            num_units=state_size,
+            memory=encoder_outputs,
+            memory_sequence_length=encoder_sequence_length)
         self.output_attention = True
 
     def __call__(self,
@@ -304,7 +516,8 @@ class AttentionDecoder(Decoder):
                  initial_state=None,
                  is_chatting=False,
                  loop_embedder=None,
-                 cell=None):
+                 cell=None,
+                 sequence_length=None):
         """
         The only modifcation to the superclass is we pass in our own
         cell that is wrapped with a custom attention class (specified in
@@ -314,13 +527,18 @@ class AttentionDecoder(Decoder):
         """
 
         if cell is None:
+            if is_chatting and self.beam_width > 1 and initial_state is not None:
+                initial_state = nest.map_structure(
+                    lambda s: bot_ops.tile_beams(s, self.beam_width),
+                    initial_state)
             cell = self.get_cell('attn_cell', initial_state)
 
         return super(AttentionDecoder, self).__call__(
             inputs=inputs,
             is_chatting=is_chatting,
             loop_embedder=loop_embedder,
-            cell=cell)
+            cell=cell,
+            sequence_length=sequence_length)
 
     def get_cell(self, name, initial_state):
         # Get the simple underlying cell first.
@@ -329,6 +547,7 @@ class AttentionDecoder(Decoder):
         return SimpleAttentionWrapper(
             cell=cell,
             attention_mechanism=self.attention_mechanism,
-            initial_cell_state=initial_state)
+            initial_cell_state=initial_state,
+            memory_sequence_length=self.memory_sequence_length)
 
 
@@ -12,13 +12,17 @@ class BasicEncoder(RNN):
     inside dynamic_rnn.
     """
 
-    def __call__(self, inputs, initial_state=None):
+    def __call__(self, inputs, initial_state=None, sequence_length=None):
         """Run the inputs on the encoder and return the output(s).
 
         Args:
             inputs: Tensor with shape [batch_size, max_time, embed_size].
             initial_state: (optional) Tensor with shape [batch_size, state_size] 
                 to initialize decoder cell.
+            sequence_length: (optional) Tensor with shape [batch_size] of the
+                true (unpadded) length of each input. The cell is not run on
+                padding: outputs there are zero and the state is the one at
+                the last true timestep.
 
         Returns:
             outputs: (only if return_sequence is True)
@@ -30,6 +34,7 @@ class BasicEncoder(RNN):
         _, state = tf.nn.dynamic_rnn(cell,
                                      inputs,
                                      initial_state=initial_state,
+                                     sequence_length=sequence_length,
                                      dtype=tf.float32)
         return _, state
 
@@ -43,11 +48,15 @@ class BidirectionalEncoder(RNN):
     between encoder/decoder.
     """
 
-    def __call__(self, inputs, initial_state=None):
+    def __call__(self, inputs, initial_state=None, sequence_length=None):
         """Run the inputs on the encoder and return the output(s).
 
         Args:
             inputs: Tensor with shape [batch_size, max_time, embed_size].
+            sequence_length: (optional) Tensor with shape [batch_size] of the
+                true (unpadded) length of each input. Besides skipping the
+                padding, this makes the backward cell start at the last true
+                token of each input rather than at its padding.
 
         Returns:
             outputs: Tensor of shape [batch_size, max_time, state_size].
@@ -60,6 +69,7 @@ class BidirectionalEncoder(RNN):
             cell_fw=cell_fw,
             cell_bw=cell_bw,
             inputs=inputs,
+            sequence_length=sequence_length,
             dtype=tf.float32)
 
         # Create fully connected layer to help get us back to
@@ -7,6 +7,8 @@ LENGTHS = {'encoder_sequence_length': tf.FixedLenFeature([], dtype=tf.int64),
            'decoder_sequence_length': tf.FixedLenFeature([], dtype=tf.int64)}
 SEQUENCES = {'encoder_sequence': tf.FixedLenSequenceFeature([], dtype=tf.int64),
              'decoder_sequence': tf.FixedLenSequenceFeature([], dtype=tf.int64)}
+# Number of threads enqueuing examples into the shuffle queue.
+NUM_THREADS = 4
 
 
 class InputPipeline:
@@ -19,24 +21,34 @@ class InputPipeline:
             3. Organize sequences into buckets of similar lengths, pad, and batch.
     """
 
-    def __init__(self, file_paths, batch_size, capacity=None, is_chatting=False, scope=None):
+    def __init__(self, file_paths, batch_size, capacity=None, is_chatting=False,
+                 scope=None, bucket_boundaries=None, num_threads=NUM_THREADS):
         """
         Args:
             file_paths: (dict) returned by instance of Dataset via Dataset.paths.
             batch_size: number of examples returned by dequeue op.
             capacity: maximum number of examples allowed in the input queue at a time.
             is_chatting: (bool) determines whether we're feeding user input or file inputs.
+            bucket_boundaries: upper length boundaries of the buckets, usually
+                Dataset.bucket_boundaries. Defaults to [8, 16, 32].
+            num_threads: number of threads reading and enqueuing examples.
         """
         with tf.name_scope(scope, 'input_pipeline') as scope:
             if capacity is None:
                 self.capacity = max(50 * batch_size, int(1e4))
                 logging.info("Input capacity set to %d examples." % self.capacity)
+            else:
+                self.capacity = capacity
             self.batch_size = batch_size
+            self.num_threads = num_threads
+            if bucket_boundaries is None:
+                bucket_boundaries = [8, 16, 32]
+            self.bucket_boundaries = bucket_boundaries
             self.paths = file_paths
             self.control = {'train': 0, 'valid': 1}
             self.active_data = tf.convert_to_tensor(self.control['train'])
             self.is_chatting = is_chatting
-            self._user_input = tf.placeholder(tf.int32, [1, None], name='user_input')
+            self._user_input = tf.placeholder(tf.int32, [None, None], name='user_input')
             self._feed_dict = None
             self._scope = scope
 
@@ -44,6 +56,10 @@ class InputPipeline:
                 # Create tensors that will store input batches at runtime.
                 self._train_lengths, self.train_batches = self.build_pipeline('train')
                 self._valid_lengths, self.valid_batches = self.build_pipeline('valid')
+            # Number of elements in each queue of the pipeline, for monitoring.
+            self.queue_sizes = {
+                qr.name: qr.queue.size()
+                for qr in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS, scope)}
 
     def build_pipeline(self, name):
         """Creates a new input subgraph composed of the following components:
@@ -63,12 +79,13 @@ class InputPipeline:
                 Supports keys in SEQUENCES.
         """
         with tf.variable_scope(name + '_pipeline'):
-            proto_text = self._read_line(self.paths[name + '_tfrecords'])
-            context_pair, sequence_pair = self._assign_queue(proto_text)
+            proto_texts = self._read_line(self.paths[name + '_tfrecords'])
+            context_pair, sequence_pair = self._assign_queue(proto_texts)
             input_length = tf.add(context_pair['encoder_sequence_length'],
                                   context_pair['decoder_sequence_length'],
                                   name=name + 'length_add')
-            return self._padded_bucket_batches(input_length, sequence_pair)
+            return self._padded_bucket_batches(input_length, context_pair,
+                                               sequence_pair)
 
     @property
     def encoder_inputs(self):
@@ -87,7 +104,30 @@ class InputPipeline:
             return self._cond_input('decoder')
         else:
             # In a chat session, we just give the bot the go-ahead to respond!
-            return tf.convert_to_tensor([[io_utils.GO_ID]])
+            # One GO_ID per input sentence, so we can respond to many at once.
+            return tf.fill([tf.shape(self._user_input)[0], 1], io_utils.GO_ID)
+
+    @property
+    def encoder_sequence_length(self):
+        """Tensor of shape [batch_size]: the true (unpadded) length of each
+        sequence in encoder_inputs. When chatting, this is the number of
+        non-PAD tokens of each user input."""
+        if not self.is_chatting:
+            return self._cond_length('encoder')
+        else:
+            return tf.reduce_sum(
+                tf.to_int32(tf.not_equal(self._user_input, io_utils.PAD_ID)),
+                axis=1, name='user_input_length')
+
+    @property
+    def decoder_sequence_length(self):
+        """Tensor of shape [batch_size]: the true (unpadded) length of each
+        sequence in decoder_inputs. None when chatting, since the decoder
+        then generates its own inputs."""
+        if not self.is_chatting:
+            return self._cond_length('decoder')
+        else:
+            return None
 
     @property
     def user_input(self):
@@ -115,22 +155,42 @@ class InputPipeline:
             return tf.cond(tf.equal(self.active_data, self.control['train']),
                            train, valid, name=prefix + '_cond_input')
 
-    def _read_line(self, file):
+    def _cond_length(self, prefix):
+        with tf.name_scope(self._scope):
+            key = prefix + '_sequence_length'
+            def train(): return tf.to_int32(self._train_lengths[key])
+            def valid(): return tf.to_int32(self._valid_lengths[key])
+            return tf.cond(tf.equal(self.active_data, self.control['train']),
+                           train, valid, name=prefix + '_cond_length')
+
+    def _read_line(self, files):
         """Create ops for extracting lines from files.
 
+        Args:
+            files: path to a tfrecords file, or list of paths to tfrecords
+                shards (see Dataset.convert_to_tf_records). Shards are read
+                in parallel by up to num_threads readers.
+
         Returns:
-            Tensor that will contain the lines at runtime.
+            List of tensors (one per reader) that will contain the lines at
+            runtime.
         """
+        if not isinstance(files, (list, tuple)):
+            files = [files]
         with tf.variable_scope('reader'):
-            filename_queue = tf.train.string_input_producer([file])
-            reader = tf.TFRecordReader(name='tfrecord_reader')
-            _, next_raw = reader.read(filename_queue, name='read_records')
-        return next_raw
+            filename_queue = tf.train.string_input_producer(files)
+            raw_records = []
+            for i in range(min(len(files), self.num_threads)):
+                reader = tf.TFRecordReader(name='tfrecord_reader_%d' % i)
+                _, next_raw = reader.read(filename_queue, name='read_records_%d' % i)
+                raw_records.append(next_raw)
+        return raw_records
 
-    def _assign_queue(self, proto_text):
+    def _assign_queue(self, proto_texts):
         """
         Args:
-            proto_text: object to be enqueued and managed by parallel threads.
+            proto_texts: list of objects to be enqueued and managed by
+                parallel threads.
         """
 
         with tf.variable_scope('shuffle_queue'):
@@ -139,10 +199,14 @@ class InputPipeline:
                 min_after_dequeue=10*self.batch_size,
                 dtypes=tf.string, shapes=[()])
 
-            enqueue_op = queue.enqueue(proto_text)
+            # Spread the enqueuing threads evenly across the readers.
+            enqueue_ops = [queue.enqueue(proto_texts[i % len(proto_texts)])
+                           for i in range(self.num_threads)]
             example_dq = queue.dequeue()
+            tf.summary.scalar('fraction_of_%d_full' % self.capacity,
+                              tf.to_float(queue.size()) / self.capacity)
 
-            qr = tf.train.QueueRunner(queue, [enqueue_op] * 4)
+            qr = tf.train.QueueRunner(queue, enqueue_ops)
             tf.train.add_queue_runner(qr)
 
             _sequence_lengths, _sequences = tf.parse_single_sequence_example(
@@ -151,14 +215,104 @@ class InputPipeline:
                 sequence_features=SEQUENCES)
         return _sequence_lengths, _sequences
 
-    def _padded_bucket_batches(self, input_length, data):
+    def _padded_bucket_batches(self, input_length, lengths, sequences):
+        """Batches the lengths along with their sequences, so that each batch
+        keeps the true length of its padded sequences."""
         with tf.variable_scope('bucket_batch'):
-            lengths, sequences = bucket_by_sequence_length(
+            tensors = dict(lengths)
+            tensors.update(sequences)
+            _, batches = bucket_by_sequence_length(
                 input_length=tf.to_int32(input_length),
-                tensors=data,
+                tensors=tensors,
                 batch_size=self.batch_size,
-                bucket_boundaries=[8, 16, 32],
+                bucket_boundaries=self.bucket_boundaries,
                 capacity=self.capacity,
                 dynamic_pad=True)
-        return lengths, sequences
+        return ({k: batches[k] for k in LENGTHS},
+                {k: batches[k] for k in SEQUENCES})
+
+
+def input_wait_time(run_metadata):
+    """Returns the time, in seconds, that a traced step spent waiting on input.
+
+    This is the duration of the longest dequeue (or tf.data get_next) op in
+    run_metadata.step_stats. A value close to the step time means training
+    is input-bound: increase capacity/num_threads, or use DataPipeline.
+
+    Args:
+        run_metadata: tf.RunMetadata filled by a session.run call with
+            trace_level=tf.RunOptions.FULL_TRACE.
+    """
+    wait_micros = 0
+    for device_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in device_stats.node_stats:
+            label = node_stats.timeline_label
+            if 'Dequeue' in label or 'IteratorGetNext' in label:
+                wait_micros = max(wait_micros, node_stats.all_end_rel_micros)
+    return wait_micros / 1e6
+
 
+class DataPipeline(InputPipeline):
+    """InputPipeline built on tf.data instead of queue runners.
+
+    Exposes the same interface (encoder_inputs, decoder_inputs, toggle_active,
+    ...) so it can be swapped in via the 'pipeline.class' model parameter.
+
+        Overview of pipeline construction:
+            1. Interleave reads of the tfrecords shards, in parallel.
+            2. Shuffle and parse the examples with num_threads parallel calls.
+            3. Group examples by bucket and pad each group into a batch.
+            4. Prefetch batches, so training steps don't wait on input.
+    """
+
+    # Number of batches prepared in the background while the model trains.
+    PREFETCH_BATCHES = 8
+
+    def build_pipeline(self, name):
+        """Creates the tf.data input subgraph for the 'name' data.
+
+        Args:
+            name: filename prefix for data. See Dataset class for naming conventions.
+
+        Returns:
+            2-tuple (lengths, sequences), as in InputPipeline.build_pipeline.
+        """
+        files = self.paths[name + '_tfrecords']
+        if not isinstance(files, (list, tuple)):
+            files = [files]
+
+        with tf.variable_scope(name + '_pipeline'):
+            dataset = tf.data.Dataset.from_tensor_slices(files)
+            dataset = dataset.shuffle(len(files)).repeat()
+            dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+                tf.data.TFRecordDataset,
+                cycle_length=min(len(files), self.num_threads),
+                sloppy=True))
+            dataset = dataset.shuffle(self.capacity)
+            dataset = dataset.map(self._parse, num_parallel_calls=self.num_threads)
+            dataset = dataset.apply(tf.contrib.data.group_by_window(
+                key_func=self._bucket_id,
+                reduce_func=lambda _, examples: examples.padded_batch(
+                    self.batch_size,
+                    padded_shapes=({k: [] for k in LENGTHS},
+                                   {k: [None] for k in SEQUENCES})),
+                window_size=self.batch_size))
+            dataset = dataset.prefetch(self.PREFETCH_BATCHES)
+            return dataset.make_one_shot_iterator().get_next()
+
+    @staticmethod
+    def _parse(proto_text):
+        return tf.parse_single_sequence_example(
+            serialized=proto_text,
+            context_features=LENGTHS,
+            sequence_features=SEQUENCES)
+
+    def _bucket_id(self, lengths, sequences):
+        """Same bucket assignment as bucket_by_sequence_length: example is in
+        bucket i if bucket_boundaries[i-1] <= length < bucket_boundaries[i].
+        """
+        input_length = tf.add(lengths['encoder_sequence_length'],
+                              lengths['decoder_sequence_length'])
+        boundaries = tf.constant(self.bucket_boundaries, dtype=tf.int64)
+        return tf.reduce_sum(
+            tf.to_int64(tf.greater_equal(input_length, boundaries)))
@@ -12,7 +12,8 @@ import logging
 import numpy as np
 import tensorflow as tf
 from chatbot import components
-from chatbot.components import bot_ops, Embedder, InputPipeline
+from chatbot.components import bot_ops, Embedder
+from chatbot.components.input_pipeline import input_wait_time
 from chatbot._models import Model
 from utils import io_utils
 from pydoc import locate
@@ -21,9 +22,9 @@ from pydoc import locate
 class DynamicBot(Model):
     """ General sequence-to-sequence model for conversations. 
     
-    Will eventually support beam search, and a wider variety of 
-    cell options. At present, supports multi-layer encoder/decoders, 
-    GRU/LSTM cells, attention, and dynamic unrolling (online decoding included). 
+    Will eventually support a wider variety of cell options. At present,
+    supports multi-layer encoder/decoders, GRU/LSTM cells, attention, 
+    dynamic unrolling (online decoding included) and beam search decoding.
     
     Additionally, will eventually support biologically inspired mechanisms for 
     learning, such as hebbian-based update rules.
@@ -70,21 +71,29 @@ class DynamicBot(Model):
                         or getattr(components, getattr(self, 'encoder.class'))
         decoder_class = locate(getattr(self, 'decoder.class')) \
                         or getattr(components, getattr(self, 'decoder.class'))
+        pipeline_class = locate(getattr(self, 'pipeline.class')) \
+                        or getattr(components, getattr(self, 'pipeline.class'))
 
         assert encoder_class is not None, "Couldn't find requested %s." % \
                                           self.model_params['encoder.class']
         assert decoder_class is not None, "Couldn't find requested %s." % \
                                           self.model_params['decoder.class']
+        assert pipeline_class is not None, "Couldn't find requested %s." % \
+                                          self.model_params['pipeline.class']
 
         # Organize input pipeline inside single node for clean visualization.
-        self.pipeline = InputPipeline(
+        self.pipeline = pipeline_class(
             file_paths=dataset.paths,
             batch_size=self.batch_size,
-            is_chatting=self.is_chatting)
+            is_chatting=self.is_chatting,
+            bucket_boundaries=getattr(dataset, 'bucket_boundaries', None))
 
         # Grab the input feeds for encoder/decoder from the pipeline.
         encoder_inputs = self.pipeline.encoder_inputs
         self.decoder_inputs = self.pipeline.decoder_inputs
+        # True lengths of the padded inputs, so the RNNs skip the padding.
+        encoder_lengths = self.pipeline.encoder_sequence_length
+        decoder_lengths = self.pipeline.decoder_sequence_length
 
         # Create embedder object -- handles all of your embedding needs!
         # By passing scope to embedder calls, we can create distinct embeddings,
@@ -110,7 +119,8 @@ class DynamicBot(Model):
             # For now, encoders require just the RNN params when created.
             encoder = encoder_class(**rnn_params)
             # Apply embedded inputs to encoder for the final (context) state.
-            encoder_outputs, encoder_state = encoder(embedded_enc_inputs)
+            encoder_outputs, encoder_state = encoder(
+                embedded_enc_inputs, sequence_length=encoder_lengths)
 
         with tf.variable_scope("decoder"):
             embedded_dec_inputs = self.embedder(self.decoder_inputs)
@@ -119,9 +129,13 @@ class DynamicBot(Model):
                 rnn_params['attention_mechanism'] = self.attention_mechanism
             self.decoder = decoder_class(
                 encoder_outputs=encoder_outputs,
+                encoder_sequence_length=encoder_lengths,
                 vocab_size=self.vocab_size,
                 max_seq_len=dataset.max_seq_len,
                 temperature=self.temperature,
+                # Beam search only applies to chat sessions.
+                beam_width=self.beam_width if self.is_chatting else 1,
+                length_penalty=self.length_penalty,
                 **rnn_params)
 
             # For decoder outpus, we want the full sequence (output sentence),
@@ -130,7 +144,8 @@ class DynamicBot(Model):
                 embedded_dec_inputs,
                 initial_state=encoder_state,
                 is_chatting=self.is_chatting,
-                loop_embedder=self.embedder)
+                loop_embedder=self.embedder,
+                sequence_length=decoder_lengths)
 
         self.outputs = tf.identity(decoder_outputs, name='outputs')
         # Tag inputs and outputs by name should we want to freeze the model.
@@ -170,7 +185,8 @@ class DynamicBot(Model):
                         self.outputs[:, :-1, :],
                         self.decoder.get_projection_tensors(),
                         self.vocab_size,
-                        num_samples=self.num_samples) + l1
+                        num_samples=self.num_samples,
+                        weights=target_weights) + l1
                 else:
                     self.loss = tf.losses.sparse_softmax_cross_entropy(
                         labels=target_labels,
@@ -207,7 +223,7 @@ class DynamicBot(Model):
 
         super(DynamicBot, self).compile()
 
-    def step(self, forward_only=False):
+    def step(self, forward_only=False, run_metadata=None):
         """Run one step of the model, which can mean 1 of the following:
             1. forward_only == False. 
                - This means we are training.
@@ -221,6 +237,8 @@ class DynamicBot(Model):
         Args:
             forward_only: if True, don't perform backward pass 
             (gradient updates).
+            run_metadata: (optional) tf.RunMetadata. If given, the training
+            step is traced and its step stats are stored in run_metadata.
 
         Returns:
             3-tuple: (summaries, step_loss, step_outputs).
@@ -239,7 +257,11 @@ class DynamicBot(Model):
 
         if not forward_only:
             fetches = [self.merged, self.loss, self.train_op]
-            summaries, step_loss, _ = self.sess.run(fetches)
+            options = None
+            if run_metadata is not None:
+                options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            summaries, step_loss, _ = self.sess.run(
+                fetches, options=options, run_metadata=run_metadata)
             return summaries, step_loss, None
         elif self.is_chatting:
             response = self.sess.run(
@@ -277,30 +299,52 @@ class DynamicBot(Model):
 
         # Note: Calling sleep allows sustained GPU utilization across training.
         # Without it, GPU has to wait for data to be enqueued more often.
-        print('QUEUE RUNNERS RELEASED.', end=" ")
-        for _ in range(3):
-            print('.', end=" ");
-            time.sleep(1);
-            sys.stdout.flush()
-        print('GO!')
+        # Not needed by the tf.data pipeline, which has no queue runners.
+        if threads:
+            print('QUEUE RUNNERS RELEASED.', end=" ")
+            for _ in range(3):
+                print('.', end=" ");
+                time.sleep(1);
+                sys.stdout.flush()
+            print('GO!')
 
         try:
-            avg_loss = avg_step_time = 0.0
+            avg_loss = total_step_time = 0.0
+            num_timed_steps = 0
             while not coord.should_stop():
 
                 i_step = self.sess.run(self.global_step)
 
+                # Trace the last step of each checkpoint interval, to
+                # measure how long it waited on the input pipeline. Tracing
+                # slows the step down, so it isn't part of the step time.
+                run_metadata = None
+                if i_step % self.steps_per_ckpt == 0:
+                    run_metadata = tf.RunMetadata()
+
                 start_time = time.time()
-                summaries, step_loss, _ = self.step()
+                summaries, step_loss, _ = self.step(run_metadata=run_metadata)
+                step_time = time.time() - start_time
                 # Calculate running averages.
-                avg_step_time += (time.time() - start_time) / self.steps_per_ckpt
+                if run_metadata is None:
+                    total_step_time += step_time
+                    num_timed_steps += 1
                 avg_loss += step_loss / self.steps_per_ckpt
 
                 # Print updates in desired intervals (steps_per_ckpt).
                 if i_step % self.steps_per_ckpt == 0:
                     # Display averged-training updates and save.
                     print("Step %d:" % i_step, end=" ")
-                    print("step time = %.3f" % avg_step_time)
+                    print("step time = %.3f"
+                          % (total_step_time / max(num_timed_steps, 1)))
+                    # Compared with the time of the same (traced) step.
+                    print("\tinput wait = %.3f of traced step time = %.3f"
+                          % (input_wait_time(run_metadata), step_time),
+                          end="; ")
+                    queue_sizes = self.sess.run(self.pipeline.queue_sizes)
+                    print("queue sizes:", ", ".join(
+                        "%s=%d" % (name, size)
+                        for name, size in sorted(queue_sizes.items())))
                     print("\ttraining loss = %.3f" % avg_loss, end="; ")
                     print("training perplexity = %.2f" % perplexity(avg_loss))
                     self.save(summaries=summaries)
@@ -314,7 +358,8 @@ class DynamicBot(Model):
                     print("\tValidation loss = %.3f" % eval_loss, end="; ")
                     print("val perplexity = %.2f" % perplexity(eval_loss))
                     # Reset the running averages and exit checkpoint.
-                    avg_loss = avg_step_time = 0.0
+                    avg_loss = total_step_time = 0.0
+                    num_timed_steps = 0
 
                 if i_step >= self.max_steps:
                     print("Maximum step", i_step, "reached.")
@@ -362,20 +407,30 @@ class DynamicBot(Model):
         Returns:
             response string from bot.
         """
-        # Convert input sentence to token-ids.
-        encoder_inputs = io_utils.sentence_to_token_ids(
-            tf.compat.as_bytes(sentence), self.dataset.word_to_idx)
+        return self.respond_batch([sentence])[0]
+
+    def respond_batch(self, sentences):
+        """Responds to many input sentences with a single session run.
+
+        Args:
+            sentences: list of (str) input sentences from users.
+
+        Returns:
+            list of response strings from bot, one per input sentence.
+        """
+        # Convert input sentences to a padded batch of token-ids.
+        encoder_inputs = io_utils.encoder_batch(io_utils.sentences_to_token_ids(
+            sentences, self.dataset.word_to_idx))
 
-        encoder_inputs = np.array([encoder_inputs[::-1]])
         self.pipeline.feed_user_input(encoder_inputs)
-        # Get output sentence from the chatbot.
-        _, _, response = self.step(forward_only=True)
-        # response has shape [1, response_length].
-        # Its last element is the EOS_ID, which we don't show user.
-        response = self.dataset.as_words(response[0][:-1])
-        if 'UNK' in response:
-            response = "I don't know."
-        return response
+        # Get output sentences from the chatbot.
+        _, _, responses = self.step(forward_only=True)
+        # responses has shape [batch_size, response_length]. Each response
+        # ends with EOS_ID (then padding), which we don't show user.
+        responses = self.dataset.as_words_batch(
+            [io_utils.response_ids(response) for response in responses])
+        return ["I don't know." if 'UNK' in response else response
+                for response in responses]
 
     def chat(self):
         """Alias for decode."""
@@ -396,7 +451,7 @@ class DynamicBot(Model):
             lr_val = self.learning_rate.eval(session=self.sess)
             tf.reset_default_graph()
             # Gross. Am ashamed:
-            self.sess = tf.Session()
+            self.sess = tf.Session(config=self.session_config())
             with self.graph.name_scope(tf.GraphKeys.SUMMARIES):
                 self.global_step    = tf.Variable(initial_value=0, trainable=False)
                 self.learning_rate  = tf.constant(lr_val)
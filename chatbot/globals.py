@@ -1,12 +1,12 @@
 """Place all default/global chatbot variables here."""
 
-import tensorflow as tf
-
+# Dotted paths (see pydoc.locate), so that importing this module doesn't
+# import tensorflow.
 OPTIMIZERS = {
-    'Adagrad':  tf.train.AdagradOptimizer,
-    'Adam':     tf.train.AdamOptimizer,
-    'SGD':      tf.train.GradientDescentOptimizer,
-    'RMSProp':  tf.train.RMSPropOptimizer,
+    'Adagrad':  'tensorflow.train.AdagradOptimizer',
+    'Adam':     'tensorflow.train.AdamOptimizer',
+    'SGD':      'tensorflow.train.GradientDescentOptimizer',
+    'RMSProp':  'tensorflow.train.RMSPropOptimizer',
 }
 
 # All allowed and/or used default configuration values, period.
@@ -18,18 +18,24 @@ DEFAULT_FULL_CONFIG = {
         "ckpt_dir": "out",  # Directory to store training checkpoints.
         "decode": False,
         "batch_size": 256,
+        "beam_width": 1,  # Beam search width for chat sessions (1 = greedy).
         "dropout_prob": 0.2,  # Drop rate applied at encoder/decoders output.
         "decoder.class": "BasicDecoder",
         "encoder.class": "BasicEncoder",
         "embed_size": 128,
+        "inter_op_threads": 0,  # Session inter-op threads (0 = TF default).
+        "intra_op_threads": 0,  # Session intra-op threads (0 = TF default).
         "learning_rate": 0.002,
         "l1_reg": 1.0e-6,  # L1 regularization applied to word embeddings.
+        "length_penalty": 0.0,  # Beam search length penalty (0 = none).
         "lr_decay": 0.98,
         "max_gradient": 5.0,
         "max_steps": int(1e6),  # Max number of training iterations.
         "num_layers": 1,  # Num layers for each of encoder, decoder.
         "num_samples": 512,  # IF sampled_loss is true, default sample size.
         "optimizer": "Adam",  # Options are those in OPTIMIZERS above.
+        "pipeline.class": "InputPipeline",  # Or DataPipeline (tf.data).
+        "quantize_weights": False,  # Store frozen weights as 8-bit values.
         "reset_model": True,
         "sampled_loss": False,  # Whether to do sampled softmax.
         "state_size": 512,
@@ -40,6 +46,10 @@ DEFAULT_FULL_CONFIG = {
         "data_dir": None,  # Require user to specify.
         "vocab_size": 40000,
         "max_seq_len": 10,  # Maximum length of sentence used to train bot.
-        "optimize_params": True  # Reduce vocab size if exceeds num unique words
+        "optimize_params": True,  # Reduce vocab size if exceeds num unique words
+        "num_workers": 1,  # Processes used when preparing data files.
+        "binary_ids": False,  # Read token ids from memory-mapped .npy files.
+        "tfrecords_shards": 1,  # Number of files to split tfrecords data into.
+        "num_buckets": 4,  # Number of length buckets, derived from the data.
     },
 }
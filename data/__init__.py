@@ -1,11 +1,31 @@
+"""Datasets are imported on first access (PEP 562), so that importing the
+package doesn't import tensorflow and pandas.
+"""
+
 from __future__ import absolute_import
 
-from data import data_helper
-from data import _dataset
-from data import dataset_wrappers
+import importlib
+
+# Attributes of the package, and the module each is imported from.
+_LAZY_ATTRS = {
+    'DataHelper': 'data.data_helper',
+    'Dataset': 'data._dataset',
+    'Cornell': 'data.dataset_wrappers',
+    'Ubuntu': 'data.dataset_wrappers',
+    'Reddit': 'data.dataset_wrappers',
+    'TestData': 'data.dataset_wrappers',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    try:
+        return importlib.import_module(__name__ + '.' + name)
+    except ModuleNotFoundError as e:
+        if e.name != __name__ + '.' + name:
+            raise
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-from data.data_helper import DataHelper
-from data._dataset import Dataset
-from data.dataset_wrappers import Cornell, Ubuntu, Reddit, TestData
 
 __all__ = ['Cornell', 'Reddit', 'Ubuntu', 'TestData']
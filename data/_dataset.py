@@ -6,15 +6,111 @@ from __future__ import print_function
 
 import os
 import logging
+import itertools
+import multiprocessing
 import numpy as np
 import tensorflow as tf
 from utils import io_utils
+from utils.vocab import Vocabulary
+from data import bucketing
 from abc import ABCMeta, abstractmethod, abstractproperty
 
 from chatbot.globals import DEFAULT_FULL_CONFIG
 DEFAULT_PARAMS = DEFAULT_FULL_CONFIG['dataset_params']
 
 
+def token_id_sentences(path, binary_ids=False, start=0, stop=None):
+    """Yields the token ids of sentences [start, stop) in a token-ids file.
+
+    Args:
+        path: path to a token-ids file written by io_utils.data_to_token_ids.
+        binary_ids: if True, sentences are zero-copy slices of the
+            memory-mapped binary format (see io_utils.token_ids_to_binary).
+            Otherwise, they are lists of ints parsed from the text file.
+        start: index of the first sentence to yield.
+        stop: index of the sentence to stop at (None for end of file).
+    """
+    if binary_ids:
+        tokens, offsets = io_utils.load_binary_token_ids(path)
+        offsets = offsets[start:None if stop is None else stop + 1]
+        for begin, end in zip(offsets[:-1], offsets[1:]):
+            yield tokens[begin:end]
+    else:
+        with tf.gfile.GFile(path, mode="r") as f:
+            for line in itertools.islice(f, start, stop):
+                yield [int(x) for x in line.split()]
+
+
+def sequence_example(encoder_ids, decoder_ids):
+    """Returns the tf.train.SequenceExample for an (encoder, decoder) pair,
+    in the format parsed by chatbot.components.InputPipeline.
+    """
+
+    def int64_feature(value):
+        return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+    encoder_list = [int(x) for x in encoder_ids]
+    decoder_list = [io_utils.GO_ID] \
+                   + [int(x) for x in decoder_ids] \
+                   + [io_utils.EOS_ID]
+
+    # Building the protos in one go is much faster than appending per token.
+    return tf.train.SequenceExample(
+        context=tf.train.Features(feature={
+            'encoder_sequence_length': int64_feature(len(encoder_list)),
+            'decoder_sequence_length': int64_feature(len(decoder_list))}),
+        feature_lists=tf.train.FeatureLists(feature_list={
+            'encoder_sequence': tf.train.FeatureList(
+                feature=[int64_feature(e) for e in encoder_list]),
+            'decoder_sequence': tf.train.FeatureList(
+                feature=[int64_feature(d) for d in decoder_list])}))
+
+
+def padded_batch(tokens, starts, lengths, width, reverse=False):
+    """Gather sentences from a flat token array into a padded 2D batch.
+
+    Args:
+        tokens: flat array of token ids (e.g. from io_utils.load_binary_token_ids).
+        starts: array of the index in tokens of each sentence's first token.
+        lengths: array of the number of tokens in each sentence.
+        width: number of columns of the batch. Must be >= max(lengths).
+        reverse: if True, reverse each row after padding (so padding
+            comes first), as expected by the encoders.
+
+    Returns:
+        int64 array of shape [len(starts), width], padded with PAD_ID.
+    """
+    batch = np.full((len(starts), width), io_utils.PAD_ID, dtype=np.int64)
+    rows = np.repeat(np.arange(len(starts)), lengths)
+    # Position of each token within its own sentence.
+    positions = np.arange(rows.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    columns = width - 1 - positions if reverse else positions
+    batch[rows, columns] = tokens[np.repeat(starts, lengths) + positions]
+    return batch
+
+
+def _write_tfrecords_shard(args):
+    """Worker for Dataset.convert_to_tf_records. Writes the examples from
+    sentence pairs [start, stop) to output_path.
+
+    The shard is written to a temporary file and renamed when complete, so
+    that an interrupted conversion never leaves a valid-looking shard behind.
+    """
+    from_path, to_path, start, stop, output_path, max_seq_len, binary_ids = args
+    tmp_path = output_path + '.tmp'
+    with tf.python_io.TFRecordWriter(tmp_path) as writer:
+        for encoder_ids, decoder_ids in zip(
+                token_id_sentences(from_path, binary_ids, start, stop),
+                token_id_sentences(to_path, binary_ids, start, stop)):
+            # Skip sentence pairs that are too long for specifications.
+            if max(len(encoder_ids), len(decoder_ids)) > max_seq_len:
+                continue
+            writer.write(
+                sequence_example(encoder_ids, decoder_ids).SerializeToString())
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
 class DatasetABC(metaclass=ABCMeta):
 
     @abstractmethod
@@ -77,7 +173,9 @@ class Dataset(DatasetABC):
             data_dir=self.data_dir,
             vocab_size=self.vocab_size,
             optimize=dataset_params.get('optimize_params'),
-            config_path=dataset_params.get('config_path'))
+            config_path=dataset_params.get('config_path'),
+            num_workers=self.num_workers,
+            binary_ids=self.binary_ids)
 
         if vocab_size != self.vocab_size:
             self.log.info("Updating vocab size from %d to %d",
@@ -94,13 +192,21 @@ class Dataset(DatasetABC):
             'valid_tfrecords': None}
         self._word_to_idx, self._idx_to_word = io_utils.get_vocab_dicts(
             vocab_path)
+        self._vocab = Vocabulary(self._idx_to_word, self._word_to_idx)
 
         # Create tfrecords file if not located in data_dir.
         self.convert_to_tf_records('train')
         self.convert_to_tf_records('valid')
+        self.bucket_boundaries = self.build_bucket_index('train')
 
     def convert_to_tf_records(self, prefix='train'):
-        """If can't find tfrecords 'prefix' files, creates them.
+        """If can't find tfrecords 'prefix' files, creates them. Files
+        older than the token-ids they were written from are rewritten.
+
+        If tfrecords_shards > 1, the examples are split into that many shard
+        files, e.g. trainvoc40000_seq10-00003-of-00016.tfrecords, which are
+        written in parallel by num_workers processes. In that case,
+        self.paths[prefix + '_tfrecords'] is the list of shard paths.
 
         Args:
             prefix: 'train' or 'valid'. Determines which tfrecords to build.
@@ -108,73 +214,115 @@ class Dataset(DatasetABC):
 
         from_path = self.paths['from_'+prefix]
         to_path = self.paths['to_'+prefix]
-        tfrecords_fname = (prefix
-                           + 'voc%d_seq%d' % (self.vocab_size, self.max_seq_len)
-                           + '.tfrecords')
-        output_path = os.path.join(self.data_dir, tfrecords_fname)
-        if os.path.isfile(output_path):
-            self.log.info('Using tfrecords file %s' % output_path)
-            self.paths[prefix + '_tfrecords'] = output_path
+        base_fname = prefix + 'voc%d_seq%d' % (self.vocab_size, self.max_seq_len)
+        num_shards = self.tfrecords_shards
+        if num_shards > 1:
+            output_paths = [
+                os.path.join(self.data_dir, '%s-%05d-of-%05d.tfrecords' % (
+                    base_fname, i, num_shards))
+                for i in range(num_shards)]
+        else:
+            output_paths = [os.path.join(self.data_dir, base_fname + '.tfrecords')]
+
+        tfrecords = output_paths if num_shards > 1 else output_paths[0]
+
+        def current(path):
+            # Written after the last (re)build of the token-ids files.
+            return io_utils.derived_file_current(path, from_path, to_path)
+
+        if all(current(path) for path in output_paths):
+            self.log.info('Using tfrecords file(s) %s' % tfrecords)
+            self.paths[prefix + '_tfrecords'] = tfrecords
             return
 
-        def get_sequence_example(encoder_line, decoder_line):
-            space_needed = max(len(encoder_line.split()), len(decoder_line.split()))
-            if space_needed > self.max_seq_len:
-                return None
-
-            example  = tf.train.SequenceExample()
-            encoder_list = [int(x) for x in encoder_line.split()]
-            decoder_list = [io_utils.GO_ID] \
-                           + [int(x) for x in decoder_line.split()] \
-                           + [io_utils.EOS_ID]
-
-            # Why tensorflow . . . why . . .
-            example.context.feature['encoder_sequence_length'].int64_list.value.append(
-                len(encoder_list))
-            example.context.feature['decoder_sequence_length'].int64_list.value.append(
-                len(decoder_list))
-
-            encoder_sequence = example.feature_lists.feature_list['encoder_sequence']
-            decoder_sequence = example.feature_lists.feature_list['decoder_sequence']
-            for e in encoder_list:
-                encoder_sequence.feature.add().int64_list.value.append(e)
-            for d in decoder_list:
-                decoder_sequence.feature.add().int64_list.value.append(d)
-
-            return example
-
-        with tf.gfile.GFile(from_path, mode="r") as encoder_file:
-            with tf.gfile.GFile(to_path, mode="r") as decoder_file:
-                with tf.python_io.TFRecordWriter(output_path) as writer:
-                    encoder_line = encoder_file.readline()
-                    decoder_line = decoder_file.readline()
-                    while encoder_line and decoder_line:
-                        sequence_example = get_sequence_example(
-                            encoder_line,
-                            decoder_line)
-                        if sequence_example is not None:
-                            writer.write(sequence_example.SerializeToString())
-                        encoder_line = encoder_file.readline()
-                        decoder_line = decoder_file.readline()
-
-        self.log.info("Converted text files %s and %s into tfrecords file %s" \
+        # Assign contiguous ranges of sentence pairs to each shard.
+        num_pairs = io_utils.num_lines(from_path)
+        bounds = [num_pairs * i // num_shards for i in range(num_shards)] + [None]
+        tasks = [(from_path, to_path, bounds[i], bounds[i + 1], output_paths[i],
+                  self.max_seq_len, self.binary_ids)
+                 for i in range(num_shards)
+                 if not current(output_paths[i])]
+
+        if self.num_workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(self.num_workers, len(tasks)))
+            try:
+                pool.map(_write_tfrecords_shard, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                _write_tfrecords_shard(task)
+
+        self.log.info("Converted text files %s and %s into %d tfrecords file(s) %s" \
                       % (os.path.basename(from_path),
                          os.path.basename(to_path),
-                         os.path.basename(output_path)))
-        self.paths[prefix + '_tfrecords'] = output_path
+                         num_shards,
+                         os.path.basename(output_paths[0])))
+        self.paths[prefix + '_tfrecords'] = tfrecords
+
+    def build_bucket_index(self, prefix='train'):
+        """Loads, or computes and saves, the length index of 'prefix' data.
+
+        The index is saved to data_dir as e.g. trainvoc40000_seq10.buckets.npz
+        and holds:
+            histogram: number of examples per length (see data.bucketing).
+            boundaries: the num_buckets bucket boundaries minimizing padding.
+            bucket_ids: the bucket of each sentence pair (-1 if skipped).
+
+        Returns:
+            The bucket boundaries, to be passed to the InputPipeline.
+        """
+
+        base_fname = prefix + 'voc%d_seq%d' % (self.vocab_size, self.max_seq_len)
+        index_path = os.path.join(self.data_dir, base_fname + '.buckets.npz')
+        if io_utils.derived_file_current(index_path,
+                                         self.paths['from_' + prefix],
+                                         self.paths['to_' + prefix]):
+            with np.load(index_path) as index:
+                if index['num_buckets'] == self.num_buckets:
+                    self.log.info('Using bucket index %s' % index_path)
+                    return index['boundaries'].tolist()
+
+        enc_lengths = io_utils.token_ids_lengths(self.paths['from_' + prefix])
+        dec_lengths = io_utils.token_ids_lengths(self.paths['to_' + prefix])
+        num_pairs = min(len(enc_lengths), len(dec_lengths))
+        lengths = bucketing.example_lengths(enc_lengths[:num_pairs],
+                                            dec_lengths[:num_pairs],
+                                            self.max_seq_len)
+        histogram = bucketing.length_histogram(lengths)
+        boundaries = bucketing.optimal_boundaries(histogram, self.num_buckets)
+        # Write to a temporary file first, so an interrupted save isn't reused.
+        tmp_path = index_path + '.tmp.npz'
+        np.savez(tmp_path,
+                 num_buckets=self.num_buckets,
+                 histogram=histogram,
+                 boundaries=np.array(boundaries, dtype=np.int64),
+                 bucket_ids=bucketing.assign_buckets(lengths, boundaries))
+        os.replace(tmp_path, index_path)
+
+        self.log.info('Saved bucket index %s. Expected padding fraction:\n%s'
+                      % (index_path, bucketing.bucket_report(
+                          histogram, boundaries=boundaries)))
+        return boundaries
+
+    def token_ids(self, path):
+        """Yields the token ids of each sentence in the token-ids file at path.
+
+        See token_id_sentences for the format of the yielded sentences.
+        """
+        return token_id_sentences(path, self.binary_ids)
 
     def sentence_generator(self, prefix='from'):
         """Yields (as words) single sentences from training data, 
         for testing purposes.
         """
         self.log.info("Generating sentences from %s", self.paths[prefix+'_train'])
-        with tf.gfile.GFile(self.paths[prefix+'_train'], mode="r") as f:
-            sentence = self.as_words(
-                list(map(int, f.readline().strip().lower().split())))
-            while sentence:
-                yield sentence
-                sentence = self.as_words(
-                    list(map(int, f.readline().strip().lower().split())))
+        for sentence_ids in self.token_ids(self.paths[prefix+'_train']):
+            sentence = self.as_words(sentence_ids)
+            if not sentence:
+                break
+            yield sentence
 
     def pairs_generator(self, num_generate=None):
         in_sentences = self.sentence_generator('from')
@@ -209,64 +357,53 @@ class Dataset(DatasetABC):
 
     def _generator(self, from_path, to_path, batch_size):
         """(Used by BucketModels only). Returns a generator function that 
-        reads data from file, and yields shuffled batches.
+        reads data from file, and yields padded batches.
+
+        Sentences are read from the memory-mapped binary token-ids format,
+        which is built from the text files first if needed. Batches are
+        filled with vectorized numpy indexing from a precomputed length
+        index, so no per-token python objects are created.
 
         Args:
             from_path: full path to file for encoder inputs.
             to_path: full path to file for decoder inputs.
             batch_size: number of samples to yield at once.
+
+        Yields:
+            (encoder_batch, decoder_batch) int64 arrays of shape
+            [batch_size, max_len], where max_len is the longest sentence of
+            the batch (including the decoder EOS). Encoder sentences are
+            padded and then reversed. Decoder sentences are followed by
+            EOS_ID and then padded. GO_ID is prepended by the chat bot,
+            since it determines whether or not it's responsible for
+            responding.
         """
 
-        def longest_sentence(enc_list, dec_list):
-            max_enc_len = max([len(s) for s in enc_list])
-            max_dec_len = max([len(s) for s in dec_list])
-            return max(max_enc_len, max_dec_len)
-
-        def padded_batch(encoder_tokens, decoder_tokens):
-            max_sent_len = longest_sentence(encoder_tokens, decoder_tokens)
-            encoder_batch = np.array(
-                [s + [io_utils.PAD_ID] * (max_sent_len - len(s))
-                 for s in encoder_tokens])[:, ::-1]
-            decoder_batch = np.array(
-                [s + [io_utils.PAD_ID] * (max_sent_len - len(s))
-                 for s in decoder_tokens])
-            return encoder_batch, decoder_batch
-
-        encoder_tokens = []
-        decoder_tokens = []
-        with tf.gfile.GFile(from_path, mode="r") as source_file:
-            with tf.gfile.GFile(to_path, mode="r") as target_file:
-
-                source, target = source_file.readline(), target_file.readline()
-                while source and target:
-
-                    # Skip sentence pairs that are too long for specifications.
-                    space_needed = max(len(source.split()), len(target.split()))
-                    if space_needed > self.max_seq_len:
-                        source, target = source_file.readline(), target_file.readline()
-                        continue
-
-                    # Reformat token strings to token lists.
-                    # Note: GO_ID is prepended by the chat bot, since it
-                    # determines whether or not it's responsible for responding.
-                    encoder_tokens.append([int(x) for x in source.split()])
-                    decoder_tokens.append(
-                        [int(x) for x in target.split()] + [io_utils.EOS_ID])
-
-                    # Have we collected batch_size number of sentences?
-                    # If so, pad & yield.
-                    assert len(encoder_tokens) == len(decoder_tokens)
-                    if len(encoder_tokens) == batch_size:
-                        yield padded_batch(encoder_tokens, decoder_tokens)
-                        encoder_tokens = []
-                        decoder_tokens = []
-                    source, target = source_file.readline(), target_file.readline()
-
-                # Don't forget to yield the 'leftovers'!
-                assert len(encoder_tokens) == len(decoder_tokens)
-                assert len(encoder_tokens) <= batch_size
-                if len(encoder_tokens) > 0:
-                    yield padded_batch(encoder_tokens, decoder_tokens)
+        def length_index(path):
+            io_utils.token_ids_to_binary(path, self.vocab_size)
+            tokens, offsets = io_utils.load_binary_token_ids(path)
+            return tokens, offsets[:-1], np.diff(offsets)
+
+        enc_tokens, enc_starts, enc_lengths = length_index(from_path)
+        dec_tokens, dec_starts, dec_lengths = length_index(to_path)
+        num_pairs = min(len(enc_lengths), len(dec_lengths))
+
+        # Skip sentence pairs that are too long for specifications.
+        keep = np.flatnonzero(np.maximum(enc_lengths[:num_pairs],
+                                         dec_lengths[:num_pairs])
+                              <= self.max_seq_len)
+
+        for i in range(0, len(keep), batch_size):
+            pairs = keep[i:i + batch_size]
+            lengths = (enc_lengths[pairs], dec_lengths[pairs])
+            max_sent_len = max(lengths[0].max(), lengths[1].max() + 1)
+            encoder_batch = padded_batch(
+                enc_tokens, enc_starts[pairs], lengths[0], max_sent_len,
+                reverse=True)
+            decoder_batch = padded_batch(
+                dec_tokens, dec_starts[pairs], lengths[1], max_sent_len)
+            decoder_batch[np.arange(len(pairs)), lengths[1]] = io_utils.EOS_ID
+            yield encoder_batch, decoder_batch
 
     @property
     def word_to_idx(self):
@@ -280,25 +417,11 @@ class Dataset(DatasetABC):
 
     def as_words(self, sentence):
         """Convert list of integer tokens to a single sentence string."""
+        return self._vocab.decode(sentence)
 
-        words = []
-        for token in sentence:
-            word = self.idx_to_word[token]
-            try:
-                word = tf.compat.as_str(word)
-            except UnicodeDecodeError:
-                logging.error("UnicodeDecodeError on (token, word): "
-                              "(%r, %r)", token, word)
-                word = str(word)
-            words.append(word)
-
-        words = " ".join(words)
-        #words = " ".join([tf.compat.as_str(self.idx_to_word[i]) for i in sentence])
-        words = words.replace(' , ', ', ').replace(' .', '.').replace(' !', '!')
-        words = words.replace(" ' ", "'").replace(" ?", "?")
-        if len(words) < 2:
-            return words
-        return words[0].upper() + words[1:]
+    def as_words_batch(self, sentences):
+        """Convert each list of integer tokens in sentences to a string."""
+        return self._vocab.decode_batch(sentences)
 
     @property
     def name(self):
@@ -0,0 +1,116 @@
+"""Length statistics of a dataset, and bucket boundaries derived from them.
+
+The lengths used here are the same keys InputPipeline buckets on: the
+encoder length plus the decoder length (which includes GO and EOS) of each
+example written to the tfrecords files.
+
+Cost model: an example in bucket [lo, hi) is assumed to be padded to the
+longest length of that bucket. This slightly overestimates the padding of
+dynamically padded batches, but ranks candidate boundaries consistently.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# Boundaries InputPipeline used before they were derived from the data.
+DEFAULT_BOUNDARIES = [8, 16, 32]
+
+
+def example_lengths(encoder_lengths, decoder_lengths, max_seq_len):
+    """Returns the bucketing key of each sentence pair (-1 if skipped).
+
+    Args:
+        encoder_lengths: array of token counts of the encoder sentences.
+        decoder_lengths: array of token counts of the decoder sentences,
+            before GO and EOS are added.
+        max_seq_len: pairs with a sentence longer than this are skipped
+            when writing tfrecords, and get a length of -1.
+    """
+    lengths = encoder_lengths + decoder_lengths + 2
+    too_long = np.maximum(encoder_lengths, decoder_lengths) > max_seq_len
+    return np.where(too_long, -1, lengths)
+
+
+def length_histogram(lengths):
+    """Returns counts such that counts[l] == number of examples of length l."""
+    return np.bincount(lengths[lengths >= 0])
+
+
+def assign_buckets(lengths, boundaries):
+    """Returns the bucket index of each example (-1 for skipped examples)."""
+    bucket_ids = np.searchsorted(boundaries, lengths, side='right')
+    return np.where(lengths >= 0, bucket_ids, -1)
+
+
+def padding_fraction(histogram, boundaries):
+    """Expected fraction of padded tokens when bucketing with boundaries."""
+    lengths = np.arange(len(histogram))
+    total = np.dot(histogram, lengths)
+    if total == 0:
+        return 0.0
+    padded = 0
+    edges = [0] + [b for b in boundaries if b < len(histogram)] + [len(histogram)]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        counts = histogram[lo:hi]
+        if counts.any():
+            longest = lo + np.flatnonzero(counts)[-1]
+            padded += longest * counts.sum()
+    return 1.0 - total / padded
+
+
+def optimal_boundaries(histogram, num_buckets):
+    """Bucket boundaries minimizing the padding of examples with histogram.
+
+    Solved exactly with dynamic programming over the distinct lengths:
+    best[j][i] is the minimum padded size of the examples with the i
+    shortest distinct lengths split into j buckets.
+
+    Returns:
+        Sorted list of at most num_buckets - 1 boundaries, in the format
+        expected by tf.contrib.training.bucket_by_sequence_length.
+    """
+    values = np.flatnonzero(histogram)
+    if len(values) <= 1 or num_buckets <= 1:
+        return []
+    num_buckets = min(num_buckets, len(values))
+    cum_counts = np.concatenate([[0], np.cumsum(histogram[values])])
+
+    n = len(values)
+    best = np.full((num_buckets + 1, n + 1), np.inf)
+    split = np.zeros((num_buckets + 1, n + 1), dtype=np.int64)
+    best[0][0] = 0
+    for j in range(1, num_buckets + 1):
+        for i in range(j, n + 1):
+            # Bucket j holds distinct lengths values[k:i], padded to values[i-1].
+            k = np.arange(j - 1, i)
+            costs = best[j - 1][k] + values[i - 1] * (cum_counts[i] - cum_counts[k])
+            split[j][i] = k[np.argmin(costs)]
+            best[j][i] = costs.min()
+
+    # Walk back through the splits to recover the longest length per bucket.
+    boundaries = []
+    i = n
+    for j in range(num_buckets, 1, -1):
+        i = split[j][i]
+        boundaries.append(int(values[i - 1]) + 1)
+    return sorted(boundaries)
+
+
+def bucket_report(histogram, max_buckets=8, boundaries=None):
+    """Returns a printable table of the expected padding fraction per choice
+    of bucket boundaries: the optimal ones for 1 to max_buckets buckets, the
+    old default ones, and (if given) the ones in use.
+    """
+    rows = [('%d buckets' % k, optimal_boundaries(histogram, k))
+            for k in range(1, max_buckets + 1)]
+    rows.append(('default', DEFAULT_BOUNDARIES))
+    if boundaries is not None:
+        rows.append(('in use', list(boundaries)))
+    lines = ['%-12s %-8s %s' % ('choice', 'padding', 'boundaries')]
+    for name, bounds in rows:
+        lines.append('%-12s %-8.3f %s' % (
+            name, padding_fraction(histogram, bounds), bounds))
+    return '\n'.join(lines)
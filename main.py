@@ -35,52 +35,53 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 import data
 import chatbot
 import logging
-import tensorflow as tf
+import argparse
 from pydoc import locate
 from utils import io_utils
 
 # =============================================================================
-# FLAGS: Command line argument parser from TensorFlow.
+# FLAGS: Command line argument parser.
 # =============================================================================
-
-flags = tf.app.flags
-flags.DEFINE_string(
-    flag_name="pretrained_dir",
-    default_value=None,
-    docstring="relative path to a pretrained model directory."
-              "It is assumed that the model is one from this repository, and "
-              " thus has certain files that are generated after any training"
-              " session (TL;DR: any ckpt_dir you've trained previously).")
-flags.DEFINE_string(
-    flag_name="config",
-    default_value=None,
-    docstring="relative path to a valid yaml config file."
-              " For example: configs/example_cornell.yml")
-flags.DEFINE_string(
-    flag_name="debug",
-    default_value=False,
-    docstring="If true, increases output verbosity (log levels).")
-flags.DEFINE_string(
-    flag_name="model",
-    default_value="{}",
-    docstring="Options: chatbot.{DynamicBot,Simplebot,ChatBot}.")
-flags.DEFINE_string(
-    flag_name="model_params",
-    default_value="{}",
-    docstring="Configuration dictionary, with supported keys specified by"
-              " those in chatbot.globals.py.")
-flags.DEFINE_string(
-    flag_name="dataset",
-    default_value="{}",
-    docstring="Name (capitalized) of dataset to use."
-              " Options: [data.]{Cornell,Ubuntu,Reddit}."
-              " - Legend: [optional] {Pick,One,Of,These}.")
-flags.DEFINE_string(
-    flag_name="dataset_params",
-    default_value="{}",
-    docstring="Configuration dictionary, with supported keys specified by"
-              " those in chatbot.globals.py.")
-FLAGS = flags.FLAGS
+# Note: tensorflow is only imported in main() (data and chatbot import it
+# lazily), so that e.g. --help doesn't spend seconds importing it.
+
+parser = argparse.ArgumentParser(description="Train and/or chat with a bot.")
+parser.add_argument(
+    "--pretrained_dir",
+    default=None,
+    help="relative path to a pretrained model directory."
+         "It is assumed that the model is one from this repository, and "
+         " thus has certain files that are generated after any training"
+         " session (TL;DR: any ckpt_dir you've trained previously).")
+parser.add_argument(
+    "--config",
+    default=None,
+    help="relative path to a valid yaml config file."
+         " For example: configs/example_cornell.yml")
+parser.add_argument(
+    "--debug",
+    default=False,
+    help="If true, increases output verbosity (log levels).")
+parser.add_argument(
+    "--model",
+    default="{}",
+    help="Options: chatbot.{DynamicBot,Simplebot,ChatBot}.")
+parser.add_argument(
+    "--model_params",
+    default="{}",
+    help="Configuration dictionary, with supported keys specified by"
+         " those in chatbot.globals.py.")
+parser.add_argument(
+    "--dataset",
+    default="{}",
+    help="Name (capitalized) of dataset to use."
+         " Options: [data.]{Cornell,Ubuntu,Reddit}."
+         " - Legend: [optional] {Pick,One,Of,These}.")
+parser.add_argument(
+    "--dataset_params",
+    default="{}",
+    help="Configuration dictionary, with supported keys specified by"
+         " those in chatbot.globals.py.")
 
 
 def start_training(dataset, bot):
@@ -107,15 +108,18 @@ def start_chatting(bot):
     bot.chat()
 
 
-def main(argv):
+def main(flags):
 
-    if FLAGS.debug:
+    if flags.debug:
         # Setting to '0': all tensorflow messages are logged.
         os.environ['TF_CPP_MIN_LOG_LEVEL'] = '0'
         logging.basicConfig(level=logging.INFO)
 
+    import tensorflow as tf
+    tf.logging.set_verbosity('ERROR')
+
     # Extract the merged configs/dictionaries.
-    config = io_utils.parse_config(flags=FLAGS)
+    config = io_utils.parse_config(flags=flags)
     if config['model_params']['decode'] and config['model_params']['reset_model']:
         print("Woops! You passed {decode: True, reset_model: True}." 
               " You can't chat with a reset bot! I'll set reset to False.")
@@ -123,7 +127,7 @@ def main(argv):
 
     # If loading from pretrained, double-check that certain values are correct.
     # (This is not something a user need worry about -- done automatically)
-    if FLAGS.pretrained_dir is not None:
+    if flags.pretrained_dir is not None:
         assert config['model_params']['decode'] \
                and not config['model_params']['reset_model']
 
@@ -144,6 +148,5 @@ def main(argv):
         start_chatting(bot)
 
 if __name__ == "__main__":
-    tf.logging.set_verbosity('ERROR')
-    tf.app.run()
+    main(parser.parse_args())
 
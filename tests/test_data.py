@@ -3,7 +3,11 @@ import pdb
 import sys
 sys.path.append("..")
 import os
+import shutil
+import filecmp
+import tempfile
 import unittest
+import numpy as np
 import tensorflow as tf
 from pydoc import locate
 import chatbot
@@ -84,6 +88,142 @@ class TestData(unittest.TestCase):
             incomplete_params.clear()
             dataset_params.clear()
 
+    def test_parallel_vocabulary(self):
+        """The multiprocess vocab builder must match the serial one exactly."""
+        from_path = os.path.join(TEST_DATA_DIR, 'train_from.txt')
+        to_path = os.path.join(TEST_DATA_DIR, 'train_to.txt')
+        out_dir = tempfile.mkdtemp()
+        serial_path = os.path.join(out_dir, 'serial_vocab.txt')
+        parallel_path = os.path.join(out_dir, 'parallel_vocab.txt')
+
+        serial_size = io_utils.create_vocabulary(
+            serial_path, from_path, to_path, 1000)
+        parallel_size = io_utils.create_vocabulary(
+            parallel_path, from_path, to_path, 1000, num_workers=3)
+        self.assertEqual(serial_size, parallel_size)
+        self.assertTrue(filecmp.cmp(serial_path, parallel_path, shallow=False))
+
+    def test_token_ids_resume(self):
+        """A token-ids file without its completion marker gets rewritten."""
+        data_path = os.path.join(TEST_DATA_DIR, 'train_from.txt')
+        vocab_path = os.path.join(TEST_DATA_DIR, 'vocab121.txt')
+        out_dir = tempfile.mkdtemp()
+        serial_path = os.path.join(out_dir, 'serial.ids')
+        parallel_path = os.path.join(out_dir, 'parallel.ids')
+
+        io_utils.data_to_token_ids(data_path, serial_path, vocab_path)
+        self.assertTrue(io_utils.token_ids_complete(serial_path))
+
+        # Simulate a crash that left a truncated file and no marker behind.
+        with open(parallel_path, 'w') as f:
+            f.write('1 2 3')
+        self.assertFalse(io_utils.token_ids_complete(parallel_path))
+        io_utils.data_to_token_ids(data_path, parallel_path, vocab_path,
+                                   num_workers=3)
+        self.assertTrue(io_utils.token_ids_complete(parallel_path))
+        self.assertTrue(filecmp.cmp(serial_path, parallel_path, shallow=False))
+        self.assertFalse([f for f in os.listdir(out_dir) if '.part-' in f])
+
+    def test_token_ids_without_marker(self):
+        """Unmarked token-ids files are kept only if they look complete, and
+        rebuilding one invalidates what was derived from it."""
+        data_path = os.path.join(TEST_DATA_DIR, 'train_from.txt')
+        vocab_path = os.path.join(TEST_DATA_DIR, 'vocab121.txt')
+        out_dir = tempfile.mkdtemp()
+        ids_path = os.path.join(out_dir, 'train_from.txt.ids121')
+
+        # Written by a version without markers: complete, so it is kept.
+        io_utils.data_to_token_ids(data_path, ids_path, vocab_path)
+        os.remove(ids_path + '.complete')
+        derived_path = os.path.join(out_dir, 'train.buckets.npz')
+        with open(derived_path, 'w') as f:
+            f.write('derived')
+        self.assertTrue(io_utils.derived_file_current(derived_path, ids_path))
+        io_utils.data_to_token_ids(data_path, ids_path, vocab_path)
+        self.assertTrue(io_utils.token_ids_complete(ids_path))
+        self.assertTrue(io_utils.derived_file_current(derived_path, ids_path))
+
+        # Truncated: rebuilt, and the files derived from it are stale.
+        io_utils.token_ids_to_binary(ids_path, vocab_size=121)
+        os.remove(ids_path + '.complete')
+        with open(ids_path, 'w') as f:
+            f.write('1 2 3\n')
+        io_utils.data_to_token_ids(data_path, ids_path, vocab_path)
+        self.assertEqual(io_utils.num_lines(ids_path), io_utils.num_lines(data_path))
+        self.assertFalse(io_utils.derived_file_current(derived_path, ids_path))
+        for path in io_utils.binary_token_ids_paths(ids_path):
+            self.assertFalse(os.path.exists(path))
+
+    def test_binary_token_ids(self):
+        """The binary token-ids format holds the same sentences as the text."""
+        out_dir = tempfile.mkdtemp()
+        ids_path = os.path.join(out_dir, 'train_to.txt.ids121')
+        shutil.copy(os.path.join(TEST_DATA_DIR, 'train_to.txt.ids121'), ids_path)
+
+        io_utils.token_ids_to_binary(ids_path, vocab_size=121)
+        tokens, offsets = io_utils.load_binary_token_ids(ids_path)
+        self.assertEqual(tokens.dtype, np.uint16)
+        with open(ids_path) as f:
+            sentences = [[int(x) for x in line.split()] for line in f]
+        self.assertEqual(len(offsets), len(sentences) + 1)
+        for i, sentence in enumerate(sentences):
+            self.assertEqual(tokens[offsets[i]:offsets[i + 1]].tolist(), sentence)
+
+    def test_sharded_tfrecords(self):
+        """Sharded tfrecords must hold the same examples as a single file."""
+        from data._dataset import _write_tfrecords_shard
+        from_path = os.path.join(TEST_DATA_DIR, 'train_from.txt.ids121')
+        to_path = os.path.join(TEST_DATA_DIR, 'train_to.txt.ids121')
+        out_dir = tempfile.mkdtemp()
+
+        def records(paths):
+            return [r for p in paths for r in tf.python_io.tf_record_iterator(p)]
+
+        single_path = os.path.join(out_dir, 'single.tfrecords')
+        _write_tfrecords_shard(
+            (from_path, to_path, 0, None, single_path, 15, False))
+        num_pairs = io_utils.num_lines(from_path)
+        bounds = [0, num_pairs // 3, 2 * num_pairs // 3, None]
+        shard_paths = []
+        for i in range(3):
+            shard_paths.append(os.path.join(out_dir, 'shard-%d' % i))
+            _write_tfrecords_shard((from_path, to_path, bounds[i], bounds[i + 1],
+                                    shard_paths[-1], 15, False))
+        self.assertEqual(records([single_path]), records(shard_paths))
+
+    def test_bucket_boundaries(self):
+        """Derived boundaries must be optimal under the padding cost model."""
+        from itertools import combinations
+        from data import bucketing
+        enc_lengths = io_utils.token_ids_lengths(
+            os.path.join(TEST_DATA_DIR, 'train_from.txt.ids121'))
+        dec_lengths = io_utils.token_ids_lengths(
+            os.path.join(TEST_DATA_DIR, 'train_to.txt.ids121'))
+        num_pairs = min(len(enc_lengths), len(dec_lengths))
+        lengths = bucketing.example_lengths(
+            enc_lengths[:num_pairs], dec_lengths[:num_pairs], 10)
+        histogram = bucketing.length_histogram(lengths)
+
+        candidates = np.flatnonzero(histogram)[:-1] + 1
+        for num_buckets in range(1, 4):
+            boundaries = bucketing.optimal_boundaries(histogram, num_buckets)
+            best = min(bucketing.padding_fraction(histogram, list(c))
+                       for c in combinations(candidates, num_buckets - 1))
+            self.assertAlmostEqual(
+                bucketing.padding_fraction(histogram, boundaries), best)
+
+        boundaries = bucketing.optimal_boundaries(histogram, 4)
+        self.assertLessEqual(
+            bucketing.padding_fraction(histogram, boundaries),
+            bucketing.padding_fraction(histogram, bucketing.DEFAULT_BOUNDARIES))
+        bucket_ids = bucketing.assign_buckets(lengths, boundaries)
+        self.assertEqual(np.sum(bucket_ids >= 0), histogram.sum())
+
+    def test_length_batches(self):
+        token_ids = [[5, 6], [7], [8, 9], [], [10]]
+        self.assertEqual(io_utils.length_batches(token_ids),
+                         [[0, 2], [1, 4], [3]])
+
     def test_cornell(self):
         """Train a bot on cornell and display responses when given
         training data as input -- a sanity check that the data is clean.
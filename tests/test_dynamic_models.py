@@ -48,6 +48,18 @@ class TestDynamicModels(unittest.TestCase):
         bot = create_bot(flags)
         self._quick_train(bot)
 
+    def test_train_data_pipeline(self):
+        """Simulate a brief training session with the tf.data pipeline."""
+        flags = TEST_FLAGS
+        flags = flags._replace(model_params=dict(
+            **flags.model_params,
+            reset_model=True,
+            steps_per_ckpt=10,
+            **{'pipeline.class': 'DataPipeline'}))
+        bot = create_bot(flags)
+        self.assertIsInstance(bot.pipeline, chatbot.components.DataPipeline)
+        self._quick_train(bot)
+
     def test_base_methods(self):
         """Call each method in chatbot._models.Model, checking for errors."""
         bot = create_bot()
@@ -138,6 +150,112 @@ class TestDynamicModels(unittest.TestCase):
             response = sess.run(tensors['outputs'], feed_dict=feed_dict)
             logging.info('Reponse: %s', response)
 
+    def test_optimized_export(self):
+        """The optimized graph must respond exactly like the frozen one."""
+        from utils import graph_optimizer
+        flags = TEST_FLAGS
+        flags = flags._replace(model_params=dict(
+            **flags.model_params,
+            reset_model=True,
+            decode=True,
+            temperature=0.0))
+        bot = create_bot(flags)
+        bot.freeze()
+        rows = graph_optimizer.export_optimized(bot.ckpt_dir, report=False)
+        self.assertEqual([r[0] for r in rows], ['frozen', 'strip', 'fold', 'fuse'])
+        self.assertLessEqual(rows[-1][1], rows[0][1])
+
+        encoder_inputs = np.array([[5, 6, 7, 8]], dtype=np.int32)
+        responses = []
+        for file_name in ['frozen_model.pb', 'optimized_model.pb']:
+            graph_def = graph_optimizer.read_graph_def(
+                os.path.join(bot.ckpt_dir, file_name))
+            with tf.Graph().as_default() as graph:
+                tf.import_graph_def(graph_def, name='')
+            with tf.Session(graph=graph) as sess:
+                responses.append(sess.run('outputs:0', feed_dict={
+                    'input_pipeline/user_input:0': encoder_inputs}))
+        np.testing.assert_array_equal(responses[0], responses[1])
+
+    def test_respond_batch(self):
+        """Batched responses must match responding to sentences one by one."""
+        flags = TEST_FLAGS
+        flags = flags._replace(model_params=dict(
+            **flags.model_params,
+            reset_model=True,
+            decode=True,
+            temperature=0.0))
+        bot = create_bot(flags)
+        self.assertTrue(bot.is_chatting)
+
+        sentence = "How's it going?"
+        responses = bot.respond_batch([sentence] * 4)
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(responses, [bot(sentence)] * 4)
+
+        responses = bot.respond_batch(["Hi.", "How's it going?", "Bye."])
+        self.assertEqual(len(responses), 3)
+
+    def test_beam_search(self):
+        """Chat with beam search, for both decoder classes."""
+        for decoder_class in ['BasicDecoder', 'AttentionDecoder']:
+            flags = TEST_FLAGS
+            flags = flags._replace(model_params=dict(
+                **flags.model_params,
+                reset_model=True,
+                decode=True,
+                beam_width=4,
+                length_penalty=0.6,
+                attention_mechanism='LuongAttention',
+                **{'decoder.class': decoder_class}))
+            bot = create_bot(flags)
+            responses = bot.respond_batch(["Hi.", "How's it going?", "Bye."])
+            self.assertEqual(len(responses), 3)
+            for response in responses:
+                self.assertIsInstance(response, str)
+
+    def test_sequence_length(self):
+        """Padding past the sequence lengths must not change the encoder
+        state or the (attention) decoder outputs."""
+        rnn_params = {'state_size': 16, 'embed_size': 8, 'num_layers': 1,
+                      'dropout_prob': 0.0, 'base_cell': 'GRUCell'}
+        for encoder_class in ['BasicEncoder', 'BidirectionalEncoder']:
+            tf.reset_default_graph()
+            enc_inputs = tf.placeholder(tf.float32, [None, None, 8])
+            dec_inputs = tf.placeholder(tf.float32, [None, None, 8])
+            enc_lengths = tf.placeholder(tf.int32, [None])
+            dec_lengths = tf.placeholder(tf.int32, [None])
+            encoder = getattr(chatbot.components, encoder_class)(**rnn_params)
+            enc_outputs, enc_state = encoder(enc_inputs,
+                                             sequence_length=enc_lengths)
+            decoder = chatbot.components.AttentionDecoder(
+                encoder_outputs=enc_outputs,
+                encoder_sequence_length=enc_lengths,
+                vocab_size=10,
+                attention_mechanism='LuongAttention',
+                **rnn_params)
+            dec_outputs, _ = decoder(dec_inputs,
+                                     initial_state=enc_state,
+                                     sequence_length=dec_lengths)
+
+            enc_data = np.random.randn(1, 3, 8)
+            dec_data = np.random.randn(1, 4, 8)
+            padded_enc = np.concatenate([enc_data, np.random.randn(1, 5, 8)], 1)
+            padded_dec = np.concatenate([dec_data, np.random.randn(1, 2, 8)], 1)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                state, outputs = sess.run([enc_state, dec_outputs], feed_dict={
+                    enc_inputs: enc_data, enc_lengths: [3],
+                    dec_inputs: dec_data, dec_lengths: [4]})
+                padded_state, padded_outputs = sess.run(
+                    [enc_state, dec_outputs], feed_dict={
+                        enc_inputs: padded_enc, enc_lengths: [3],
+                        dec_inputs: padded_dec, dec_lengths: [4]})
+            np.testing.assert_allclose(state, padded_state, atol=1e-5)
+            np.testing.assert_allclose(outputs, padded_outputs[:, :4],
+                                       atol=1e-5)
+            np.testing.assert_allclose(padded_outputs[:, 4:], 0.)
+
 
     def test_memorize(self):
         """Train a bot to memorize (overfit) the small test data, and 
@@ -154,7 +272,7 @@ class TestDynamicModels(unittest.TestCase):
             max_steps=300))
         flags = flags._replace(dataset_params=dict(
             max_seq_len=20,
-            data_dir=TEST_DATA_DIR))
+            data_dir=TEST_DATA_COPY_DIR))
         print('TEST_FLAGS', flags.dataset)
         bot, dataset = create_bot(flags=flags, return_dataset=True)
         bot.train()
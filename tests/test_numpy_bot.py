@@ -0,0 +1,162 @@
+"""Tests for the NumPy runtime and its exporter."""
+
+import os
+import json
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from utils import numpy_bot, numpy_export, graph_optimizer
+from tests.utils import *
+
+
+def random_bot(cell='gru', num_layers=1, attention=False, temperature=0.0,
+               vocab_size=20, embed_size=4, state_size=6, seed=0):
+    """Returns a NumpyBot with random weights."""
+    random_state = np.random.RandomState(seed)
+
+    def weights(*shape):
+        return random_state.randn(*shape).astype(np.float32)
+
+    arrays = {'encoder/embedding': weights(vocab_size, embed_size),
+              'decoder/embedding': weights(vocab_size, embed_size),
+              'projection/w': weights(state_size, vocab_size),
+              'projection/b': weights(vocab_size)}
+    for name in ['encoder', 'decoder']:
+        input_size = embed_size
+        if name == 'decoder' and attention:
+            input_size += state_size
+        for i in range(num_layers):
+            prefix = '%s/cell_%d/' % (name, i)
+            size = input_size + state_size if i == 0 else 2 * state_size
+            if cell == 'gru':
+                arrays[prefix + 'gates_kernel'] = weights(size, 2 * state_size)
+                arrays[prefix + 'gates_bias'] = weights(2 * state_size)
+                arrays[prefix + 'candidate_kernel'] = weights(size, state_size)
+                arrays[prefix + 'candidate_bias'] = weights(state_size)
+            else:
+                arrays[prefix + 'kernel'] = weights(size, 4 * state_size)
+                arrays[prefix + 'bias'] = weights(4 * state_size)
+    if attention:
+        arrays['attention/memory_kernel'] = weights(state_size, state_size)
+        arrays['attention/attention_kernel'] = weights(2 * state_size,
+                                                       state_size)
+    return numpy_bot.NumpyBot(arrays, {'cell': cell,
+                                       'num_layers': num_layers,
+                                       'attention': attention,
+                                       'max_seq_len': 10,
+                                       'temperature': temperature})
+
+
+class TestNumpyBot(unittest.TestCase):
+
+    def setUp(self):
+        tf.logging.set_verbosity('ERROR')
+
+    def test_padding(self):
+        """Padding a sentence in a batch must not change its response."""
+        for cell in ['gru', 'lstm']:
+            for num_layers in [1, 2]:
+                for attention in [False, True]:
+                    bot = random_bot(cell, num_layers, attention)
+                    batch = np.array([[5, 6, 7, 0, 0],
+                                      [8, 9, 10, 11, 12]])
+                    responses = bot(batch)
+                    for i, length in enumerate([3, 5]):
+                        row = responses[i]
+                        response = bot(batch[None, i, :length])[0]
+                        np.testing.assert_array_equal(
+                            row[:len(response)], response)
+                        self.assertTrue(np.all(row[len(response):] == 0))
+
+    def test_step(self):
+        """Decoding step by step must give the responses of __call__."""
+        for attention in [False, True]:
+            bot = random_bot('lstm', 2, attention)
+            batch = np.array([[5, 6, 7, 0], [8, 9, 10, 11]])
+            state = bot.initial_state(batch)
+            ids = np.full(len(batch), numpy_bot.GO_ID)
+            steps = []
+            for _ in range(bot.max_seq_len + 1):
+                ids, state = bot.step(ids, state)
+                steps.append(ids)
+            responses = bot(batch)
+            # Responses are padded after EOS_ID, and may stop early.
+            for i, response in enumerate(responses):
+                for t, word_id in enumerate(response):
+                    self.assertEqual(word_id, steps[t][i])
+                    if word_id == numpy_bot.EOS_ID:
+                        self.assertTrue(np.all(response[t + 1:] == 0))
+                        break
+
+    def test_sample(self):
+        """Sampled word frequencies must follow the softmax of the logits."""
+        bot = random_bot(temperature=1.0)
+        logits = np.log(np.array([[0.1, 0.2, 0.7]] * 20000))
+        ids = bot.sample(logits, np.random.RandomState(0))
+        np.testing.assert_allclose(
+            np.bincount(ids, minlength=3) / len(ids), [0.1, 0.2, 0.7],
+            atol=0.02)
+
+    def test_save_load(self):
+        bot = random_bot('lstm', 2, attention=True)
+        path = os.path.join(TEST_DIR, 'out', numpy_bot.NPZ_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, config=np.array(json.dumps(bot.config)),
+                            **bot.arrays)
+        loaded = numpy_bot.NumpyBot.load(path)
+        batch = np.array([[5, 6, 7]])
+        np.testing.assert_array_equal(loaded(batch), bot(batch))
+        self.assertEqual(loaded.memory_size, bot.memory_size)
+
+    def test_export(self):
+        """Exported bots must respond exactly like their frozen graph."""
+        for base_cell, num_layers, decoder_class in [
+                ('GRUCell', 1, 'BasicDecoder'),
+                ('LSTMCell', 2, 'BasicDecoder'),
+                ('GRUCell', 2, 'AttentionDecoder'),
+                ('LSTMCell', 1, 'AttentionDecoder')]:
+            flags = TEST_FLAGS
+            flags = flags._replace(model_params=dict(
+                **flags.model_params,
+                reset_model=True,
+                decode=True,
+                temperature=0.0,
+                base_cell=base_cell,
+                num_layers=num_layers,
+                attention_mechanism='LuongAttention',
+                **{'decoder.class': decoder_class}))
+            bot = create_bot(flags)
+            bot.freeze()
+            # The check must use frozen_model.pb, not the 8-bit graph.
+            graph_optimizer.export_optimized(bot.ckpt_dir, quantize=True,
+                                             report=False)
+            # Raises ValueError if the responses differ.
+            path = numpy_export.export_npz(bot.ckpt_dir)
+            self.assertTrue(os.path.exists(path))
+            self.assertFalse(os.path.exists(path + '.tmp.npz'))
+
+    def test_unsupported(self):
+        config = io_utils.parse_config(flags=TEST_FLAGS)
+        config['model_params']['encoder.class'] = 'BidirectionalEncoder'
+        with self.assertRaises(ValueError):
+            numpy_export.numpy_config(config)
+
+    def test_empty_inputs(self):
+        """Empty inputs are encoded to the zero state, and get the response
+        of an empty sentence in a batch with longer ones."""
+        for cell in ['gru', 'lstm']:
+            for attention in [False, True]:
+                bot = random_bot(cell, 2, attention)
+                memory, _ = bot.encode(np.zeros((2, 0), np.int32))
+                self.assertEqual(memory.shape, (2, 0, 6))
+                response = bot(np.zeros((1, 0), np.int32))[0]
+                responses = bot(np.zeros((2, 0), np.int32))
+                np.testing.assert_array_equal(responses[1], response)
+                padded = bot(np.array([[0, 0, 0], [5, 6, 7]]))[0]
+                np.testing.assert_array_equal(padded[:len(response)],
+                                              response)
+
+if __name__ == '__main__':
+    unittest.main()
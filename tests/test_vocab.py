@@ -0,0 +1,108 @@
+"""Tests for the shared tokenizer and vocabulary lookup."""
+
+import os
+import re
+import shutil
+import itertools
+import tempfile
+import unittest
+
+from utils import vocab as vocab_lib
+from tests.utils import *
+
+# The tokenizer utils.vocab replaced: split on whitespace, then punctuation.
+_WORD_SPLIT = re.compile(b"([.,!?\"':;)(])")
+_DIGIT_RE = re.compile(br"\d")
+
+
+def reference_tokenize(sentence):
+    words = []
+    for space_separated_fragment in sentence.strip().lower().split():
+        words.extend(_WORD_SPLIT.split(space_separated_fragment))
+    return [_DIGIT_RE.sub(b"0", w) for w in words if w]
+
+
+def reference_detokenize(words):
+    words = " ".join(words)
+    words = words.replace(' , ', ', ').replace(' .', '.').replace(' !', '!')
+    words = words.replace(" ' ", "'").replace(" ?", "?")
+    if len(words) < 2:
+        return words
+    return words[0].upper() + words[1:]
+
+
+class TestVocab(unittest.TestCase):
+
+    def setUp(self):
+        self.vocab_path = os.path.join(TEST_DATA_DIR, 'vocab121.txt')
+
+    def test_tokenize(self):
+        """The single-pass tokenizer must match the fragment-wise one."""
+        sentences = [b"Hi, how's it going?!", b"  It's 10:30 (am)...  ",
+                     b"\tno\x0bpunctuation here\n", b"", b"\"'';;"]
+        for file_name in ['train_from.txt', 'train_to.txt']:
+            with open(os.path.join(TEST_DATA_DIR, file_name), 'rb') as f:
+                sentences.extend(f.readlines())
+        for sentence in sentences:
+            self.assertEqual(vocab_lib.tokenize(sentence),
+                             reference_tokenize(sentence))
+        self.assertEqual(vocab_lib.tokenize("Wow, 42!"), [b"wow", b",", b"00", b"!"])
+
+    def test_encode(self):
+        vocab = vocab_lib.Vocabulary.load(self.vocab_path)
+        self.assertEqual(len(vocab), 121)
+        sentences = ["How's it going?", "zzyzx"]
+        token_ids = vocab.encode_batch(sentences)
+        self.assertEqual(token_ids, [vocab.encode(s) for s in sentences])
+        self.assertEqual(token_ids[1], [vocab_lib.UNK_ID])
+        self.assertTrue(all(vocab.idx_to_word[i] == w for i, w in zip(
+            token_ids[0], vocab_lib.tokenize(sentences[0]))))
+
+    def test_detokenize(self):
+        """The single-pass detokenizer must match the chained replaces."""
+        tokens = ['i', 'you', ',', '.', '!', '?', "'"]
+        for length in range(7):
+            for words in itertools.product(tokens, repeat=length):
+                self.assertEqual(vocab_lib.detokenize(list(words)),
+                                 reference_detokenize(list(words)))
+
+    def test_decode(self):
+        vocab = vocab_lib.Vocabulary.load(self.vocab_path)
+        sentences = ["how's it going?", "hi, i'm zzyzx."]
+        token_ids = vocab.encode_batch(sentences)
+        self.assertEqual(vocab.decode_batch(token_ids),
+                         ["How's it going?", "Hi, i'm _UNK."])
+        self.assertEqual(vocab.decode(token_ids[0]), "How's it going?")
+
+    def test_index_cache(self):
+        """The index is reused, and rebuilt when the vocab changes."""
+        out_dir = tempfile.mkdtemp()
+        vocab_path = os.path.join(out_dir, 'vocab121.txt')
+        shutil.copy(self.vocab_path, vocab_path)
+
+        vocab = vocab_lib.Vocabulary.load(vocab_path)
+        self.assertTrue(os.path.exists(vocab_path + '.index.json'))
+        cached = vocab_lib.Vocabulary.load(vocab_path)
+        self.assertEqual(cached.idx_to_word, vocab.idx_to_word)
+        self.assertEqual(cached.word_to_idx, vocab.word_to_idx)
+
+        with open(vocab_path, 'ab') as f:
+            f.write(b'zzyzx\n')
+        vocab = vocab_lib.Vocabulary.load(vocab_path)
+        self.assertEqual(len(vocab), 122)
+        self.assertEqual(vocab.word_to_idx[b'zzyzx'], 121)
+
+        # Undecodable words survive the index, and a corrupt one is ignored.
+        with open(vocab_path, 'ab') as f:
+            f.write(b'\xff\xfe\n')
+        vocab = vocab_lib.Vocabulary.load(vocab_path)
+        self.assertEqual(vocab_lib.Vocabulary.load(vocab_path).idx_to_word,
+                         vocab.idx_to_word)
+        self.assertEqual(vocab.idx_to_word[-1], b'\xff\xfe')
+        with open(vocab_path + '.index.json', 'w') as f:
+            f.write('{"signature": ')
+        self.assertEqual(len(vocab_lib.Vocabulary.load(vocab_path)), 123)
+
+
+if __name__ == '__main__':
+    unittest.main()
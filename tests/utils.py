@@ -5,6 +5,8 @@ import data
 import chatbot
 
 import os
+import shutil
+import tempfile
 from pydoc import locate
 import pdb
 from utils import io_utils
@@ -15,6 +17,10 @@ from collections import namedtuple
 TEST_DIR = os.path.dirname(os.path.realpath(__file__))
 TEST_DATA_DIR = os.path.join(TEST_DIR, 'test_data')
 TEST_CONFIG_PATH = os.path.join(TEST_DIR, 'test_config.yml')
+# Datasets write (and may rewrite) files in their data_dir, so the tests
+# build theirs in a copy of the tracked test data.
+TEST_DATA_COPY_DIR = os.path.join(tempfile.mkdtemp(), 'test_data')
+shutil.copytree(TEST_DATA_DIR, TEST_DATA_COPY_DIR)
 logging.basicConfig(level=logging.INFO)
 
 _flag_names = ["pretrained_dir",
@@ -31,7 +37,7 @@ TEST_FLAGS = Flags(pretrained_dir=None,
                    model='{}',
                    dataset='{}',
                    model_params={'ckpt_dir': os.path.join(TEST_DIR, 'out')},
-                   dataset_params={'data_dir': TEST_DATA_DIR})
+                   dataset_params={'data_dir': TEST_DATA_COPY_DIR})
 
 
 def create_bot(flags=TEST_FLAGS, return_dataset=False):
@@ -1,2 +1,15 @@
-from utils import io_utils
-from utils import bot_freezer
+import importlib
+
+
+def __getattr__(name):
+    # Submodules (e.g. bot_freezer, which imports tensorflow) are imported
+    # on first access.
+    try:
+        return importlib.import_module(__name__ + '.' + name)
+    except ModuleNotFoundError as e:
+        if e.name != __name__ + '.' + name:
+            raise
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+__all__ = ['io_utils', 'bot_freezer', 'vocab']
@@ -7,23 +7,31 @@ from __future__ import print_function
 import numpy as np
 import tensorflow as tf
 from utils import io_utils
+from utils import graph_optimizer
+from utils.vocab import Vocabulary
 import os
 import re
 from pydoc import locate
 
 
-def load_graph(frozen_model_dir):
+def load_graph(frozen_model_dir, file_name=None):
     """Load frozen tensorflow graph into the default graph.
 
     Args:
         frozen_model_dir: location of protobuf file containing frozen graph.
+        file_name: (optional) name of the graph file in frozen_model_dir,
+            e.g. graph_optimizer.FROZEN_FILE. By default, the graph
+            optimized by graph_optimizer.export_optimized if there is one.
 
     Returns:
         tf.Graph object imported from frozen_model_path.
     """
 
     # Prase the frozen graph definition into a GraphDef object.
-    frozen_file = os.path.join(frozen_model_dir, "frozen_model.pb")
+    if file_name is None:
+        frozen_file = graph_optimizer.frozen_graph_path(frozen_model_dir)
+    else:
+        frozen_file = os.path.join(frozen_model_dir, file_name)
     with tf.gfile.GFile(frozen_file, "rb") as f:
         graph_def = tf.GraphDef()
         graph_def.ParseFromString(f.read())
@@ -40,23 +48,35 @@ def load_graph(frozen_model_dir):
     return graph
 
 
-def unfreeze_bot(frozen_model_path):
+def unfreeze_bot(frozen_model_path, file_name=None):
     """Restores the frozen graph from file and grabs input/output tensors needed to
     interface with a bot for conversation.
 
     Args:
         frozen_model_path: location of protobuf file containing frozen graph.
+        file_name: (optional) name of the graph file. See load_graph.
 
     Returns:
         outputs: tensor that can be run in a session.
     """
 
-    bot_graph   = load_graph(frozen_model_path)
+    bot_graph   = load_graph(frozen_model_path, file_name)
     tensors = {'inputs': bot_graph.get_tensor_by_name('import/input_pipeline/user_input:0'),
                'outputs': bot_graph.get_tensor_by_name('import/outputs:0')}
     return tensors, bot_graph
 
 
+def uses_sequence_lengths(graph):
+    """Returns True if the (unfrozen) chat graph passes the length of each
+    user input to its encoder. Graphs frozen before the encoders took
+    sequence lengths run over the padding of batched inputs."""
+    try:
+        graph.get_operation_by_name('import/input_pipeline/user_input_length')
+    except KeyError:
+        return False
+    return True
+
+
 def unfreeze_and_chat(frozen_model_path):
     """Summon a bot back from the dead and have a nice lil chat with it."""
 
@@ -100,31 +120,67 @@ def get_frozen_vocab(config):
     return word_to_idx, idx_to_word
 
 
+def session_config(intra_op_threads=0, inter_op_threads=0):
+    """Returns a tf.ConfigProto with the given thread pool sizes (0 lets
+    TensorFlow pick, usually one thread per core for each pool)."""
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=inter_op_threads)
+
+
 class FrozenBot:
 
-    def __init__(self, frozen_model_dir, vocab_size):
+    def __init__(self, frozen_model_dir, vocab_size, session_config=None):
+        """
+        Args:
+            frozen_model_dir: directory containing the frozen model.
+            vocab_size: size of the vocabulary of the frozen model.
+            session_config: (optional) tf.ConfigProto of the session, e.g.
+                to set intra_op_parallelism_threads when several bots
+                share the cores (see session_config below).
+        """
         print(frozen_model_dir)
         print(type(frozen_model_dir))
         self.tensor_dict, self.graph = unfreeze_bot(frozen_model_dir)
-        self.sess = tf.Session(graph=self.graph)
+        self.sess = tf.Session(graph=self.graph, config=session_config)
+        self.uses_sequence_lengths = uses_sequence_lengths(self.graph)
 
         self.config = {'dataset_params': {
             'data_dir': frozen_model_dir, 'vocab_size': vocab_size}}
         self.word_to_idx, self.idx_to_word = self.get_frozen_vocab()
+        self.vocab = Vocabulary(self.idx_to_word, self.word_to_idx)
 
     def as_words(self, sentence):
-        return " ".join([tf.compat.as_str(self.idx_to_word[i]) for i in sentence])
+        return self.vocab.decode(sentence)
 
     def __call__(self, sentence):
         """Outputs response sentence (string) given input (string)."""
-        # Convert input sentence to token-ids.
-        sentence_tokens = io_utils.sentence_to_token_ids(
-            tf.compat.as_bytes(sentence), self.word_to_idx)
-        sentence_tokens = np.array([sentence_tokens[::-1]])
+        return self.respond_batch([sentence])[0]
 
-        # Get output sentence from the chatbot.
-        fetches = self.tensor_dict['outputs']
-        feed_dict={self.tensor_dict['inputs']: sentence_tokens}
-        response = self.sess.run(fetches=fetches, feed_dict=feed_dict)
-        return self.as_words(response[0][:-1])
+    def respond_batch(self, sentences):
+        """Outputs response sentences (strings) given inputs (strings).
+
+        Graphs frozen before batched decoding have an input of shape
+        [1, None]; sentences are then run one at a time. Graphs frozen
+        before the encoders took sequence lengths get one batch per
+        sentence length (see io_utils.length_batches).
+        """
+        # Convert input sentences to token-ids.
+        sentence_tokens = io_utils.sentences_to_token_ids(
+            sentences, self.word_to_idx)
 
+        fetches = self.tensor_dict['outputs']
+        if self.tensor_dict['inputs'].shape[0].value == 1:
+            batches = [[i] for i in range(len(sentence_tokens))]
+        elif not self.uses_sequence_lengths:
+            batches = io_utils.length_batches(sentence_tokens)
+        else:
+            batches = [list(range(len(sentence_tokens)))]
+
+        responses = [None] * len(sentence_tokens)
+        for batch in batches:
+            inputs = io_utils.encoder_batch([sentence_tokens[i] for i in batch])
+            feed_dict = {self.tensor_dict['inputs']: inputs}
+            outputs = self.sess.run(fetches=fetches, feed_dict=feed_dict)
+            for i, response in zip(batch, outputs):
+                responses[i] = io_utils.response_ids(response)
+        return self.vocab.decode_batch(responses)
@@ -0,0 +1,20 @@
+"""Batched inputs and outputs of the chat bots, shared with serving.
+
+The implementation lives in webpage/deepchat/bot_io.py, since the webpage is
+deployed without the rest of this repository. It is loaded from its file
+here, as importing it through the deepchat package would import the web
+app (and flask) too.
+"""
+
+import os
+import importlib.util
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+_PATH = os.path.join(_PROJECT_ROOT, 'webpage', 'deepchat', 'bot_io.py')
+_spec = importlib.util.spec_from_file_location('deepchat_bot_io', _PATH)
+_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_module)
+
+encoder_batch = _module.encoder_batch
+length_batches = _module.length_batches
+response_ids = _module.response_ids
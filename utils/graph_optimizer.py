@@ -0,0 +1,162 @@
+"""Optimizes frozen chat graphs for deployment with the Graph Transform Tool.
+
+Model.freeze writes frozen_model.pb, which still holds everything reachable
+from the outputs as it was built for training: variable reads, constant
+subgraphs, duplicated nodes, etc. export_optimized rewrites it through the
+stages below into optimized_model.pb (which unfreeze_bot prefers), and
+reports the graph size and CPU decode latency after each stage.
+
+Identity nodes are not removed with remove_nodes(op=Identity): in the
+decoder's while loop they are part of the control flow. The chains of
+Identity nodes on constants (e.g. the '.../read' of frozen variables) are
+folded away with the rest of the constant subgraphs instead.
+
+Usage (for a directory that already has a frozen_model.pb):
+    python -m utils.graph_optimizer --model_dir path_to/ckpt_dir [--quantize]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import argparse
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+# Names of the input and output nodes of frozen chat graphs.
+INPUT_NAME = 'input_pipeline/user_input'
+OUTPUT_NAME = 'outputs'
+
+FROZEN_FILE = 'frozen_model.pb'
+OPTIMIZED_FILE = 'optimized_model.pb'
+
+# (name, transforms) of each optimization stage, applied in order.
+STAGES = [
+    ('strip', ['strip_unused_nodes(type=int32)',
+               'remove_nodes(op=CheckNumerics)',
+               'remove_attribute(attribute_name=_class)',
+               'remove_device']),
+    ('fold', ['fold_constants(ignore_errors=true)',
+              'fold_batch_norms',
+              'fold_old_batch_norms']),
+    ('fuse', ['merge_duplicate_nodes',
+              'fuse_pad_and_conv',
+              'fuse_resize_and_conv',
+              'sort_by_execution_order']),
+]
+QUANTIZE_STAGE = ('quantize', ['quantize_weights(minimum_size=1024)',
+                               'sort_by_execution_order'])
+
+
+def read_graph_def(path):
+    with tf.gfile.GFile(path, 'rb') as f:
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+
+def optimize_graph_def(graph_def, quantize=False):
+    """Applies each of STAGES (and QUANTIZE_STAGE if quantize) to graph_def.
+
+    Returns:
+        list of (stage name, GraphDef after the stage), starting with
+        ('frozen', graph_def).
+    """
+    stages = STAGES + ([QUANTIZE_STAGE] if quantize else [])
+    results = [('frozen', graph_def)]
+    for name, transforms in stages:
+        graph_def = TransformGraph(
+            graph_def, [INPUT_NAME], [OUTPUT_NAME], transforms)
+        results.append((name, graph_def))
+    return results
+
+
+def decode_latency(graph_def, sentence_length=10, vocab_size=100, num_runs=20):
+    """Median seconds for one CPU session run of graph_def on a random
+    sentence (after one warm-up run)."""
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+    inputs = graph.get_tensor_by_name(INPUT_NAME + ':0')
+    outputs = graph.get_tensor_by_name(OUTPUT_NAME + ':0')
+    # Token ids below 4 are the special symbols (PAD, GO, EOS, UNK).
+    feed = {inputs: np.random.randint(
+        4, vocab_size, size=[1, sentence_length]).astype(np.int32)}
+
+    config = tf.ConfigProto(device_count={'GPU': 0})
+    with tf.Session(graph=graph, config=config) as sess:
+        sess.run(outputs, feed_dict=feed)
+        times = []
+        for _ in range(num_runs):
+            start = time.time()
+            sess.run(outputs, feed_dict=feed)
+            times.append(time.time() - start)
+    return float(np.median(times))
+
+
+def export_optimized(model_dir, quantize=False, vocab_size=100,
+                     report=True):
+    """Writes model_dir/optimized_model.pb from model_dir/frozen_model.pb.
+
+    Args:
+        model_dir: directory containing frozen_model.pb.
+        quantize: if True, also store weights as 8-bit values (dequantized
+            when the graph is run). Shrinks the file about 4x, at some cost
+            in accuracy.
+        vocab_size: upper bound on the token ids fed when timing decoding.
+        report: if True, print the graph size and CPU decode latency after
+            each stage.
+
+    Returns:
+        list of (stage name, number of nodes, size in bytes, latency in
+        seconds or None) rows.
+    """
+    graph_def = read_graph_def(os.path.join(model_dir, FROZEN_FILE))
+    results = optimize_graph_def(graph_def, quantize=quantize)
+    with tf.gfile.GFile(os.path.join(model_dir, OPTIMIZED_FILE), 'wb') as f:
+        f.write(results[-1][1].SerializeToString())
+
+    rows = []
+    for name, stage_graph_def in results:
+        latency = None
+        if report:
+            latency = decode_latency(stage_graph_def, vocab_size=vocab_size)
+        rows.append((name, len(stage_graph_def.node),
+                     stage_graph_def.ByteSize(), latency))
+    if report:
+        print(format_report(rows))
+    return rows
+
+
+def format_report(rows):
+    lines = ['%-10s %8s %12s %14s' % ('stage', 'nodes', 'size (KB)',
+                                       'latency (ms)')]
+    for name, num_nodes, size, latency in rows:
+        lines.append('%-10s %8d %12.1f %14s' % (
+            name, num_nodes, size / 1024.,
+            '-' if latency is None else '%.2f' % (1000 * latency)))
+    return '\n'.join(lines)
+
+
+def frozen_graph_path(model_dir):
+    """Returns the path of the optimized graph in model_dir if there is
+    one, else of the frozen graph."""
+    optimized_path = os.path.join(model_dir, OPTIMIZED_FILE)
+    if tf.gfile.Exists(optimized_path):
+        return optimized_path
+    return os.path.join(model_dir, FROZEN_FILE)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--model_dir', required=True,
+                        help='Directory containing frozen_model.pb.')
+    parser.add_argument('--quantize', action='store_true',
+                        help='Also quantize weights to 8 bits.')
+    parser.add_argument('--vocab_size', type=int, default=100,
+                        help='Upper bound on token ids fed when timing.')
+    args = parser.parse_args()
+    export_optimized(args.model_dir, args.quantize, args.vocab_size)
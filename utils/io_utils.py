@@ -4,18 +4,21 @@ from __future__ import division
 from __future__ import print_function
 
 import os
-import re
 import sys
+import glob
 import yaml
 import copy
-import pandas as pd
+import shutil
 import logging
+import multiprocessing
 
-import tensorflow as tf
+import numpy as np
 from collections import Counter, namedtuple
-from tensorflow.python.platform import gfile
 from subprocess import Popen, PIPE
 from chatbot.globals import DEFAULT_FULL_CONFIG
+from utils import vocab as vocab_lib
+# Also part of this module's API, shared with the webpage.
+from utils.bot_io import encoder_batch, length_batches, response_ids
 
 
 # Special vocabulary symbols.
@@ -31,9 +34,14 @@ GO_ID = 1
 EOS_ID = 2
 UNK_ID = 3
 
-# Regular expressions used to tokenize.
-_WORD_SPLIT = re.compile(b"([.,!?\"':;)(])")
-_DIGIT_RE = re.compile(br"\d")
+# Suffix of the marker file written once a token-ids file is fully written.
+_COMPLETE_SUFFIX = ".complete"
+# Approximate size of the chunks data_to_token_ids tokenizes independently.
+_TOKENIZE_CHUNK_BYTES = 32 * 1024 * 1024
+# Approximate number of bytes token_ids_to_binary parses at a time.
+_BINARY_BATCH_BYTES = 16 * 1024 * 1024
+# Vocabulary used by data_to_token_ids worker processes.
+_worker_vocab = None
 
 # Build mock FLAGS object for utils to wrap info around if needed.
 # This makes the API more user-friendly, since it takes care of
@@ -58,6 +66,7 @@ _FLAGS = Flags(pretrained_dir=None,
 
 
 def save_hyper_params(hyper_params, fname):
+    import pandas as pd
     # Append to file if exists, else create.
     df = pd.DataFrame(hyper_params)
     with open(fname, 'a+') as f:
@@ -281,7 +290,7 @@ def parse_config(flags=None, pretrained_dir=None, config_path=None):
         # Get the config_path from the pretrained directory.
         if config_path is None:
             config_path = os.path.join(pretrained_dir, 'config.yml')
-        assert gfile.Exists(config_path), \
+        assert os.path.exists(config_path), \
             "Cannot parse from %s. No config.yml." % config_path
 
         # Wrap test_flags string inside an actual tf.app.test_flags object.
@@ -308,10 +317,7 @@ def parse_config(flags=None, pretrained_dir=None, config_path=None):
 
 def basic_tokenizer(sentence):
     """Very basic tokenizer: split the sentence into a list of tokens."""
-    words = []
-    for space_separated_fragment in sentence.strip().lower().split():
-        words.extend(_WORD_SPLIT.split(space_separated_fragment))
-    return [w for w in words if w]
+    return vocab_lib.tokenize(sentence, normalize_digits=False)
 
 
 def num_lines(file_path):
@@ -333,20 +339,99 @@ def get_word_freqs(path, counter, norm_digits=True):
     """
 
     print("Creating vocabulary for data", path)
-    with gfile.GFile(path, mode="rb") as f:
+    with open(path, mode="rb") as f:
         for i, line in enumerate(f):
             if (i + 1) % 100000 == 0:
                 print("\tProcessing line", (i + 1))
-            line = tf.compat.as_bytes(line)
-            tokens = basic_tokenizer(line)
             # Update word frequency counts in vocab counter dict.
-            for w in tokens:
-                word = _DIGIT_RE.sub(b"0", w) if norm_digits else w
-                counter[word] += 1
+            counter.update(vocab_lib.tokenize(line, norm_digits))
         return counter
 
 
-def create_vocabulary(vocab_path, from_path, to_path, max_vocab_size, norm_digits=True):
+def shard_offsets(path, num_shards):
+    """Split the file at path into num_shards contiguous byte ranges.
+
+    The ranges are not aligned to line boundaries; readers are expected to
+    use read_shard_lines, which assigns each line to the range containing
+    its first byte.
+
+    Returns:
+        list of (start, end) byte offset tuples covering the whole file.
+    """
+    file_size = os.path.getsize(path)
+    num_shards = max(1, min(num_shards, file_size))
+    bounds = [file_size * i // num_shards for i in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_shard_lines(path, start, end):
+    """Yields (as bytes) each line of path whose first byte lies in [start, end).
+
+    Consecutive (start, end) ranges from shard_offsets therefore visit every
+    line of the file exactly once, in order.
+    """
+    with open(path, mode="rb") as f:
+        if start > 0:
+            # Skip the line that began in the previous shard (if any).
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+
+def _count_shard(args):
+    """Worker for get_word_freqs_parallel. Returns the Counter of one shard."""
+    path, start, end, norm_digits = args
+    counter = Counter()
+    for line in read_shard_lines(path, start, end):
+        counter.update(vocab_lib.tokenize(line, norm_digits))
+    return counter
+
+
+def get_word_freqs_parallel(paths, counter, norm_digits=True, num_workers=None):
+    """Multiprocess version of get_word_freqs over a list of files.
+
+    Each file is split by byte offset into shards that are counted in a
+    process pool. Shard counters are merged in file order, so the insertion
+    order (and thus tie-breaking when sorting by frequency) is identical to
+    calling get_word_freqs on each path in turn.
+
+    Args:
+        paths: list of data files to extract vocab counts from.
+        counter: collections.Counter object for mapping word -> frequency.
+        norm_digits: Boolean; if true, all digits are replaced by 0s.
+        num_workers: number of processes. Defaults to the number of cores.
+
+    Returns:
+        The counter (dict), updated with mappings from word -> frequency.
+    """
+
+    num_workers = num_workers or multiprocessing.cpu_count()
+    # A few shards per worker keeps the pool busy when line lengths vary.
+    tasks = []
+    for path in paths:
+        print("Creating vocabulary for data", path)
+        tasks.extend((path, start, end, norm_digits)
+                     for start, end in shard_offsets(path, 4 * num_workers))
+
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        for i, shard_counter in enumerate(pool.imap(_count_shard, tasks)):
+            counter.update(shard_counter)
+            print("\tCounted shard %d/%d" % (i + 1, len(tasks)))
+    finally:
+        pool.close()
+        pool.join()
+    return counter
+
+
+def create_vocabulary(vocab_path, from_path, to_path, max_vocab_size,
+                      norm_digits=True, num_workers=1):
     """Create vocabulary file (if it does not exist yet) from data file.
 
     Data file is assumed to contain one sentence per line. Each sentence is
@@ -360,23 +445,29 @@ def create_vocabulary(vocab_path, from_path, to_path, max_vocab_size, norm_digit
       from_path: data file for encoder inputs.
       to_path: data file for decoder inputs.
       max_vocab_size: limit on the size of the created vocabulary.
-        norm_digits: Boolean; if true, all digits are replaced by 0s.
+      norm_digits: Boolean; if true, all digits are replaced by 0s.
+      num_workers: if greater than 1, count words with that many processes.
+        The resulting vocabulary file is identical to the serial one.
     """
 
-    if gfile.Exists(vocab_path):
+    if os.path.exists(vocab_path):
         return num_lines(vocab_path)
 
     vocab = Counter()
     # Pool all data words together to reflect the data distribution well.
-    vocab = get_word_freqs(from_path, vocab, norm_digits)
-    vocab = get_word_freqs(to_path, vocab, norm_digits)
+    if num_workers > 1:
+        vocab = get_word_freqs_parallel(
+            [from_path, to_path], vocab, norm_digits, num_workers)
+    else:
+        vocab = get_word_freqs(from_path, vocab, norm_digits)
+        vocab = get_word_freqs(to_path, vocab, norm_digits)
 
     # Get sorted vocabulary, from most frequent to least frequent.
     vocab_list = _START_VOCAB + sorted(vocab, key=vocab.get, reverse=True)
     vocab_list = vocab_list[:max_vocab_size]
 
     # Write the list to a file.
-    with gfile.GFile(vocab_path, mode="wb") as vocab_file:
+    with open(vocab_path, mode="wb") as vocab_file:
         for w in vocab_list:
             vocab_file.write(w + b"\n")
 
@@ -396,15 +487,8 @@ def get_vocab_dicts(vocabulary_path):
     Raises:
       ValueError: if the provided vocabulary_path does not exist.
     """
-    if gfile.Exists(vocabulary_path):
-        rev_vocab = []
-        with gfile.GFile(vocabulary_path, mode="rb") as f:
-            rev_vocab.extend(f.readlines())
-        rev_vocab = [tf.compat.as_bytes(line.strip()) for line in rev_vocab]
-        vocab = dict([(x, y) for (y, x) in enumerate(rev_vocab)])
-        return vocab, rev_vocab
-    else:
-        raise ValueError("Vocabulary file %s not found.", vocabulary_path)
+    vocab = vocab_lib.Vocabulary.load(vocabulary_path)
+    return vocab.word_to_idx, vocab.idx_to_word
 
 
 def sentence_to_token_ids(sentence, vocabulary, normalize_digits=True):
@@ -422,40 +506,264 @@ def sentence_to_token_ids(sentence, vocabulary, normalize_digits=True):
     Returns:
       a list of integers, the token-ids for the sentence.
     """
-    words = basic_tokenizer(sentence)
+    return vocab_lib.encode_batch([sentence], vocabulary, normalize_digits)[0]
+
+
+def sentences_to_token_ids(sentences, vocabulary, normalize_digits=True):
+    """Batch version of sentence_to_token_ids: returns a list of token-id
+    lists, one per sentence (bytes or str) in sentences.
+    """
+    return vocab_lib.encode_batch(sentences, vocabulary, normalize_digits)
+
+
+def _init_tokenize_worker(vocabulary_path):
+    """Pool initializer: load the vocabulary once per worker process."""
+    global _worker_vocab
+    _worker_vocab = vocab_lib.Vocabulary.load(vocabulary_path)
+
+
+def _tokenize_chunk(args):
+    """Worker for data_to_token_ids. Writes the token-ids of one chunk.
+
+    The chunk is written to a temporary file and renamed into place, so
+    the existence of part_path means the chunk is complete.
+    """
+    data_path, start, end, part_path, normalize_digits = args
+    tmp_path = part_path + ".tmp"
+    with open(tmp_path, mode="w") as tokens_file:
+        lines = list(read_shard_lines(data_path, start, end))
+        for token_ids in _worker_vocab.encode_batch(lines, normalize_digits):
+            tokens_file.write(" ".join([str(tok) for tok in token_ids]) + "\n")
+    os.replace(tmp_path, part_path)
+    return part_path
 
-    if not normalize_digits:
-        return [vocabulary.get(w, UNK_ID) for w in words]
 
-    # Normalize digits by 0 before looking words up in the vocabulary.
-    return [vocabulary.get(_DIGIT_RE.sub(b"0", w), UNK_ID) for w in words]
+def token_ids_complete(target_path):
+    """Returns True if target_path was fully written by data_to_token_ids."""
+    return os.path.exists(target_path) and os.path.exists(target_path + _COMPLETE_SUFFIX)
 
 
-def data_to_token_ids(data_path, target_path, vocabulary_path, normalize_digits=True):
+def _adopt_unmarked_token_ids(data_path, target_path):
+    """Writes the completion marker of a target_path left by a version of
+    data_to_token_ids that didn't write markers, if it looks complete: newer
+    than data_path and with as many lines. Returns True if it was adopted.
+
+    When target_path was built is unknown, so the marker is dated to the
+    epoch: the files already derived from it are kept, as they were before
+    markers existed (see derived_file_current).
+    """
+    if os.path.getmtime(target_path) < os.path.getmtime(data_path):
+        return False
+    count = num_lines(target_path)
+    # Counts a last line without a newline too, as data_to_token_ids does.
+    with open(data_path, mode="rb") as f:
+        if count != sum(1 for _ in f):
+            return False
+    marker_path = target_path + _COMPLETE_SUFFIX
+    with open(marker_path, mode="w") as marker:
+        marker.write("%d\n" % count)
+    os.utime(marker_path, (0, 0))
+    return True
+
+
+def derived_file_current(path, *ids_paths):
+    """Returns True if path exists and was written after each token-ids file
+    in ids_paths was last (re)built, i.e. after its completion marker.
+
+    Files derived from token-ids files (binary token-ids, tfrecords, bucket
+    indices) must be rebuilt when this returns False. Token-ids files
+    without a marker have no known build time, and don't make path stale:
+    comparing with their own mtime would depend on e.g. the order in which
+    git checked the files out.
+    """
+    if not os.path.exists(path):
+        return False
+    mtime = os.path.getmtime(path)
+    for ids_path in ids_paths:
+        marker_path = ids_path + _COMPLETE_SUFFIX
+        if os.path.exists(marker_path) \
+                and mtime < os.path.getmtime(marker_path):
+            return False
+    return True
+
+
+def data_to_token_ids(data_path, target_path, vocabulary_path,
+                      normalize_digits=True, num_workers=1):
     """Tokenize data file and turn into token-ids using given vocabulary file.
 
-    This function loads data line-by-line from data_path, calls the above
-    sentence_to_token_ids, and saves the result to target_path.
+    This function splits data_path into chunks (by byte offset), calls the
+    above sentence_to_token_ids on each of their lines, and saves the result
+    to target_path. Chunks are tokenized in a process pool if num_workers > 1.
+
+    Writing is crash-safe and resumable:
+        - Each chunk is written to its own part file, renamed into place
+          when done. Parts found from an interrupted run are reused.
+        - The parts are concatenated into a temporary file that is
+          atomically renamed to target_path.
+        - A completion marker (target_path + '.complete') is written last.
+          A target_path without its marker is treated as incomplete,
+          unless it is newer than data_path and has as many lines (as
+          written by versions that didn't write markers).
+        - Files derived from target_path by a previous build (its binary
+          format, tfrecords, bucket indices) are older than the new marker,
+          so they are rebuilt. See derived_file_current.
 
     Args:
       data_path: path to the data file in one-sentence-per-line format.
       target_path: path where the file with token-ids will be created.
       vocabulary_path: path to the vocabulary file.
       normalize_digits: Boolean; if true, all digits are replaced by 0s.
+      num_workers: number of processes used for tokenizing.
     """
-    if not gfile.Exists(target_path):
-        print("Tokenizing data in %s" % data_path)
-        vocab, _ = get_vocab_dicts(vocabulary_path=vocabulary_path)
-        with gfile.GFile(data_path, mode="rb") as data_file:
-            with gfile.GFile(target_path, mode="w") as tokens_file:
-                counter = 0
-                for line in data_file:
-                    counter += 1
-                    if counter % 100000 == 0:
-                        print("  tokenizing line %d" % counter)
-                    token_ids = sentence_to_token_ids(
-                        tf.compat.as_bytes(line), vocab, normalize_digits)
-                    tokens_file.write(" ".join([str(tok) for tok in token_ids]) + "\n")
+
+    if token_ids_complete(target_path):
+        return
+    if os.path.exists(target_path):
+        if _adopt_unmarked_token_ids(data_path, target_path):
+            return
+        logging.warning("Found %s without a completion marker. "
+                        "Assuming it is truncated and re-tokenizing.", target_path)
+    # The binary format is named after target_path: remove it right away.
+    for path in binary_token_ids_paths(target_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    print("Tokenizing data in %s" % data_path)
+    num_chunks = max(num_workers,
+                     -(-os.path.getsize(data_path) // _TOKENIZE_CHUNK_BYTES))
+    chunks = shard_offsets(data_path, num_chunks)
+    part_paths = ["%s.part-%05d-of-%05d" % (target_path, i, len(chunks))
+                  for i in range(len(chunks))]
+    tasks = [(data_path, start, end, part_path, normalize_digits)
+             for (start, end), part_path in zip(chunks, part_paths)
+             if not os.path.exists(part_path)]
+    if len(tasks) < len(chunks):
+        print("  resuming: %d/%d chunks already tokenized" % (
+            len(chunks) - len(tasks), len(chunks)))
+
+    if num_workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(num_workers,
+                                    initializer=_init_tokenize_worker,
+                                    initargs=(vocabulary_path,))
+        try:
+            for i, _ in enumerate(pool.imap_unordered(_tokenize_chunk, tasks)):
+                print("  tokenized chunk %d/%d" % (i + 1, len(tasks)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_tokenize_worker(vocabulary_path)
+        for i, task in enumerate(tasks):
+            _tokenize_chunk(task)
+            print("  tokenized chunk %d/%d" % (i + 1, len(tasks)))
+
+    # Stitch the parts together and move the result into place atomically.
+    tmp_path = target_path + ".tmp"
+    with open(tmp_path, mode="wb") as tokens_file:
+        for part_path in part_paths:
+            with open(part_path, mode="rb") as part_file:
+                shutil.copyfileobj(part_file, tokens_file)
+    os.replace(tmp_path, target_path)
+    with open(target_path + _COMPLETE_SUFFIX, mode="w") as marker:
+        marker.write("%d\n" % num_lines(target_path))
+    # Also clean up parts left behind by runs with a different chunk count.
+    for part_path in glob.glob(glob.escape(target_path) + ".part-*"):
+        os.remove(part_path)
+
+
+def binary_token_ids_paths(ids_path):
+    """Returns the (tokens, offsets) .npy paths of the binary ids_path format."""
+    return ids_path + ".tokens.npy", ids_path + ".offsets.npy"
+
+
+def binary_token_ids_dtype(vocab_size):
+    """Smallest unsigned integer type able to hold all token ids."""
+    return np.uint16 if vocab_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+def token_ids_to_binary(ids_path, vocab_size):
+    """Convert a (text) token-ids file into its compact binary format.
+
+    The binary format is a pair of .npy files, both memory-mappable:
+        - tokens: flat uint16 (or uint32 for vocab_size > 2^16) array of
+          all token ids in the file, sentence after sentence.
+        - offsets: int64 array of length num_sentences + 1, such that
+          sentence i is tokens[offsets[i]:offsets[i+1]].
+
+    Does nothing if the binary files already exist and were written after
+    ids_path (see derived_file_current).
+
+    Args:
+        ids_path: path to a token-ids file written by data_to_token_ids.
+        vocab_size: size of the vocabulary used to write ids_path.
+
+    Returns:
+        The (tokens, offsets) paths. See binary_token_ids_paths.
+    """
+
+    tokens_path, offsets_path = binary_token_ids_paths(ids_path)
+    if derived_file_current(tokens_path, ids_path) \
+            and derived_file_current(offsets_path, ids_path):
+        return tokens_path, offsets_path
+
+    print("Converting %s to binary token-ids" % ids_path)
+    # First pass: sentence lengths, which determine the offsets index.
+    with open(ids_path, mode="rb") as f:
+        lengths = np.fromiter((len(line.split()) for line in f), dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    # Second pass: fill the token array in large batches of lines.
+    tmp_tokens_path = tokens_path + ".tmp"
+    tokens = np.lib.format.open_memmap(
+        tmp_tokens_path, mode="w+",
+        dtype=binary_token_ids_dtype(vocab_size), shape=(int(offsets[-1]),))
+    with open(ids_path, mode="rb") as f:
+        position = 0
+        while True:
+            lines = f.readlines(_BINARY_BATCH_BYTES)
+            if not lines:
+                break
+            batch = np.array(b" ".join(lines).split(), dtype=np.int64)
+            tokens[position:position + len(batch)] = batch
+            position += len(batch)
+    assert position == offsets[-1]
+    tokens.flush()
+    del tokens
+
+    tmp_offsets_path = offsets_path + ".tmp"
+    with open(tmp_offsets_path, mode="wb") as f:
+        np.save(f, offsets)
+    # Offsets are renamed last: both files existing means both are complete.
+    os.replace(tmp_tokens_path, tokens_path)
+    os.replace(tmp_offsets_path, offsets_path)
+    return tokens_path, offsets_path
+
+
+def load_binary_token_ids(ids_path):
+    """Memory-map the binary format of ids_path. See token_ids_to_binary.
+
+    Returns:
+        tokens: flat (memory-mapped) array of all token ids.
+        offsets: array such that sentence i is tokens[offsets[i]:offsets[i+1]].
+
+    Raises:
+      ValueError: if the binary files for ids_path do not exist.
+    """
+    tokens_path, offsets_path = binary_token_ids_paths(ids_path)
+    if not (os.path.exists(tokens_path) and os.path.exists(offsets_path)):
+        raise ValueError("Binary token-ids for %s not found." % ids_path)
+    return np.load(tokens_path, mmap_mode="r"), np.load(offsets_path)
+
+
+def token_ids_lengths(ids_path):
+    """Returns an int64 array with the number of tokens of each line of
+    ids_path, read from the binary offsets when they are current."""
+    _, offsets_path = binary_token_ids_paths(ids_path)
+    if derived_file_current(offsets_path, ids_path):
+        return np.diff(np.load(offsets_path))
+    with open(ids_path, mode="rb") as f:
+        return np.fromiter((len(line.split()) for line in f), dtype=np.int64)
 
 
 def prepare_data(data_dir,
@@ -465,7 +773,9 @@ def prepare_data(data_dir,
                  from_valid_path=None,
                  to_valid_path=None,
                  optimize=True,
-                 config_path=None):
+                 config_path=None,
+                 num_workers=1,
+                 binary_ids=False):
 
     """Prepare all necessary files that are required for the training.
 
@@ -480,6 +790,10 @@ def prepare_data(data_dir,
             vocab_size (num unique words in data) < preferred vocab_size. 
             This would decrease computational cost, should the situation arise.
         config_path: (required if optimize==True) location of config file.
+        num_workers: number of processes used to build the vocabulary
+            and token-ids files.
+        binary_ids: if True, also write the binary token-ids format of each
+            token-ids file. See token_ids_to_binary.
         
     Note on optimize:
     - It will only have an effect if the following conditions are ALL met:
@@ -527,7 +841,8 @@ def prepare_data(data_dir,
         vocab_path,
         from_train_path,
         to_train_path,
-        vocab_size)
+        vocab_size,
+        num_workers=num_workers)
     assert true_vocab_size <= vocab_size
 
     # User-permitted, we reset the config file's vocab size and rename the
@@ -564,6 +879,9 @@ def prepare_data(data_dir,
         data_to_token_ids(
             eval(name + '_path'),
             id_paths[name],
-            vocab_path)
+            vocab_path,
+            num_workers=num_workers)
+        if binary_ids:
+            token_ids_to_binary(id_paths[name], vocab_size)
 
     return id_paths, vocab_path, vocab_size
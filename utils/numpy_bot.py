@@ -0,0 +1,28 @@
+"""Pure-NumPy runtime for chat bots exported by utils/numpy_export.py.
+
+The runtime lives in webpage/deepchat/numpy_bot.py, since the webpage is
+deployed without the rest of this repository. It is loaded from its file
+here, as importing it through the deepchat package would import the web
+app (and flask) too.
+"""
+
+import os
+import importlib.util
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+_PATH = os.path.join(_PROJECT_ROOT, 'webpage', 'deepchat', 'numpy_bot.py')
+_spec = importlib.util.spec_from_file_location('deepchat_numpy_bot', _PATH)
+_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_module)
+
+PAD_ID = _module.PAD_ID
+GO_ID = _module.GO_ID
+EOS_ID = _module.EOS_ID
+NPZ_FILE = _module.NPZ_FILE
+GREEDY_TEMPERATURE = _module.GREEDY_TEMPERATURE
+GRUCell = _module.GRUCell
+LSTMCell = _module.LSTMCell
+MultiCell = _module.MultiCell
+LuongAttention = _module.LuongAttention
+DecoderState = _module.DecoderState
+NumpyBot = _module.NumpyBot
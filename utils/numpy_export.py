@@ -0,0 +1,215 @@
+"""Exports frozen chat bots to the pure-NumPy runtime of utils/numpy_bot.py.
+
+export_npz reads the weights of the frozen graph (the constants that
+replaced its variables) and writes the ones used when chatting -- the
+embeddings, the encoder and decoder cells, the attention and the output
+projection -- to numpy_model.npz, along with the settings NumpyBot needs.
+The exported bot is then checked to respond like the frozen graph.
+
+Supported bots: BasicEncoder, BasicDecoder or AttentionDecoder with
+LuongAttention, GRU or LSTM cells of any number of layers, and no beam
+search.
+
+Usage (for a directory that already has a frozen_model.pb):
+    python -m utils.numpy_export --model_dir path_to/ckpt_dir
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import json
+import argparse
+
+import numpy as np
+import tensorflow as tf
+from utils import io_utils
+from utils import bot_freezer
+from utils import graph_optimizer
+from utils.numpy_bot import NumpyBot, NPZ_FILE, PAD_ID, GREEDY_TEMPERATURE
+
+
+def numpy_config(config):
+    """Returns the NumpyBot config of a bot, given its (parse_config) config.
+
+    Raises:
+        ValueError: if NumpyBot doesn't support the bot.
+    """
+    model_params = config['model_params']
+    encoder_class = model_params['encoder.class'].split('.')[-1]
+    decoder_class = model_params['decoder.class'].split('.')[-1]
+    base_cell = model_params['base_cell'].split('.')[-1]
+    if encoder_class != 'BasicEncoder':
+        raise ValueError("Unsupported encoder.class %s." % encoder_class)
+    if decoder_class not in ('BasicDecoder', 'AttentionDecoder'):
+        raise ValueError("Unsupported decoder.class %s." % decoder_class)
+    attention = decoder_class == 'AttentionDecoder'
+    if attention and model_params['attention_mechanism'] != 'LuongAttention':
+        raise ValueError("Unsupported attention_mechanism %s."
+                         % model_params['attention_mechanism'])
+    if model_params.get('beam_width', 1) > 1:
+        raise ValueError("Beam search is not supported.")
+    if 'GRU' in base_cell:
+        cell = 'gru'
+    elif 'LSTM' in base_cell:
+        cell = 'lstm'
+    else:
+        raise ValueError("Unsupported base_cell %s." % base_cell)
+    return {'cell': cell,
+            'num_layers': model_params['num_layers'],
+            'attention': attention,
+            'max_seq_len': config['dataset_params']['max_seq_len'],
+            'temperature': model_params['temperature']}
+
+
+def frozen_arrays(model_dir):
+    """Returns the dictionary of the constants of model_dir/frozen_model.pb,
+    keyed by name. Frozen variables keep their variable names."""
+    graph_def = graph_optimizer.read_graph_def(
+        os.path.join(model_dir, graph_optimizer.FROZEN_FILE))
+    return {node.name: tf.make_ndarray(node.attr['value'].tensor)
+            for node in graph_def.node if node.op == 'Const'}
+
+
+def _find(arrays, pattern):
+    """Returns the array whose name fully matches pattern.
+
+    Raises:
+        ValueError: if not exactly one name matches.
+    """
+    names = [name for name in arrays if re.match(pattern + '$', name)]
+    if len(names) != 1:
+        raise ValueError("Expected one weight matching %s, found %r."
+                         % (pattern, names))
+    return arrays[names[0]]
+
+
+def cell_arrays(arrays, scope, name, config):
+    """Returns the weights of each layer of the cell run in scope, keyed by
+    '<name>/cell_<layer>/<weight>'.
+
+    Variable names differ across TensorFlow versions (e.g. 'weights' or
+    'kernel') and with the cell wrappers, so they are matched loosely.
+    """
+    weights = {}
+    for i in range(config['num_layers']):
+        layer = 'cell_%d/' % i if config['num_layers'] > 1 else ''
+        prefix = re.escape(scope) + '/(.*/)?' + layer
+        key = '%s/cell_%d/' % (name, i)
+        if config['cell'] == 'gru':
+            for part in ('gates', 'candidate'):
+                weights[key + part + '_kernel'] = _find(
+                    arrays, prefix + 'gru_cell/%s/(kernel|weights)' % part)
+                weights[key + part + '_bias'] = _find(
+                    arrays, prefix + 'gru_cell/%s/(bias|biases)' % part)
+        else:
+            weights[key + 'kernel'] = _find(
+                arrays, prefix + '(basic_)?lstm_cell/(kernel|weights)')
+            weights[key + 'bias'] = _find(
+                arrays, prefix + '(basic_)?lstm_cell/(bias|biases)')
+    return weights
+
+
+def numpy_arrays(arrays, config):
+    """Returns the weights of NumpyBot, keyed as in numpy_model.npz, from
+    the frozen arrays of a bot."""
+    weights = {'encoder/embedding': arrays['encoder/embed_tensor'],
+               'decoder/embedding': arrays['decoder/embed_tensor'],
+               'projection/w': arrays['decoder/projection_tensors/w'],
+               'projection/b': arrays['decoder/projection_tensors/b']}
+    weights.update(cell_arrays(arrays, 'encoder', 'encoder', config))
+    weights.update(cell_arrays(arrays, 'decoder/decoder_rnn', 'decoder', config))
+    if config['attention']:
+        weights['attention/memory_kernel'] = _find(
+            arrays, r'decoder/(.*/)?memory_layer/kernel')
+        weights['attention/attention_kernel'] = _find(
+            arrays, r'decoder/(.*/)?attention_layer/kernel')
+    return weights
+
+
+def random_inputs(vocab_size, num_sentences=8, max_len=10, seed=0):
+    """Returns a batch of random (padded) encoder inputs of various lengths."""
+    random_state = np.random.RandomState(seed)
+    lengths = random_state.randint(1, max_len + 1, size=num_sentences)
+    inputs = np.full([num_sentences, lengths.max()], PAD_ID, dtype=np.int32)
+    for i, length in enumerate(lengths):
+        # Token ids below 4 are the special symbols (PAD, GO, EOS, UNK).
+        inputs[i, :length] = random_state.randint(4, vocab_size, size=length)
+    return inputs
+
+
+def verify(model_dir, bot, vocab_size):
+    """Raises ValueError unless bot responds to random inputs with the same
+    token ids as the frozen graph in model_dir (which must decode greedily).
+
+    The reference is frozen_model.pb, where the weights come from, even if
+    model_dir also has an optimized (possibly 8-bit) graph.
+    """
+    inputs = random_inputs(vocab_size)
+    tensors, graph = bot_freezer.unfreeze_bot(model_dir,
+                                              graph_optimizer.FROZEN_FILE)
+    with tf.Session(graph=graph) as sess:
+        # Graphs frozen before batched decoding only accept one sentence.
+        if tensors['inputs'].shape[0].value == 1:
+            batches = [row[None, :np.sum(row != PAD_ID)] for row in inputs]
+        else:
+            batches = [inputs]
+        for batch in batches:
+            expected = sess.run(tensors['outputs'],
+                                feed_dict={tensors['inputs']: batch})
+            if not np.array_equal(bot(batch), expected):
+                raise ValueError("NumpyBot responses differ from the ones "
+                                 "of the frozen graph in %s." % model_dir)
+
+
+def export_npz(model_dir, check=True):
+    """Writes model_dir/numpy_model.npz from model_dir/frozen_model.pb.
+
+    Args:
+        model_dir: directory containing frozen_model.pb and config.yml.
+        check: if True (and the bot decodes greedily), check that NumpyBot
+            responds exactly like the frozen graph.
+
+    The file is only written if the check passes. An existing file is left
+    as it was otherwise.
+
+    Returns:
+        The path of the written file.
+
+    Raises:
+        ValueError: if NumpyBot doesn't support the bot, or (if check) its
+            responses differ from the ones of the frozen graph.
+    """
+    config = io_utils.parse_config(pretrained_dir=model_dir)
+    np_config = numpy_config(config)
+    weights = numpy_arrays(frozen_arrays(model_dir), np_config)
+
+    path = os.path.join(model_dir, NPZ_FILE)
+    # Write to a temporary file first, so that a bot failing the check (or
+    # an interrupted export) doesn't replace the file served by the webpage.
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, config=np.array(json.dumps(np_config)),
+                        **weights)
+    try:
+        bot = NumpyBot.load(tmp_path)
+        if check and np_config['temperature'] < GREEDY_TEMPERATURE:
+            verify(model_dir, bot, config['dataset_params']['vocab_size'])
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    print("Exported %d weights (%.1f MB) to %s." % (
+        len(weights), bot.memory_size / 2**20, path))
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--model_dir', required=True,
+                        help='Directory containing frozen_model.pb.')
+    parser.add_argument('--no_check', action='store_true',
+                        help="Don't compare responses with the frozen graph.")
+    args = parser.parse_args()
+    export_npz(args.model_dir, check=not args.no_check)
@@ -0,0 +1,26 @@
+"""Tokenizer and vocabulary lookup shared by data preprocessing and serving.
+
+The implementation lives in webpage/deepchat/vocab.py, since the webpage is
+deployed without the rest of this repository. It is loaded from its file
+here, as importing it through the deepchat package would import the web
+app (and flask) too.
+"""
+
+import os
+import importlib.util
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+_PATH = os.path.join(_PROJECT_ROOT, 'webpage', 'deepchat', 'vocab.py')
+_spec = importlib.util.spec_from_file_location('deepchat_vocab', _PATH)
+_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_module)
+
+PAD_ID = _module.PAD_ID
+GO_ID = _module.GO_ID
+EOS_ID = _module.EOS_ID
+UNK_ID = _module.UNK_ID
+tokenize = _module.tokenize
+encode_batch = _module.encode_batch
+decode_word = _module.decode_word
+detokenize = _module.detokenize
+Vocabulary = _module.Vocabulary
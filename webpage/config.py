@@ -21,6 +21,38 @@ class Config:
     BASIC_AUTH_USERNAME = os.getenv('BASIC_AUTH_USERNAME', 'admin')
     BASIC_AUTH_PASSWORD = os.getenv('BASIC_AUTH_PASSWORD', 'password')
 
+    # Chat requests are answered in batches of at most BATCH_MAX_SIZE, each
+    # waiting at most BATCH_MAX_WAIT_MS for other requests to join it.
+    BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 32))
+    BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', 5))
+    # Number of (temperature 0) responses cached per bot.
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+    # Frozen models loaded when the app starts, and the total size (in MB)
+    # of frozen weights kept loaded (0 for no limit).
+    MODEL_POOL_NAMES = os.getenv('MODEL_POOL_NAMES',
+                                 'reddit,cornell,ubuntu').split(',')
+    MODEL_POOL_MEMORY_MB = float(os.getenv('MODEL_POOL_MEMORY_MB', 0))
+    # Seconds a chat request waits for its bot to be loaded before it is
+    # answered with a 503 (the bot keeps loading in the background). 0 to
+    # wait until it is loaded.
+    MODEL_POOL_LOAD_TIMEOUT = float(os.getenv('MODEL_POOL_LOAD_TIMEOUT', 5))
+    # Run the bots with 'tensorflow' (frozen_model.pb), or with 'numpy'
+    # (numpy_model.npz, see utils/numpy_export.py in the main repository).
+    # Only 'numpy' streams responses word by word on /chat/<name>/stream:
+    # the frozen graph decodes whole responses, which are sent at once.
+    BOT_RUNTIME = os.getenv('BOT_RUNTIME', 'tensorflow')
+    # Sizes of the thread pools of each bot session (0 for TensorFlow's
+    # default of one thread per core).
+    BOT_INTRA_OP_THREADS = int(os.getenv('BOT_INTRA_OP_THREADS', 0))
+    BOT_INTER_OP_THREADS = int(os.getenv('BOT_INTER_OP_THREADS', 0))
+    # Number of worker processes serving each bot (0 to run the bots in the
+    # web server process), and whether to pin each worker to its own cores.
+    # See benchmarks/worker_pool.py in the main repository to pick them.
+    BOT_WORKERS = int(os.getenv('BOT_WORKERS', 0))
+    BOT_PIN_WORKERS = os.getenv('BOT_PIN_WORKERS', 'false').lower() == 'true'
+    # Seconds between two writes of the logged chat turns to the database.
+    TURN_LOG_FLUSH_SECONDS = float(os.getenv('TURN_LOG_FLUSH_SECONDS', 1))
+
     @staticmethod
     def init_app(app):
         pass
@@ -34,6 +66,8 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    # Bots are loaded on first request only.
+    MODEL_POOL_NAMES = []
     # Path of our db file. Required by Flask-SQLAlchemy extension.
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'data_test.db')
 
@@ -1,6 +1,7 @@
 """deepchat/__init__.py: Initialize session objects."""
 
 import os
+from functools import partial
 from flask import Flask
 from flask_wtf import CSRFProtect
 from flask_moment import Moment
@@ -10,6 +11,9 @@ from flask_pagedown import PageDown
 from flask_sqlalchemy import SQLAlchemy
 from flask_admin import Admin
 from config import config
+from . import web_bot
+from .model_pool import ModelPool
+from .worker_pool import WorkerPool, split_cpus
 
 csrf = CSRFProtect()
 # Initialize our database.
@@ -77,6 +81,7 @@ def create_app(config_name):
     """
 
     from .main import main as main_blueprint
+    from .turn_logger import TurnLogger
 
     # Create flask application object, and
     # read/use info in config.py.
@@ -103,6 +108,36 @@ def create_app(config_name):
     api.init_app(app)
     app.register_blueprint(main_blueprint)
 
+    # Load the bots in the background, so they are warm by the time
+    # someone talks to them.
+    memory_budget = app.config['MODEL_POOL_MEMORY_MB'] * 1024 * 1024
+    load_bot = partial(web_bot.FrozenBot,
+                       is_testing=app.testing,
+                       cache_size=app.config['RESPONSE_CACHE_SIZE'],
+                       runtime=app.config['BOT_RUNTIME'],
+                       intra_op_threads=app.config['BOT_INTRA_OP_THREADS'],
+                       inter_op_threads=app.config['BOT_INTER_OP_THREADS'])
+    num_workers = app.config['BOT_WORKERS']
+    if num_workers > 0:
+        # Each bot is served by its own worker processes.
+        cpu_sets = None
+        if app.config['BOT_PIN_WORKERS']:
+            cpu_sets = split_cpus(num_workers)
+        load_bot = partial(WorkerPool,
+                           load_bot=load_bot,
+                           num_workers=num_workers,
+                           cpu_sets=cpu_sets)
+    app.model_pool = ModelPool(
+        load_bot,
+        memory_budget=memory_budget or None,
+        max_batch_size=app.config['BATCH_MAX_SIZE'],
+        max_wait_ms=app.config['BATCH_MAX_WAIT_MS'],
+        load_timeout=app.config['MODEL_POOL_LOAD_TIMEOUT'] or None)
+    app.model_pool.preload(app.config['MODEL_POOL_NAMES'])
+    # Chat turns are written to the database in the background.
+    app.turn_logger = TurnLogger(
+        app, flush_interval=app.config['TURN_LOG_FLUSH_SECONDS'])
+
     return app
 
 
@@ -0,0 +1,107 @@
+"""deepchat/batching.py: Micro-batching of chat requests.
+
+Requests handled concurrently by the web server are queued here, and a
+worker thread answers them in batches with one call to the bot's
+respond_batch, instead of one session run per request. Bots that can answer
+several batches at once (e.g. a WorkerPool) get one thread per batch in
+flight.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+
+class BatchingWorker:
+    """Collects sentences for up to max_wait_ms (or until max_batch_size of
+    them are waiting), responds to them together and fans the responses back
+    out to each caller.
+    """
+
+    def __init__(self, respond_batch, max_batch_size=32, max_wait_ms=5,
+                 num_threads=1):
+        """
+        Args:
+            respond_batch: callable mapping a list of sentences to the list
+                of responses, e.g. FrozenBot.respond_batch.
+            max_batch_size: maximum number of sentences per batch.
+            max_wait_ms: maximum time (in milliseconds) the first request of
+                a batch waits for others to join it.
+            num_threads: number of batches answered concurrently. Keep 1
+                unless respond_batch is safe to call from several threads.
+        """
+        self.respond_batch = respond_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self._requests = Queue()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(num_threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, sentence):
+        """Returns a Future that will hold the response to sentence."""
+        if self._closed:
+            raise RuntimeError("BatchingWorker is closed.")
+        future = Future()
+        self._requests.put((sentence, future))
+        return future
+
+    def __call__(self, sentence, timeout=None):
+        """Blocks until the response to sentence is ready, and returns it."""
+        return self.submit(sentence).result(timeout=timeout)
+
+    def close(self):
+        """Stops the worker once the requests already queued are answered."""
+        self._closed = True
+        self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _next_batch(self):
+        """Waits for a request, then for more until the batch is full or
+        max_wait has passed. Returns None when the worker was closed."""
+        request = self._requests.get()
+        if request is None:
+            # Let the other threads stop too.
+            self._requests.put(None)
+            return None
+        batch = [request]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self._requests.get(
+                    timeout=max(deadline - time.time(), 0))
+            except Empty:
+                break
+            if request is None:
+                # Answer this last batch, then stop.
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            sentences, futures = zip(*batch)
+            try:
+                responses = self.respond_batch(list(sentences))
+            except Exception as e:
+                if len(batch) == 1:
+                    futures[0].set_exception(e)
+                    continue
+                # Respond to each sentence alone, so that the one(s) at fault
+                # don't fail the others.
+                for sentence, future in batch:
+                    try:
+                        future.set_result(self.respond_batch([sentence])[0])
+                    except Exception as e:
+                        future.set_exception(e)
+            else:
+                for future, response in zip(futures, responses):
+                    future.set_result(response)
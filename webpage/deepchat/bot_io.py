@@ -0,0 +1,54 @@
+"""deepchat/bot_io.py: Batched inputs and outputs of the chat bots.
+
+Builds the encoder inputs of a batch of tokenized sentences, and reads the
+responses out of the decoded outputs. Serving (web_bot.py) and the main
+repository (utils/io_utils.py, which loads this file) use the same
+functions, so that training, freezing and serving batch sentences alike.
+"""
+
+import numpy as np
+
+# Enumerations of the special vocabulary symbols (see vocab.py).
+PAD_ID = 0
+EOS_ID = 2
+
+
+def encoder_batch(token_ids):
+    """Builds the user_input feed for a batch of tokenized sentences.
+
+    Args:
+        token_ids: list of token-id lists, one per sentence.
+
+    Returns:
+        int32 array of shape [len(token_ids), max_len], where each row is a
+        reversed sentence followed by PAD_IDs.
+    """
+    max_len = max(len(ids) for ids in token_ids)
+    batch = np.full((len(token_ids), max_len), PAD_ID, dtype=np.int32)
+    for i, ids in enumerate(token_ids):
+        batch[i, :len(ids)] = ids[::-1]
+    return batch
+
+
+def length_batches(token_ids):
+    """Returns the indices of token_ids grouped by sentence length (in order
+    of first appearance), for graphs whose encoder doesn't take the sequence
+    lengths (see uses_sequence_lengths in utils/bot_freezer.py). Their
+    encoder runs over the padding of shorter sentences, so the response to
+    a sentence would depend on the others of its batch; sentences of the
+    same length need no padding.
+    """
+    batches = {}
+    for i, ids in enumerate(token_ids):
+        batches.setdefault(len(ids), []).append(i)
+    return list(batches.values())
+
+
+def response_ids(response):
+    """Returns the token ids of a decoded response up to (excluding) its
+    first EOS_ID. Responses of a batch are padded with PAD_ID after EOS_ID.
+    """
+    response = list(response)
+    if EOS_ID in response:
+        return response[:response.index(EOS_ID)]
+    return response
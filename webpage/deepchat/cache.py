@@ -0,0 +1,74 @@
+"""deepchat/cache.py: Bounded LRU cache of bot responses.
+
+Chat traffic repeats the same short inputs ("hi", "how are you") all the
+time. Below GREEDY_TEMPERATURE, a bot decodes greedily and always gives the
+same response to the same token ids, so those can be answered from here
+without running the model.
+"""
+
+import threading
+from collections import OrderedDict
+
+from .numpy_bot import GREEDY_TEMPERATURE
+
+
+class ResponseCache:
+    """Thread-safe LRU mapping of keys to responses, with hit/miss/eviction
+    counters. Keys are built with ResponseCache.key.
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        Args:
+            max_size: maximum number of responses kept. Least recently used
+                responses are evicted first. 0 disables the cache.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_name, temperature, token_ids):
+        """Returns the cache key of a (normalized) tokenized input. None
+        when temperature >= GREEDY_TEMPERATURE, since responses are then
+        sampled."""
+        if temperature >= GREEDY_TEMPERATURE:
+            return None
+        return model_name, temperature, tuple(token_ids)
+
+    def get(self, key):
+        """Returns the cached response for key, or None."""
+        if key is None:
+            return None
+        with self._lock:
+            response = self._responses.get(key)
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._responses.move_to_end(key)
+            return response
+
+    def put(self, key, response):
+        if key is None or self.max_size <= 0:
+            return
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Returns a dict of the cache counters and size."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._responses)}
+
+    def __len__(self):
+        return len(self._responses)
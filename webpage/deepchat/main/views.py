@@ -2,13 +2,14 @@ from datetime import datetime
 import os
 import yaml
 import json
+import logging
 
-from flask import make_response, flash
+from flask import make_response, flash, abort, Response, stream_with_context
 from werkzeug.exceptions import HTTPException
 from flask_admin.contrib import sqla
 
 from . import main
-from .. import db, web_bot, admin, basic_auth, api
+from .. import db, admin, basic_auth, api
 
 from flask import redirect, current_app
 from flask import render_template
@@ -19,6 +20,7 @@ from flask_restful import Resource, fields
 from .forms import ChatForm, UserForm
 from ..models import User, Chatbot, Conversation, Turn
 from .. import models
+from ..model_pool import ModelLoading
 from pydoc import locate
 
 
@@ -58,30 +60,17 @@ def plots():
                            user=session.get('user', 'Anon'))
 
 
-def update_database(user_message, bot_response):
-    """Fill database (db) with new input-response, and associated data."""
-
-    # 1. Get the User db.Model.
-    user = get_database_model('User', filter=session.get('user', 'Anon'))
-
-    # 2. Get the Chatbot db.Model.
-    bot_name = ChatAPI.bot_name
-    chatbot = get_database_model('Chatbot', filter=bot_name)
-
-    # 3. Get the Conversation db.Model.
+def update_database(user_message, bot_response, bot_name, chatbot_params):
+    """Log the new input-response, and associated data, to the database.
+    The turn is written in the background (see deepchat/turn_logger.py)."""
     if session.get('start_time') is None:
         session['start_time'] = datetime.utcnow()
-    conversation = get_database_model('Conversation',
-                                      filter=session.get('start_time'),
-                                      user=user,
-                                      chatbot=chatbot)
-
-    # 4. Get the Turn db.model. (called get adds it to the db if not there).
-    _ = get_database_model('Turn',
-                           user_message=user_message,
-                           chatbot_message=bot_response,
-                           conversation=conversation)
-    db.session.commit()
+    current_app.turn_logger.log(user_name=session.get('user', 'Anon'),
+                                bot_name=bot_name,
+                                start_time=session.get('start_time'),
+                                user_message=user_message,
+                                bot_message=bot_response,
+                                chatbot_params=chatbot_params)
 
 
 def get_database_model(class_name, filter=None, **kwargs):
@@ -117,36 +106,43 @@ class UserAPI(Resource):
         return {'name': user_model.name}
 
 
+def loading_response(bot_name):
+    """Returns the (flask-restful) 503 response of a request to a bot that
+    is still loading."""
+    return ({'response': "I'm waking up, please ask again in a moment.",
+             'bot_name': bot_name},
+            503,
+            {'Retry-After': '%d' % max(
+                1, current_app.config['MODEL_POOL_LOAD_TIMEOUT'])})
+
+
 class ChatAPI(Resource):
-    # Class attributes. This is convenient since we only want one active
-    # bot at any given time.
-    bot_name = 'Unk Bot'
-    bot = None
 
     def __init__(self, data_name):
-        if ChatAPI.bot_name != data_name:
-            ChatAPI.bot_name = data_name
-            ChatAPI.bot = web_bot.FrozenBot(frozen_model_dir=data_name,
-                                            is_testing=current_app.testing)
-            config = ChatAPI.bot.config
-            _ = get_database_model('Chatbot',
-                                   filter=ChatAPI.bot_name,
-                                   dataset=config['dataset'],
-                                   **config['model_params'])
-            db.session.commit()
-            # TODO: delete this after refactor rest of file.
-            session['data_name'] = data_name
+        self.bot_name = data_name
+        # TODO: delete this after refactor rest of file.
+        session['data_name'] = data_name
 
     def post(self):
         print('post received')
         print('request:', request)
         user_message = request.values.get('user_message')
         print('user_message = ', user_message)
-        bot_response = self.bot(user_message)
+        # Bots are preloaded and kept warm by the app's model pool.
+        try:
+            bot, worker = current_app.model_pool.acquire(self.bot_name)
+        except ModelLoading:
+            return loading_response(self.bot_name)
+        try:
+            bot_response = worker(user_message)
+        finally:
+            current_app.model_pool.release((bot, worker))
         print('resp:', bot_response)
-        update_database(user_message, bot_response)
+        update_database(user_message, bot_response, self.bot_name,
+                        chatbot_params=dict(dataset=bot.config['dataset'],
+                                            **bot.config['model_params']))
         return {'response': bot_response,
-                'bot_name': ChatAPI.bot_name}
+                'bot_name': self.bot_name}
 
 
 class RedditAPI(ChatAPI):
@@ -163,6 +159,76 @@ class UbuntuAPI(ChatAPI):
     def __init__(self):
         super(UbuntuAPI, self).__init__('ubuntu')
 
+
+def server_sent_event(data, event=None):
+    """Returns the text/event-stream message with the given (json) data."""
+    message = 'data: %s\n\n' % json.dumps(data)
+    if event is not None:
+        message = 'event: %s\n%s' % (event, message)
+    return message
+
+
+@main.route('/chat/<name>/stream')
+def chat_stream(name):
+    """Streams the response to the user_message query parameter as
+    server-sent events: a message with the text of the response so far for
+    each new word, then a 'done' event with the full response (or an
+    'error' event if the bot failed to respond).
+
+    Words are only sent as they are decoded by bots that can respond one
+    word at a time, i.e. FrozenBots with BOT_RUNTIME=numpy (see
+    FrozenBot.respond_stream). The response of other bots (tensorflow
+    runtime, or a WorkerPool) is sent once ready.
+    """
+    if name not in ('reddit', 'cornell', 'ubuntu'):
+        abort(404)
+    user_message = request.values.get('user_message', '')
+    # Reject what can't be answered before the stream starts: errors can't
+    # change the status once it did.
+    if not user_message.strip():
+        abort(400, 'Missing user_message.')
+    # The bot is released when the stream is closed (see below).
+    try:
+        entry = current_app.model_pool.acquire(name)
+    except ModelLoading:
+        abort(503, 'Bot %s is still loading.' % name)
+    bot, worker = entry
+    if hasattr(bot, 'respond_stream'):
+        responses = bot.respond_stream(user_message)
+    else:
+        responses = (worker(user_message) for _ in range(1))
+    # The session cookie is sent with the headers, before the turn is logged.
+    if session.get('start_time') is None:
+        session['start_time'] = datetime.utcnow()
+
+    def events():
+        bot_response = ''
+        try:
+            for bot_response in responses:
+                yield server_sent_event({'response': bot_response})
+        except Exception:
+            logging.exception("Bot %s failed to respond to %r.",
+                              name, user_message)
+            yield server_sent_event({'error': 'The bot failed to respond.',
+                                     'bot_name': name}, event='error')
+            return
+        yield server_sent_event({'response': bot_response, 'bot_name': name},
+                                event='done')
+        update_database(user_message, bot_response, name,
+                        chatbot_params=dict(dataset=bot.config['dataset'],
+                                            **bot.config['model_params']))
+
+    response = Response(stream_with_context(events()),
+                        mimetype='text/event-stream',
+                        # Don't let proxies buffer the stream.
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+    # Called even if the client disconnects before the stream starts.
+    pool = current_app.model_pool
+    response.call_on_close(lambda: pool.release(entry))
+    return response
+
+
 api.add_resource(UserAPI, '/user/')
 api.add_resource(RedditAPI, '/chat/reddit/')
 api.add_resource(CornellAPI, '/chat/cornell/')
@@ -0,0 +1,220 @@
+"""deepchat/model_pool.py: Warm pool of frozen bots, one per model name.
+
+Bots are loaded (graph import, session, vocabulary) by a background thread:
+all configured models at startup, and any model that was unloaded when it is
+requested again. Each loaded bot keeps its session open and answers requests
+through its own BatchingWorker, so switching between bots costs nothing once
+they are loaded.
+
+When the loaded bots exceed the memory budget, the least recently used ones
+are unloaded. Bots in use (see ModelPool.acquire) are never unloaded: a bot
+that is evicted or replaced while in use is closed once its last user
+releases it.
+"""
+
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from .batching import BatchingWorker
+
+
+class ModelLoading(Exception):
+    """Raised when a bot is still loading after the requested timeout. The
+    load goes on in the background."""
+
+
+class ModelPool:
+    """Thread-safe registry of loaded bots (with their batching workers),
+    keyed by model name.
+    """
+
+    def __init__(self, load_bot, memory_budget=None,
+                 max_batch_size=32, max_wait_ms=5, load_timeout=None):
+        """
+        Args:
+            load_bot: callable mapping a model name to a loaded bot, e.g.
+                web_bot.FrozenBot. Bots are expected to have respond_batch,
+                memory_size (in bytes) and freeze (to close the session).
+                Bots with a concurrency attribute (e.g. WorkerPool) are sent
+                up to that many batches at once.
+            memory_budget: maximum total memory_size (in bytes) of loaded
+                bots. None for no limit. The most recently used bot is
+                always kept, even if it alone exceeds the budget.
+            max_batch_size, max_wait_ms: see BatchingWorker.
+            load_timeout: maximum seconds a request waits for its bot to be
+                loaded before ModelLoading is raised. None to wait until the
+                bot is loaded.
+        """
+        self.load_bot = load_bot
+        self.memory_budget = memory_budget
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.load_timeout = load_timeout
+        # Loaded (bot, worker) pairs, from least to most recently used.
+        self._models = OrderedDict()
+        # Futures of the loads in progress.
+        self._loading = {}
+        # Number of users (see acquire) of each (bot, worker) pair, and the
+        # pairs to unload once they have none.
+        self._users = Counter()
+        self._unload_when_released = set()
+        self._lock = threading.Lock()
+        self._loader = ThreadPoolExecutor(max_workers=1)
+
+    def preload(self, names):
+        """Starts loading each of names in the background, and returns
+        the list of their futures."""
+        with self._lock:
+            return [self._load_async(name) for name in names]
+
+    def reload(self, name):
+        """Loads a fresh copy of name in the background. The loaded copy
+        (if any) keeps answering requests until the new one replaces it."""
+        with self._lock:
+            return self._load_async(name)
+
+    def acquire(self, name, timeout=None):
+        """Returns the (bot, worker) of name, which won't be unloaded until
+        it is given back to release. Starts loading name in the background
+        if needed.
+
+        Args:
+            timeout: maximum seconds to wait for the bot to be loaded
+                (default: load_timeout).
+
+        Raises:
+            ModelLoading: if the bot is still loading after timeout.
+        """
+        if timeout is None:
+            timeout = self.load_timeout
+        while True:
+            with self._lock:
+                entry = self._models.get(name)
+                if entry is not None:
+                    self._models.move_to_end(name)
+                    self._users[entry] += 1
+                    return entry
+                future = self._load_async(name)
+            try:
+                future.result(timeout=timeout)
+            except TimeoutError:
+                raise ModelLoading("Bot %s is still loading." % name)
+
+    def release(self, entry):
+        """Gives back a (bot, worker) returned by acquire."""
+        with self._lock:
+            self._users[entry] -= 1
+            if self._users[entry] > 0:
+                return
+            del self._users[entry]
+            if entry in self._unload_when_released:
+                self._unload_when_released.remove(entry)
+                unloaded = [entry]
+            else:
+                # It may have been kept over the budget while in use.
+                unloaded = self._evict()
+        for old_entry in unloaded:
+            self._unload(old_entry)
+
+    def get(self, name, timeout=None):
+        """Returns the (bot, worker) of name, e.g. to read the bot config.
+        Unlike with acquire, the bot may be unloaded at any time."""
+        entry = self.acquire(name, timeout)
+        self.release(entry)
+        return entry
+
+    def __call__(self, name, sentence):
+        """Returns the response of bot name to sentence.
+
+        Raises:
+            ModelLoading: if the bot is still loading after load_timeout.
+        """
+        entry = self.acquire(name)
+        try:
+            return entry[1](sentence)
+        finally:
+            self.release(entry)
+
+    def loaded(self):
+        """Returns the names of the loaded bots, least recently used first."""
+        with self._lock:
+            return list(self._models)
+
+    def close(self):
+        """Unloads all bots."""
+        self._loader.shutdown(wait=True)
+        with self._lock:
+            unloaded = self._defer_in_use(list(self._models.values()))
+            self._models.clear()
+        for entry in unloaded:
+            self._unload(entry)
+
+    def _load_async(self, name):
+        # Must hold self._lock.
+        future = self._loading.get(name)
+        if future is None:
+            future = self._loader.submit(self._load, name)
+            self._loading[name] = future
+        return future
+
+    def _load(self, name):
+        try:
+            bot = self.load_bot(name)
+        except Exception:
+            logging.exception("Could not load bot %s.", name)
+            with self._lock:
+                del self._loading[name]
+            raise
+        worker = BatchingWorker(bot.respond_batch,
+                                max_batch_size=self.max_batch_size,
+                                max_wait_ms=self.max_wait_ms,
+                                num_threads=getattr(bot, 'concurrency', 1))
+        entry = (bot, worker)
+        with self._lock:
+            unloaded = [self._models.pop(name)] if name in self._models else []
+            self._models[name] = entry
+            del self._loading[name]
+            unloaded = self._defer_in_use(unloaded) + self._evict()
+        for old_entry in unloaded:
+            self._unload(old_entry)
+        return entry
+
+    def _defer_in_use(self, entries):
+        """Returns the entries that are not in use, and marks the others to
+        be unloaded when released. Must hold self._lock."""
+        unused = []
+        for entry in entries:
+            if self._users[entry]:
+                self._unload_when_released.add(entry)
+            else:
+                unused.append(entry)
+        return unused
+
+    def _evict(self):
+        """Removes least recently used bots that are not in use until the
+        rest fit the memory budget. Must hold self._lock. Returns the removed
+        entries."""
+        evicted = []
+        if self.memory_budget is None:
+            return evicted
+        total = sum(bot.memory_size for bot, _ in self._models.values())
+        # The most recently used bot is always kept.
+        for name in list(self._models)[:-1]:
+            if total <= self.memory_budget:
+                break
+            entry = self._models[name]
+            if self._users[entry]:
+                continue
+            logging.info("Unloading bot %s to fit the memory budget.", name)
+            del self._models[name]
+            total -= entry[0].memory_size
+            evicted.append(entry)
+        return evicted
+
+    @staticmethod
+    def _unload(entry):
+        bot, worker = entry
+        worker.close()
+        bot.freeze()
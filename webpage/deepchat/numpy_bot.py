@@ -0,0 +1,314 @@
+"""Pure-NumPy runtime for chat bots exported by utils/numpy_export.py.
+
+NumpyBot runs the same computation as the chat graph of DynamicBot (a
+BasicEncoder, then a BasicDecoder or an AttentionDecoder with Luong
+attention, decoding greedily or by sampling) from the weights stored in
+numpy_model.npz, without TensorFlow. Greedy responses are the same token
+ids as the ones of the frozen graph; sampled responses follow the same
+distribution. Responses can also be decoded one word at a time (see
+NumpyBot.initial_state and NumpyBot.step), e.g. to stream them.
+
+This module only depends on NumPy, so that the webpage can run it without
+TensorFlow or the rest of the repository. utils/numpy_bot.py loads it from
+here for the exporter and the tests.
+"""
+
+import json
+from collections import namedtuple
+import numpy as np
+
+# Enumerations of the special vocabulary symbols (see utils/vocab.py).
+PAD_ID = 0
+GO_ID = 1
+EOS_ID = 2
+
+# Name of the exported file, next to frozen_model.pb.
+NPZ_FILE = 'numpy_model.npz'
+
+# Bots with a lower temperature decode greedily (argmax), like the TensorFlow
+# decoders (chatbot/components/decoders.py), and always give the same
+# response to the same input.
+GREEDY_TEMPERATURE = 0.02
+
+
+def _sigmoid(x):
+    with np.errstate(over='ignore'):
+        return 1. / (1. + np.exp(-x))
+
+
+def _softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+def _map_state(fn, *states):
+    """Applies fn to the matching arrays of (nested tuples of) states."""
+    if isinstance(states[0], tuple):
+        return tuple(_map_state(fn, *parts) for parts in zip(*states))
+    return fn(*states)
+
+
+class GRUCell:
+    """tf.contrib.rnn.GRUCell. The state is the output."""
+
+    def __init__(self, gates_kernel, gates_bias, candidate_kernel,
+                 candidate_bias):
+        self.gates_kernel = gates_kernel
+        self.gates_bias = gates_bias
+        self.candidate_kernel = candidate_kernel
+        self.candidate_bias = candidate_bias
+        self.state_size = candidate_bias.shape[0]
+        self.output_size = self.state_size
+
+    def zero_state(self, batch_size):
+        return np.zeros([batch_size, self.state_size], np.float32)
+
+    def __call__(self, inputs, state):
+        gates = _sigmoid(np.dot(np.concatenate([inputs, state], 1),
+                                self.gates_kernel) + self.gates_bias)
+        r, u = np.split(gates, 2, axis=1)
+        c = np.tanh(np.dot(np.concatenate([inputs, r * state], 1),
+                           self.candidate_kernel) + self.candidate_bias)
+        h = u * state + (1. - u) * c
+        return h, h
+
+
+class LSTMCell:
+    """tf.contrib.rnn.LSTMCell (or BasicLSTMCell) without peepholes or
+    projection. The state is the tuple (c, h), and the output is h."""
+
+    forget_bias = 1.0
+
+    def __init__(self, kernel, bias):
+        self.kernel = kernel
+        self.bias = bias
+        self.state_size = bias.shape[0] // 4
+        self.output_size = self.state_size
+
+    def zero_state(self, batch_size):
+        return (np.zeros([batch_size, self.state_size], np.float32),
+                np.zeros([batch_size, self.state_size], np.float32))
+
+    def __call__(self, inputs, state):
+        c, h = state
+        i, j, f, o = np.split(np.dot(np.concatenate([inputs, h], 1),
+                                     self.kernel) + self.bias, 4, axis=1)
+        c = _sigmoid(f + self.forget_bias) * c + _sigmoid(i) * np.tanh(j)
+        h = _sigmoid(o) * np.tanh(c)
+        return h, (c, h)
+
+
+class MultiCell:
+    """Stacked cells (tf.contrib.rnn.MultiRNNCell). The state is the tuple
+    of the layer states."""
+
+    def __init__(self, cells):
+        self.cells = cells
+        self.output_size = cells[-1].output_size
+
+    def zero_state(self, batch_size):
+        return tuple(cell.zero_state(batch_size) for cell in self.cells)
+
+    def __call__(self, inputs, state):
+        new_state = []
+        for cell, layer_state in zip(self.cells, state):
+            inputs, layer_state = cell(inputs, layer_state)
+            new_state.append(layer_state)
+        return inputs, tuple(new_state)
+
+
+class LuongAttention:
+    """The attention of SimpleAttentionWrapper (chatbot/components/base/_rnn.py)
+    with a tf.contrib.seq2seq.LuongAttention mechanism."""
+
+    def __init__(self, memory_kernel, attention_kernel):
+        self.memory_kernel = memory_kernel
+        self.attention_kernel = attention_kernel
+        self.attention_size = attention_kernel.shape[1]
+
+    def keys(self, memory):
+        return np.dot(memory, self.memory_kernel)
+
+    def __call__(self, query, memory, keys, mask):
+        """Returns the attention (output) of the cell output query, over
+        memory [batch_size, max_time, size] where mask is True."""
+        if memory.shape[1] == 0:
+            # Nothing to attend to (every input is empty).
+            context = np.zeros([len(query), memory.shape[2]], np.float32)
+        else:
+            score = np.einsum('bs,bts->bt', query, keys)
+            # The mechanism returns normalized alignments, which the wrapper
+            # (masks and) normalizes again.
+            # Rows of empty inputs (all masked) are nan here, and replaced
+            # by the mask below.
+            with np.errstate(invalid='ignore'):
+                alignments = _softmax(np.where(mask, score, -np.inf))
+            alignments = _softmax(np.where(mask, alignments,
+                                           np.finfo(np.float32).min))
+            context = np.einsum('bt,bts->bs', alignments, memory)
+        return np.tanh(np.dot(np.concatenate([query, context], 1),
+                              self.attention_kernel))
+
+
+# What the decoder needs from one step to the next: the cell state (with
+# the attention of the previous step, if any) and the encoder outputs
+# attended to, their keys and their mask (None without attention).
+DecoderState = namedtuple('DecoderState', ['cell_state', 'memory', 'keys',
+                                           'mask'])
+
+
+class NumpyBot:
+    """Encodes user inputs and decodes responses with NumPy, from the
+    weights and settings exported to numpy_model.npz."""
+
+    def __init__(self, arrays, config):
+        """
+        Args:
+            arrays: dictionary of weights, keyed as in numpy_model.npz.
+            config: dictionary with keys 'cell' ('gru' or 'lstm'),
+                'num_layers', 'attention' (bool), 'max_seq_len' and
+                'temperature'.
+        """
+        self.arrays = arrays
+        self.config = config
+        self.max_seq_len = config['max_seq_len']
+        self.temperature = config['temperature']
+        self.encoder_embedding = arrays['encoder/embedding']
+        self.decoder_embedding = arrays['decoder/embedding']
+        self.projection = (arrays['projection/w'], arrays['projection/b'])
+        self.encoder_cell = self._cell('encoder')
+        self.decoder_cell = self._cell('decoder')
+        self.attention = None
+        if config['attention']:
+            self.attention = LuongAttention(arrays['attention/memory_kernel'],
+                                            arrays['attention/attention_kernel'])
+
+    @classmethod
+    def load(cls, path):
+        """Returns the NumpyBot exported to path."""
+        with np.load(path) as f:
+            config = json.loads(str(f['config']))
+            arrays = {k: f[k] for k in f.files if k != 'config'}
+        return cls(arrays, config)
+
+    @property
+    def memory_size(self):
+        """Size in bytes of the weights."""
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def _cell(self, name):
+        cells = []
+        for i in range(self.config['num_layers']):
+            prefix = '%s/cell_%d/' % (name, i)
+            if self.config['cell'] == 'gru':
+                cells.append(GRUCell(*[self.arrays[prefix + k] for k in [
+                    'gates_kernel', 'gates_bias',
+                    'candidate_kernel', 'candidate_bias']]))
+            else:
+                cells.append(LSTMCell(self.arrays[prefix + 'kernel'],
+                                      self.arrays[prefix + 'bias']))
+        if len(cells) == 1:
+            return cells[0]
+        return MultiCell(cells)
+
+    def __call__(self, inputs, random_state=None):
+        """Returns the responses to inputs, like the outputs of the frozen
+        graph.
+
+        Args:
+            inputs: array of shape [batch_size, max_time] of (reversed)
+                token ids, padded with PAD_ID after each sentence.
+            random_state: (optional) np.random.RandomState used to sample
+                when temperature is not below GREEDY_TEMPERATURE.
+
+        Returns:
+            Array of shape [batch_size, time] with the response ids,
+            padded with PAD_ID after EOS_ID.
+        """
+        return np.stack(list(self.generate(inputs, random_state)), axis=1)
+
+    def generate(self, inputs, random_state=None):
+        """Yields the response ids to inputs one step at a time, as arrays
+        of shape [batch_size] (see __call__), until every response ended
+        or reached max_seq_len + 1 tokens (EOS_ID included)."""
+        inputs = np.asarray(inputs)
+        state = self.initial_state(inputs)
+        ids = np.full(len(inputs), GO_ID)
+        finished = np.zeros(len(inputs), bool)
+        for _ in range(self.max_seq_len + 1):
+            ids, state = self.step(ids, state, random_state)
+            # Sequences that already emitted EOS are padded from then on.
+            ids = np.where(finished, PAD_ID, ids)
+            finished |= ids == EOS_ID
+            yield ids
+            if finished.all():
+                break
+
+    def initial_state(self, inputs):
+        """Encodes inputs (see __call__) and returns the DecoderState of
+        the first decoding step."""
+        memory, state = self.encode(inputs)
+        if self.attention is None:
+            return DecoderState(state, None, None, None)
+        state = (state, np.zeros([len(inputs), self.attention.attention_size],
+                                 np.float32))
+        return DecoderState(state, memory, self.attention.keys(memory),
+                            inputs != PAD_ID)
+
+    def step(self, ids, state, random_state=None):
+        """Runs one decoding step.
+
+        Args:
+            ids: array of shape [batch_size] with the previous word ids
+                (GO_ID at the first step).
+            state: DecoderState returned by initial_state or the previous
+                step.
+            random_state: see __call__.
+
+        Returns:
+            The next word ids (shape [batch_size]) and DecoderState.
+        """
+        x = self.decoder_embedding[ids]
+        if self.attention is None:
+            output, cell_state = self.decoder_cell(x, state.cell_state)
+        else:
+            cell_state, attention = state.cell_state
+            output, cell_state = self.decoder_cell(
+                np.concatenate([x, attention], 1), cell_state)
+            output = self.attention(output, state.memory, state.keys,
+                                    state.mask)
+            cell_state = (cell_state, output)
+        w, b = self.projection
+        ids = self.sample(np.dot(output, w) + b, random_state)
+        return ids, state._replace(cell_state=cell_state)
+
+    def encode(self, inputs):
+        """Returns the encoder outputs [batch_size, max_time, state_size]
+        (zero past the end of each sentence) and final state of inputs."""
+        lengths = np.sum(inputs != PAD_ID, axis=1)
+        embedded = self.encoder_embedding[inputs]
+        state = self.encoder_cell.zero_state(len(inputs))
+        # Empty inputs (max_time 0) keep the zero state and have no outputs.
+        outputs = np.zeros([len(inputs), inputs.shape[1],
+                            self.encoder_cell.output_size], np.float32)
+        for t in range(inputs.shape[1]):
+            output, new_state = self.encoder_cell(embedded[:, t], state)
+            # Sentences that already ended keep their state.
+            running = (t < lengths)[:, None]
+            state = _map_state(lambda new, old: np.where(running, new, old),
+                               new_state, state)
+            outputs[:, t] = np.where(running, output, 0.)
+        return outputs, state
+
+    def sample(self, logits, random_state=None):
+        """Returns one word id per row of logits [batch_size, vocab_size]:
+        the argmax when temperature is (nearly) 0, else a sample of the
+        softmax of logits / temperature."""
+        if self.temperature < GREEDY_TEMPERATURE:
+            return np.argmax(logits, axis=-1)
+        random_state = random_state or np.random
+        probs = _softmax(logits.astype(np.float64) / self.temperature)
+        # Inverse transform sampling, one uniform draw per row.
+        draws = random_state.random_sample([len(probs), 1])
+        ids = np.sum(np.cumsum(probs, axis=-1) < draws, axis=-1)
+        return np.minimum(ids, probs.shape[-1] - 1)
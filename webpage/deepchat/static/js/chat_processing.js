@@ -31,22 +31,68 @@ $(document).ready(function() {
 
         chatLog.append(messageRow);
 
-        // Submit a POST request to collect user input.
-        $.post('/chat/' + dataName + '/', {
-            "user_message": userMessage.val()
-        }, function(data) {
-            userMessage.val("");
-            console.log('Response received from bot', data.bot_name)
-            $('#'+dataName+'-chat-log').append($('<div/>').addClass('row message')
-                    .append($('<div/>')
-                            .addClass('bot-name text-left col-md-2 col-sm-2')
-                            .text('Botty'))
-                    .append($('<div/>')
-                            .addClass('bot-message text-left col-md-8 col-sm-9')
-                            .text(data.response))
-                    .append($('<hr/>')));
+        let message = userMessage.val();
+        userMessage.val("");
+
+        // Row of the bot response, filled in as the words arrive.
+        let botMessage = $('<div/>')
+                .addClass('bot-message text-left col-md-8 col-sm-9');
+        function showResponse(response) {
+            botMessage.text(response);
             chatLog.scrollTop(chatLog.first().scrollHeight);
+        }
+        chatLog.append($('<div/>').addClass('row message')
+                .append($('<div/>')
+                        .addClass('bot-name text-left col-md-2 col-sm-2')
+                        .text('Botty'))
+                .append(botMessage)
+                .append($('<hr/>')));
+
+        // Submit a POST request to collect the whole response at once.
+        function postMessage() {
+            $.post('/chat/' + dataName + '/', {
+                "user_message": message
+            }, function(data) {
+                console.log('Response received from bot', data.bot_name)
+                showResponse(data.response);
+            }).fail(function(xhr) {
+                // E.g. the bot is still loading.
+                if (xhr.responseJSON) {
+                    showResponse(xhr.responseJSON.response);
+                }
+            });
+        }
+
+        if (!window.EventSource) {
+            postMessage();
+            return;
+        }
+
+        // Stream the response: each message holds the text so far, and
+        // the 'done' event the full response.
+        let source = new EventSource('/chat/' + dataName + '/stream?' +
+                                     $.param({"user_message": message}));
+        let received = false;
+        source.onmessage = function(e) {
+            received = true;
+            showResponse(JSON.parse(e.data).response);
+        };
+        source.addEventListener('done', function(e) {
+            source.close();
+            let data = JSON.parse(e.data);
+            console.log('Response received from bot', data.bot_name)
+            showResponse(data.response);
         });
+        // Called for the 'error' event of the server too, which has data.
+        source.onerror = function(e) {
+            // Don't let the browser reconnect (and ask again).
+            source.close();
+            if (e.data) {
+                showResponse(JSON.parse(e.data).error);
+            } else if (!received) {
+                postMessage();
+            }
+        };
     });
 
     userMessage.on('keyup', function(e) {
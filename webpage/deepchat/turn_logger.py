@@ -0,0 +1,144 @@
+"""deepchat/turn_logger.py: Background logging of chat turns to the database.
+
+Chat requests only queue their turn here. A writer thread stores the queued
+turns every flush_interval seconds, in one transaction, looking up the ids
+of their User, Chatbot and Conversation rows in memory (and in the database
+only the first time each is seen).
+"""
+
+import atexit
+import logging
+import threading
+import time
+from queue import Queue, Empty
+
+from . import db
+from .models import User, Chatbot, Conversation, Turn
+
+
+class TurnLogger:
+    """Queues chat turns and writes them in batches from a worker thread."""
+
+    def __init__(self, app, flush_interval=1.0):
+        """
+        Args:
+            app: the flask application, whose context the writer uses.
+            flush_interval: seconds between two writes of queued turns.
+        """
+        self.app = app
+        self.flush_interval = flush_interval
+        self._turns = Queue()
+        # Primary keys of the rows referenced by turns, by name/start time.
+        self._user_ids = {}
+        self._chatbot_ids = {}
+        self._conversation_ids = {}
+        self._closed = False
+        # Keeps turns from being queued after the writer's stop signal.
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, user_name, bot_name, start_time, user_message, bot_message,
+            chatbot_params=None):
+        """Queues a turn. Returns immediately.
+
+        Turns logged after close (e.g. by requests still being answered at
+        exit) are dropped, with a warning.
+
+        Args:
+            user_name: name of the User.
+            bot_name: name of the Chatbot.
+            start_time: start time of the Conversation.
+            user_message, bot_message: the messages of the turn.
+            chatbot_params: keyword arguments of Chatbot, used if bot_name
+                is not in the database yet.
+        """
+        with self._lock:
+            if not self._closed:
+                self._turns.put((user_name, bot_name, start_time,
+                                 user_message, bot_message, chatbot_params))
+                return
+        logging.warning("TurnLogger is closed: dropped a turn of %s with %s.",
+                        user_name, bot_name)
+
+    def flush(self):
+        """Blocks until all turns queued so far are written."""
+        self._turns.join()
+
+    def close(self):
+        """Writes the queued turns and stops the writer."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._turns.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._turns.get()]
+            deadline = time.time() + self.flush_interval
+            try:
+                # Collect everything queued until the next flush.
+                while batch[-1] is not None:
+                    batch.append(self._turns.get(
+                        timeout=max(deadline - time.time(), 0)))
+            except Empty:
+                pass
+            turns = [turn for turn in batch if turn is not None]
+            try:
+                if turns:
+                    with self.app.app_context():
+                        self._write(turns)
+            except Exception:
+                logging.exception("Could not log %d chat turns.", len(turns))
+            finally:
+                for _ in batch:
+                    self._turns.task_done()
+            if batch[-1] is None:
+                return
+
+    def _write(self, turns):
+        """Inserts turns in a single transaction."""
+        try:
+            rows = []
+            for (user_name, bot_name, start_time,
+                 user_message, bot_message, chatbot_params) in turns:
+                user_id = self._get_id(self._user_ids, User,
+                                       'name', user_name)
+                chatbot_id = self._get_id(self._chatbot_ids, Chatbot,
+                                          'name', bot_name,
+                                          **(chatbot_params or {}))
+                conversation_id = self._get_id(
+                    self._conversation_ids, Conversation,
+                    'start_time', start_time,
+                    user_id=user_id,
+                    chatbot_id=chatbot_id)
+                rows.append({'user_message': user_message,
+                             'chatbot_message': bot_message,
+                             'conversation_id': conversation_id})
+            db.session.bulk_insert_mappings(Turn, rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Ids of rows added by the failed transaction are not valid.
+            self._user_ids.clear()
+            self._chatbot_ids.clear()
+            self._conversation_ids.clear()
+            raise
+        finally:
+            db.session.remove()
+
+    @staticmethod
+    def _get_id(ids, model_class, key, value, **kwargs):
+        """Returns the id of the model_class row whose (unique) column key
+        is value, adding the row (with kwargs) if it doesn't exist yet."""
+        if value not in ids:
+            row = model_class.query.filter_by(**{key: value}).first()
+            if row is None:
+                row = model_class(**{key: value}, **kwargs)
+                db.session.add(row)
+                db.session.flush()
+            ids[value] = row.id
+        return ids[value]
@@ -0,0 +1,205 @@
+"""Tokenizer and vocabulary lookup shared by data preprocessing and serving.
+
+This module only depends on the standard library. It lives here, since the
+webpage is deployed without the rest of this repository, and utils/vocab.py
+loads it for data preprocessing.
+"""
+
+import os
+import re
+import json
+
+# Enumerations of the special vocabulary symbols (see utils/io_utils.py).
+PAD_ID = 0
+GO_ID = 1
+EOS_ID = 2
+UNK_ID = 3
+
+# A token is either a single punctuation character or a run of characters
+# that are neither whitespace nor punctuation. Finding all of them in one
+# pass gives the same tokens as splitting on whitespace and then on
+# punctuation (keeping the punctuation).
+_TOKEN_RE = re.compile(b"[.,!?\"':;)(]|[^\\s.,!?\"':;)(]+")
+_DIGIT_RE = re.compile(br"\d")
+
+# Punctuation that is always attached to the preceding word.
+_ATTACH_LEFT = frozenset(['.', '!', '?'])
+
+# Suffix of the index saved next to each vocabulary file. It is JSON, not
+# a pickle: loading it must not run code from the data or deploy directory.
+_INDEX_SUFFIX = ".index.json"
+_INDEX_VERSION = 2
+
+
+def _as_bytes(sentence):
+    if isinstance(sentence, bytes):
+        return sentence
+    return sentence.encode('utf-8')
+
+
+def tokenize(sentence, normalize_digits=True, lower=True):
+    """Split a sentence (bytes or str) into a list of (bytes) tokens.
+
+    Args:
+        sentence: the sentence to tokenize.
+        normalize_digits: Boolean; if true, all digits are replaced by 0s.
+        lower: Boolean; if true, the sentence is lowercased first.
+    """
+    if lower:
+        sentence = sentence.lower()
+    sentence = _as_bytes(sentence)
+    if normalize_digits:
+        # Digits never separate tokens, so normalizing the whole sentence
+        # at once is the same as normalizing each token.
+        sentence = _DIGIT_RE.sub(b"0", sentence)
+    return _TOKEN_RE.findall(sentence)
+
+
+def encode_batch(sentences, word_to_idx, normalize_digits=True):
+    """Returns the list of token ids of each sentence in sentences.
+
+    Args:
+        sentences: iterable of sentences (bytes or str).
+        word_to_idx: dictionary mapping tokens to ids. Unknown tokens
+            are mapped to UNK_ID.
+        normalize_digits: Boolean; if true, all digits are replaced by 0s.
+    """
+    get = word_to_idx.get
+    return [[get(w, UNK_ID) for w in tokenize(s, normalize_digits)]
+            for s in sentences]
+
+
+def decode_word(word):
+    """Returns the (str) display form of a vocabulary entry (bytes)."""
+    try:
+        return word.decode('utf-8')
+    except UnicodeDecodeError:
+        return str(word)
+
+
+def detokenize(words):
+    """Joins a list of (str) tokens into a sentence, attaching punctuation.
+
+    Produces the same output as joining with spaces, then replacing
+    ' , ' by ', ', removing spaces before '.', '!' and '?', and replacing
+    " ' " by "'", in that order (as each str.replace would, including
+    how consecutive matches consume each other's spaces). The sentence is
+    then capitalized.
+    """
+    n = len(words)
+    parts = []
+    comma_consumed = False  # Space before words[i] ended a ' , ' match.
+    quote_consumed = False  # Space before words[i] ended a " ' " match.
+    space_removed = False   # Space before words[i] removed by a " ' " match.
+    for i, word in enumerate(words):
+        has_next = i + 1 < n
+        space = i > 0 and not space_removed
+        next_comma_consumed = next_quote_consumed = space_removed = False
+        if word == ',':
+            if space and has_next and not comma_consumed:
+                space = False
+                next_comma_consumed = True
+        elif word in _ATTACH_LEFT:
+            space = False
+        elif word == "'" and space and has_next and not quote_consumed:
+            # The space after the quote must have survived the replaces of
+            # ' , ', ' .' and ' !' (which all come before " ' ").
+            following = words[i + 1]
+            if not (following in ('.', '!')
+                    or (following == ',' and i + 2 < n)):
+                space = False
+                space_removed = next_quote_consumed = True
+        if space:
+            parts.append(' ')
+        parts.append(word)
+        comma_consumed = next_comma_consumed
+        quote_consumed = next_quote_consumed
+
+    sentence = ''.join(parts)
+    if len(sentence) < 2:
+        return sentence
+    return sentence[0].upper() + sentence[1:]
+
+
+class Vocabulary:
+    """Mapping between tokens (bytes) and their ids, read from a
+    one-token-per-line vocabulary file.
+    """
+
+    def __init__(self, idx_to_word, word_to_idx=None):
+        self.idx_to_word = idx_to_word
+        if word_to_idx is None:
+            word_to_idx = {w: i for i, w in enumerate(idx_to_word)}
+        self.word_to_idx = word_to_idx
+        self._words = None
+
+    @property
+    def words(self):
+        """List of the (str) display form of each token id."""
+        if self._words is None:
+            self._words = [decode_word(w) for w in self.idx_to_word]
+        return self._words
+
+    @classmethod
+    def load(cls, vocab_path):
+        """Returns the Vocabulary of the file at vocab_path.
+
+        Parsing the text file is done once: the words are saved to
+        vocab_path + '.index.json', which later calls load instead for as
+        long as the vocabulary file is not modified.
+
+        Raises:
+            ValueError: if vocab_path does not exist.
+        """
+        if not os.path.exists(vocab_path):
+            raise ValueError("Vocabulary file %s not found." % vocab_path)
+
+        stat = os.stat(vocab_path)
+        signature = [_INDEX_VERSION, stat.st_size, stat.st_mtime]
+        index_path = vocab_path + _INDEX_SUFFIX
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if index['signature'] == signature:
+                # Words are stored as str, with their undecodable bytes
+                # escaped to surrogates.
+                return cls([w.encode('utf-8', 'surrogateescape')
+                            for w in index['words']])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+
+        with open(vocab_path, 'rb') as f:
+            vocab = cls([line.strip() for line in f])
+        try:
+            tmp_path = index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'signature': signature,
+                           'words': [w.decode('utf-8', 'surrogateescape')
+                                     for w in vocab.idx_to_word]}, f)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            # E.g. a read-only deployment. Just parse the text file next time.
+            pass
+        return vocab
+
+    def __len__(self):
+        return len(self.idx_to_word)
+
+    def encode(self, sentence, normalize_digits=True):
+        """Returns the list of token ids of sentence (bytes or str)."""
+        return encode_batch([sentence], self.word_to_idx, normalize_digits)[0]
+
+    def encode_batch(self, sentences, normalize_digits=True):
+        """Returns the list of token ids of each sentence in sentences."""
+        return encode_batch(sentences, self.word_to_idx, normalize_digits)
+
+    def decode(self, token_ids):
+        """Returns the sentence (str) of a list of token ids."""
+        words = self.words
+        return detokenize([words[i] for i in token_ids])
+
+    def decode_batch(self, batch_token_ids):
+        """Returns the sentence (str) of each list of token ids."""
+        words = self.words
+        return [detokenize([words[i] for i in token_ids])
+                for token_ids in batch_token_ids]
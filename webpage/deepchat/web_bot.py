@@ -3,45 +3,36 @@ See the main repository for better docs (all from utils and data directory).
 """
 
 import os
-import re
-import numpy as np
-import tensorflow as tf
 import yaml
+from .cache import ResponseCache
+from .vocab import Vocabulary, EOS_ID
+from .bot_io import encoder_batch, length_batches, response_ids
+from .numpy_bot import NumpyBot, NPZ_FILE
+# Note: tensorflow is imported by the functions that need it, so that the
+# web app boots (and serves pages) without loading it.
 os.environ['TF_CPP_MIN_LOG_LEVEL']='1'
 
-UNK_ID  = 3
-# Regular expressions used to tokenize.
-_WORD_SPLIT = re.compile(b"([.,!?\"':;)(])")
-_DIGIT_RE = re.compile(br"\d")
 _PRIMARY_KEYS = ['model', 'dataset', 'model_params', 'dataset_params']
 
 
-def basic_tokenizer(sentence):
-    words = []
-    for space_separated_fragment in sentence.strip().split():
-        words.extend(_WORD_SPLIT.split(space_separated_fragment))
-    return [w for w in words if w]
+# Response to inputs the bot answers with unknown words.
+UNKNOWN_RESPONSE = "I don't know."
 
 
-def sentence_to_token_ids(sentence, vocabulary, normalize_digits=True):
-    words = basic_tokenizer(sentence)
-    if not normalize_digits:
-        return [vocabulary.get(w, UNK_ID) for w in words]
-    # Normalize digits by 0 before looking words up in the vocabulary.
-    return [vocabulary.get(_DIGIT_RE.sub(b"0", w), UNK_ID) for w in words]
+def clean_response(response):
+    """Translates from confused-bot-language to English..."""
+    if 'UNK' in response:
+        return UNKNOWN_RESPONSE
+    return response
 
 
-def get_vocab_dicts(vocabulary_path):
-    """Returns word_to_idx, idx_to_word dictionaries given vocabulary."""
-    if tf.gfile.Exists(vocabulary_path):
-        rev_vocab = []
-        with tf.gfile.GFile(vocabulary_path, mode="rb") as f:
-            rev_vocab.extend(f.readlines())
-        rev_vocab = [tf.compat.as_bytes(line.strip()) for line in rev_vocab]
-        vocab = dict([(x, y) for (y, x) in enumerate(rev_vocab)])
-        return vocab, rev_vocab
-    else:
-        raise ValueError("Vocabulary file %s not found." % vocabulary_path)
+def frozen_graph_path(frozen_model_dir):
+    """Returns the path of the graph optimized for deployment (see
+    utils/graph_optimizer.py) if there is one, else of the frozen graph."""
+    optimized_file = os.path.join(frozen_model_dir, "optimized_model.pb")
+    if os.path.exists(optimized_file):
+        return optimized_file
+    return os.path.join(frozen_model_dir, "frozen_model.pb")
 
 
 def load_graph(frozen_model_dir):
@@ -54,8 +45,9 @@ def load_graph(frozen_model_dir):
         tf.Graph object imported from frozen_model_path.
     """
 
+    import tensorflow as tf
     # Prase the frozen graph definition into a GraphDef object.
-    frozen_file = os.path.join(frozen_model_dir, "frozen_model.pb")
+    frozen_file = frozen_graph_path(frozen_model_dir)
     with tf.gfile.GFile(frozen_file, "rb") as f:
         graph_def = tf.GraphDef()
         graph_def.ParseFromString(f.read())
@@ -88,14 +80,34 @@ def unfreeze_bot(frozen_model_path):
     return tensors, bot_graph
 
 
+def uses_sequence_lengths(graph):
+    """Returns True if the (unfrozen) chat graph passes the length of each
+    user input to its encoder. Graphs frozen before the encoders took
+    sequence lengths run over the padding of batched inputs."""
+    try:
+        graph.get_operation_by_name('import/input_pipeline/user_input_length')
+    except KeyError:
+        return False
+    return True
+
+
 class FrozenBot:
     """The mouth and ears of a cornell_bot that's been serialized."""
 
-    def __init__(self, frozen_model_dir, is_testing=False):
+    def __init__(self, frozen_model_dir, is_testing=False, cache_size=1024,
+                 runtime='tensorflow', intra_op_threads=0, inter_op_threads=0):
         """
         Args:
             is_testing: (bool) True for testing (while GPU is busy training).
             In that case, just use a 'bot' that returns inputs reversed.
+            cache_size: number of responses kept in the response cache.
+            runtime: 'tensorflow' to run the frozen graph in a session, or
+                'numpy' to run the exported numpy_model.npz with NumpyBot
+                (no TensorFlow needed).
+            intra_op_threads, inter_op_threads: sizes of the thread pools of
+                the session (0 lets TensorFlow use one thread per core).
+                Set them when several bots or worker processes share the
+                cores, so that their pools don't oversubscribe them.
         """
 
         # Get absolute path to model directory.
@@ -105,9 +117,22 @@ class FrozenBot:
                                      'frozen_models',
                                      frozen_model_dir)
         self.load_config(os.path.join(self.abs_model_dir, 'config.yml'))
-        self.word_to_idx, self.idx_to_word = self.get_frozen_vocab(self.config)
+        self.vocab = self.get_frozen_vocab(self.config)
+        self.word_to_idx = self.vocab.word_to_idx
+        self.idx_to_word = self.vocab.idx_to_word
         self.is_testing = is_testing
-
+        self.name = frozen_model_dir
+        self.cache = ResponseCache(max_size=cache_size)
+        if runtime not in ('tensorflow', 'numpy'):
+            raise ValueError("Unknown runtime %r." % runtime)
+        self.runtime = runtime
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.numpy_bot = None
+        self.uses_sequence_lengths = False
+
+        # Approximate memory used by the loaded bot: its frozen weights.
+        self.memory_size = 0
         # Setup tensorflow graph(s)/session(s) iff not testing.
         if not is_testing:
             self.unfreeze()
@@ -132,30 +157,14 @@ class FrozenBot:
         raise AttributeError(name)
 
     def get_frozen_vocab(self, config):
-        """Helper function to get dictionaries between tokens and words."""
+        """Helper function to get the Vocabulary of the frozen model."""
         data_dir    = config['dataset_params']['data_dir']
         vocab_size  = config['dataset_params']['vocab_size']
         vocab_path = os.path.join(data_dir, 'vocab{}.txt'.format(vocab_size))
-        word_to_idx, idx_to_word = get_vocab_dicts(vocab_path)
-        return word_to_idx, idx_to_word
+        return Vocabulary.load(vocab_path)
 
     def as_words(self, sentence):
-        words = []
-        for token in sentence:
-            word = self.idx_to_word[token]
-            try:
-                word = tf.compat.as_str(word)
-            except UnicodeDecodeError:
-                word = str(word)
-            words.append(word)
-
-        words = " ".join(words)
-        words = words.replace(' , ', ', ').replace(' .', '.').replace(' !', '!')
-        words = words.replace(" ' ", "'").replace(" ?", "?")
-        if len(words) < 2:
-            return words
-        return words[0].upper() + words[1:]
-
+        return self.vocab.decode(sentence)
 
     def __call__(self, sentence):
         """Outputs response sentence (string) given input (string)."""
@@ -165,30 +174,130 @@ class FrozenBot:
 
         sentence = sentence.strip().lower()
         print('User:', sentence)
-        # Convert input sentence to token-ids.
-        sentence_tokens = sentence_to_token_ids(
-            tf.compat.as_bytes(sentence), self.word_to_idx)
-        sentence_tokens = np.array([sentence_tokens[::-1]])
-        # Get output sentence from the chatbot.
-        fetches = self.tensor_dict['outputs']
-        feed_dict={self.tensor_dict['inputs']: sentence_tokens}
-        response = self.sess.run(fetches=fetches, feed_dict=feed_dict)
-        response = self.as_words(response[0][:-1])
-        # Translate from confused-bot-language to English...
-        if 'UNK' in response:
-            response = "I don't know."
+        response = self.respond_batch([sentence])[0]
         print("Bot:", response)
         return response
 
+    def respond_batch(self, sentences):
+        """Outputs response sentences (strings) given inputs (strings),
+        running the whole batch in one session run when the graph allows it.
+        """
+
+        if self.is_testing:
+            return [sentence[::-1] for sentence in sentences]
+
+        # Convert input sentences to token-ids.
+        sentence_tokens = self.vocab.encode_batch(sentences)
+
+        # Look up deterministic responses in the cache first.
+        temperature = self.model_params.get('temperature', 0.0)
+        keys = [ResponseCache.key(self.name, temperature, tokens)
+                for tokens in sentence_tokens]
+        responses = [self.cache.get(key) for key in keys]
+        misses = [i for i, response in enumerate(responses) if response is None]
+        if not misses:
+            return responses
+
+        # Graphs frozen before batched decoding only accept one sentence, and
+        # the ones frozen before the encoders took sequence lengths respond
+        # to padded sentences depending on their batch.
+        if self.numpy_bot is not None or self.uses_sequence_lengths:
+            batches = [misses]
+        elif self.tensor_dict['inputs'].shape[0].value == 1:
+            batches = [[i] for i in misses]
+        else:
+            missed_tokens = [sentence_tokens[i] for i in misses]
+            batches = [[misses[j] for j in batch]
+                       for batch in length_batches(missed_tokens)]
+
+        for batch in batches:
+            inputs = encoder_batch([sentence_tokens[i] for i in batch])
+            if self.numpy_bot is not None:
+                outputs = self.numpy_bot(inputs)
+            else:
+                outputs = self.sess.run(
+                    fetches=self.tensor_dict['outputs'],
+                    feed_dict={self.tensor_dict['inputs']: inputs})
+            outputs = self.vocab.decode_batch(
+                [response_ids(response) for response in outputs])
+            for i, response in zip(batch, outputs):
+                response = clean_response(response)
+                responses[i] = response
+                self.cache.put(keys[i], response)
+        return responses
+
+    def respond_stream(self, sentence):
+        """Yields the response to sentence (string) while it is decoded:
+        the text of the response so far after each new word, and lastly
+        the response itself (as respond_batch would return it). Texts with
+        unknown words are replaced by UNKNOWN_RESPONSE, like responses are.
+
+        Only the numpy runtime decodes one word at a time, so streaming
+        needs runtime='numpy' (BOT_RUNTIME=numpy). With the tensorflow
+        runtime, the frozen graph decodes the whole response in one session
+        run, which is yielded at once.
+        """
+
+        if self.is_testing:
+            words = sentence[::-1].split(' ')
+            for i in range(1, len(words) + 1):
+                yield ' '.join(words[:i])
+            return
+        if self.numpy_bot is None:
+            yield self.respond_batch([sentence])[0]
+            return
+
+        tokens = self.vocab.encode(sentence)
+        key = ResponseCache.key(self.name,
+                                self.model_params.get('temperature', 0.0),
+                                tokens)
+        response = self.cache.get(key)
+        if response is not None:
+            yield response
+            return
+
+        ids = []
+        response = clean_response(self.vocab.decode(ids))
+        for step_ids in self.numpy_bot.generate(encoder_batch([tokens])):
+            if step_ids[0] == EOS_ID:
+                break
+            ids.append(step_ids[0])
+            # Punctuation and capitalization depend on the next words, so
+            # the whole text so far is sent each time.
+            response = clean_response(self.vocab.decode(ids))
+            yield response
+            if response == UNKNOWN_RESPONSE:
+                # That is the whole response, whatever words follow.
+                break
+        if not ids:
+            yield response
+        self.cache.put(key, response)
+
     def unfreeze(self):
         # Setup tensorflow graph(s)/session(s) iff not testing.
-        if not self.is_testing:
+        if self.is_testing:
+            return
+        if self.runtime == 'numpy':
+            self.numpy_bot = NumpyBot.load(
+                os.path.join(self.abs_model_dir, NPZ_FILE))
+            self.memory_size = self.numpy_bot.memory_size
+        else:
             # Get bot graph and input/output tensors.
+            import tensorflow as tf
             self.tensor_dict, graph = unfreeze_bot(self.abs_model_dir)
-            self.sess = tf.Session(graph=graph)
+            self.sess = tf.Session(graph=graph, config=tf.ConfigProto(
+                intra_op_parallelism_threads=self.intra_op_threads,
+                inter_op_parallelism_threads=self.inter_op_threads))
+            self.uses_sequence_lengths = uses_sequence_lengths(graph)
+            self.memory_size = os.path.getsize(
+                frozen_graph_path(self.abs_model_dir))
 
     def freeze(self):
-        if not self.is_testing:
+        if self.is_testing:
+            return
+        if self.numpy_bot is not None:
+            self.numpy_bot = None
+        else:
             self.sess.close()
             self.graph = self.tensor_dict = None
 
@@ -0,0 +1,244 @@
+"""deepchat/worker_pool.py: Bots served by a pool of worker processes.
+
+A WorkerPool starts num_workers processes when it is created, and each one
+loads its own copy of a bot (e.g. a web_bot.FrozenBot with its own session).
+Their sessions should have small thread pools (intra_op_threads,
+inter_op_threads), and the workers can be pinned to disjoint sets of cores,
+so that they don't compete for the same cores under load.
+
+The pool has the interface ModelPool expects from a bot (respond_batch,
+memory_size, freeze, and the config of the bot), and each batch goes to the
+worker with the fewest batches in flight. Its concurrency attribute tells
+ModelPool how many batches to send at once.
+
+Workers are started with the 'spawn' method, which imports the main script
+again in each of them (as __mp_main__): scripts that create the web app at
+import time must not do it there (see manage.py).
+"""
+
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future
+from queue import Empty
+
+
+class WorkerError(Exception):
+    """Raised when a worker process fails to load its bot or to respond."""
+
+
+def split_cpus(num_workers, cpus=None):
+    """Returns num_workers disjoint sets of cores, covering cpus (by
+    default, the cores this process may run on) as evenly as possible.
+
+    Raises:
+        ValueError: if there are fewer cores than workers.
+    """
+    if cpus is None:
+        cpus = os.sched_getaffinity(0)
+    cpus = sorted(cpus)
+    if len(cpus) < num_workers:
+        raise ValueError("Cannot pin %d workers to %d cores."
+                         % (num_workers, len(cpus)))
+    size, extra = divmod(len(cpus), num_workers)
+    cpu_sets, start = [], 0
+    for i in range(num_workers):
+        end = start + size + (i < extra)
+        cpu_sets.append(set(cpus[start:end]))
+        start = end
+    return cpu_sets
+
+
+def _describe(error):
+    return '%s: %s' % (type(error).__name__, error)
+
+
+def _serve(load_bot, name, cpus, requests, responses, worker_id):
+    """Main function of a worker process: loads the bot and answers the
+    (request_id, sentences) requests until it receives None.
+
+    Messages sent back are (worker_id, request_id, result, error) tuples,
+    where request_id is None for the message telling the bot was loaded
+    (result is then its memory_size and config).
+    """
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    try:
+        bot = load_bot(name)
+    except Exception as e:
+        responses.put((worker_id, None, None, _describe(e)))
+        return
+    responses.put((worker_id, None, (bot.memory_size, bot.config), None))
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, sentences = request
+        try:
+            result = bot.respond_batch(sentences)
+        except Exception as e:
+            responses.put((worker_id, request_id, None, _describe(e)))
+        else:
+            responses.put((worker_id, request_id, result, None))
+    bot.freeze()
+
+
+class WorkerPool:
+    """Load-balances batches of sentences across worker processes, each
+    holding its own copy of a bot.
+    """
+
+    def __init__(self, name, load_bot, num_workers=2, cpu_sets=None,
+                 start_method='spawn', poll_interval=1.0):
+        """Starts the workers and waits until each one has loaded its bot.
+
+        Args:
+            name: model name, passed to load_bot in each worker.
+            load_bot: picklable callable mapping a model name to a loaded
+                bot, e.g. functools.partial(web_bot.FrozenBot,
+                intra_op_threads=2, inter_op_threads=1).
+            num_workers: number of worker processes.
+            cpu_sets: (optional) list of num_workers sets of cores to pin
+                each worker to, e.g. split_cpus(num_workers).
+            start_method: multiprocessing start method. 'spawn' starts each
+                worker from a fresh interpreter, which is safe even when the
+                web server already runs threads (or TensorFlow).
+            poll_interval: seconds between two checks that the workers with
+                requests in flight are still alive.
+
+        Raises:
+            WorkerError: if a worker could not load its bot.
+        """
+        if cpu_sets is not None and len(cpu_sets) != num_workers:
+            raise ValueError("Expected %d cpu_sets, got %d."
+                             % (num_workers, len(cpu_sets)))
+        self.name = name
+        self.concurrency = num_workers
+        self.poll_interval = poll_interval
+        context = multiprocessing.get_context(start_method)
+        self._responses = context.Queue()
+        self._requests = [context.Queue() for _ in range(num_workers)]
+        self._processes = [
+            context.Process(
+                target=_serve,
+                args=(load_bot, name, cpu_sets[i] if cpu_sets else None,
+                      self._requests[i], self._responses, i),
+                daemon=True)
+            for i in range(num_workers)]
+        for process in self._processes:
+            process.start()
+
+        # Futures of the requests in flight, per worker.
+        self._pending = [{} for _ in range(num_workers)]
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.memory_size = 0
+        for _ in range(num_workers):
+            worker_id, _, result, error = self._get_response()
+            if error is not None:
+                self._stop_workers()
+                raise WorkerError("Worker %d could not load %s. %s"
+                                  % (worker_id, name, error))
+            memory_size, self.config = result
+            self.memory_size += memory_size
+
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+
+    def respond_batch(self, sentences):
+        """Returns the responses of the least busy worker to sentences.
+
+        Raises:
+            WorkerError: if the worker failed to respond, or if all workers
+                exited.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("WorkerPool is closed.")
+            alive = [i for i, process in enumerate(self._processes)
+                     if process.is_alive()]
+            if not alive:
+                raise WorkerError("All workers of %s exited." % self.name)
+            worker_id = min(alive, key=lambda i: len(self._pending[i]))
+            request_id = next(self._request_ids)
+            self._pending[worker_id][request_id] = future
+            # Queue under the lock, so that freeze sends the workers their
+            # stop signal after every request already accepted.
+            self._requests[worker_id].put((request_id, list(sentences)))
+        return future.result()
+
+    def __call__(self, sentence):
+        """Outputs response sentence (string) given input (string)."""
+        return self.respond_batch([sentence])[0]
+
+    def freeze(self):
+        """Stops the workers once they answered the requests sent to them."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop_workers()
+        self._responses.put(None)
+        self._receiver.join()
+
+    def _stop_workers(self):
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join()
+
+    def _get_response(self):
+        """Returns the next message of the workers, raising WorkerError if
+        a worker died before sending it."""
+        while True:
+            try:
+                return self._responses.get(timeout=self.poll_interval)
+            except Empty:
+                dead = [i for i, process in enumerate(self._processes)
+                        if not process.is_alive()]
+                if dead:
+                    self._stop_workers()
+                    raise WorkerError("Worker %d of %s exited."
+                                      % (dead[0], self.name))
+
+    def _receive(self):
+        """Resolves the futures of the requests with the workers' responses
+        (run by a background thread)."""
+        while True:
+            try:
+                message = self._responses.get(timeout=self.poll_interval)
+            except Empty:
+                self._fail_dead_workers()
+                continue
+            if message is None:
+                return
+            worker_id, request_id, result, error = message
+            with self._lock:
+                future = self._pending[worker_id].pop(request_id, None)
+            if future is None:
+                # Already failed by _fail_dead_workers.
+                continue
+            if error is not None:
+                future.set_exception(WorkerError(error))
+            else:
+                future.set_result(result)
+
+    def _fail_dead_workers(self):
+        """Fails the requests in flight of the workers that exited."""
+        for worker_id, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            with self._lock:
+                pending = self._pending[worker_id]
+                self._pending[worker_id] = {}
+            if pending:
+                logging.error("Worker %d of %s exited with %d requests in "
+                              "flight.", worker_id, self.name, len(pending))
+            for future in pending.values():
+                future.set_exception(WorkerError(
+                    "Worker %d of %s exited." % (worker_id, self.name)))
@@ -16,7 +16,10 @@ config_name = os.getenv('APPENGINE_CONFIG')
 if config_name is None:
     config_name = os.getenv('FLASK_CONFIG', 'default')
 
-app = create_app(config_name)
+# The worker processes of a WorkerPool (see deepchat/worker_pool.py) run this
+# script again, as __mp_main__, when they start. They must not create an app
+# of their own, which would load its bots (and start more workers).
+app = create_app(config_name) if __name__ != '__mp_main__' else None
 # For better CLI.
 manager = Manager(app)
 # Database tables can be created or upgraded with a single command:
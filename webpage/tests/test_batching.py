@@ -0,0 +1,101 @@
+"""Unit tests for the micro-batching of chat requests."""
+
+import threading
+import time
+import unittest
+from deepchat.batching import BatchingWorker
+
+
+class TestBatching(unittest.TestCase):
+
+    def setUp(self):
+        self.batch_sizes = []
+
+        def respond_batch(sentences):
+            self.batch_sizes.append(len(sentences))
+            time.sleep(0.01)
+            return [sentence[::-1] for sentence in sentences]
+
+        self.worker = BatchingWorker(respond_batch,
+                                     max_batch_size=8,
+                                     max_wait_ms=20)
+
+    def tearDown(self):
+        self.worker.close()
+
+    def test_single_request(self):
+        self.assertEqual(self.worker('hello'), 'olleh')
+
+    def test_concurrent_requests(self):
+        """Concurrent requests are batched, and each gets its own response."""
+        sentences = ['sentence %d' % i for i in range(32)]
+        responses = [None] * len(sentences)
+
+        def request(i):
+            responses[i] = self.worker(sentences[i], timeout=5)
+
+        threads = [threading.Thread(target=request, args=(i,))
+                   for i in range(len(sentences))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(responses, [s[::-1] for s in sentences])
+        self.assertEqual(sum(self.batch_sizes), len(sentences))
+        self.assertLessEqual(max(self.batch_sizes), 8)
+        self.assertLess(len(self.batch_sizes), len(sentences))
+
+    def test_errors_reach_callers(self):
+        def respond_batch(sentences):
+            raise ValueError('bad batch')
+
+        worker = BatchingWorker(respond_batch)
+        with self.assertRaises(ValueError):
+            worker('hello', timeout=5)
+        worker.close()
+        with self.assertRaises(RuntimeError):
+            worker.submit('hello')
+
+    def test_errors_stay_per_sentence(self):
+        """A sentence that fails its batch doesn't fail the others."""
+        def respond_batch(sentences):
+            if 'bad' in sentences:
+                raise ValueError('bad sentence')
+            return [sentence[::-1] for sentence in sentences]
+
+        worker = BatchingWorker(respond_batch, max_batch_size=8,
+                                max_wait_ms=50)
+        futures = [worker.submit(s) for s in ['hello', 'bad', 'world']]
+        self.assertEqual(futures[0].result(timeout=5), 'olleh')
+        self.assertRaises(ValueError, futures[1].result, timeout=5)
+        self.assertEqual(futures[2].result(timeout=5), 'dlrow')
+        worker.close()
+
+    def test_num_threads(self):
+        """With num_threads, batches are answered concurrently."""
+        in_flight = []
+        max_in_flight = []
+        lock = threading.Lock()
+
+        def respond_batch(sentences):
+            with lock:
+                in_flight.append(1)
+                max_in_flight.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.pop()
+            return sentences
+
+        worker = BatchingWorker(respond_batch, max_batch_size=1,
+                                max_wait_ms=0, num_threads=4)
+        futures = [worker.submit('sentence %d' % i) for i in range(8)]
+        self.assertEqual([f.result(timeout=5) for f in futures],
+                         ['sentence %d' % i for i in range(8)])
+        self.assertGreater(max(max_in_flight), 1)
+        # Closing stops every thread.
+        worker.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
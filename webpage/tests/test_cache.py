@@ -0,0 +1,52 @@
+"""Unit tests for the chat response cache."""
+
+import unittest
+from deepchat.cache import ResponseCache
+from deepchat.numpy_bot import GREEDY_TEMPERATURE
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(max_size=2)
+
+    def test_hit_and_miss(self):
+        key = ResponseCache.key('cornell', 0.0, [4, 5, 6])
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, 'Hi.')
+        self.assertEqual(self.cache.get(key), 'Hi.')
+        self.assertEqual(self.cache.get(ResponseCache.key('reddit', 0.0, [4, 5, 6])), None)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_lru_eviction(self):
+        keys = [ResponseCache.key('cornell', 0.0, [i]) for i in range(3)]
+        self.cache.put(keys[0], 'zero')
+        self.cache.put(keys[1], 'one')
+        # Touch keys[0] so that keys[1] is the least recently used.
+        self.cache.get(keys[0])
+        self.cache.put(keys[2], 'two')
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertEqual(self.cache.get(keys[0]), 'zero')
+
+    def test_bypass_sampling(self):
+        key = ResponseCache.key('cornell', 0.5, [4, 5, 6])
+        self.assertIsNone(key)
+        self.cache.put(key, 'Hi.')
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['misses'], 0)
+
+    def test_greedy_temperatures(self):
+        """Bots decoding greedily are cached, whatever their temperature."""
+        self.assertIsNotNone(ResponseCache.key('cornell', 0.01, [4, 5, 6]))
+        self.assertIsNotNone(ResponseCache.key(
+            'cornell', GREEDY_TEMPERATURE / 2, [4, 5, 6]))
+        self.assertIsNone(ResponseCache.key(
+            'cornell', GREEDY_TEMPERATURE, [4, 5, 6]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""Unit tests for the pool of warm bots."""
+
+import threading
+import unittest
+from deepchat.model_pool import ModelPool, ModelLoading
+
+
+class FakeBot:
+
+    def __init__(self, name, memory_size=1):
+        self.name = name
+        self.memory_size = memory_size
+        self.frozen = False
+
+    def respond_batch(self, sentences):
+        return ['%s: %s' % (self.name, sentence) for sentence in sentences]
+
+    def freeze(self):
+        self.frozen = True
+
+
+class TestModelPool(unittest.TestCase):
+
+    def setUp(self):
+        self.loads = []
+
+        def load_bot(name):
+            if name == 'missing':
+                raise ValueError('No frozen model for %s.' % name)
+            self.loads.append(name)
+            return FakeBot(name)
+
+        self.load_bot = load_bot
+
+    def test_preload(self):
+        pool = ModelPool(self.load_bot)
+        for future in pool.preload(['reddit', 'cornell', 'ubuntu']):
+            future.result()
+        self.assertEqual(pool.loaded(), ['reddit', 'cornell', 'ubuntu'])
+        # Switching between loaded bots never loads them again.
+        for name in ['cornell', 'reddit', 'ubuntu', 'reddit']:
+            self.assertEqual(pool(name, 'hi'), '%s: hi' % name)
+        self.assertEqual(self.loads, ['reddit', 'cornell', 'ubuntu'])
+        pool.close()
+
+    def test_memory_budget(self):
+        """Least recently used bots are unloaded to fit the budget."""
+        pool = ModelPool(self.load_bot, memory_budget=2)
+        for future in pool.preload(['reddit', 'cornell']):
+            future.result()
+        reddit, _ = pool.get('reddit')
+        pool.get('ubuntu')
+        self.assertEqual(pool.loaded(), ['reddit', 'ubuntu'])
+        cornell_loads = self.loads.count('cornell')
+        self.assertEqual(pool('cornell', 'hi'), 'cornell: hi')
+        self.assertEqual(self.loads.count('cornell'), cornell_loads + 1)
+        self.assertEqual(pool.loaded(), ['ubuntu', 'cornell'])
+        self.assertTrue(reddit.frozen)
+        pool.close()
+
+    def test_reload(self):
+        """A reloaded bot replaces the old one, which is then unloaded."""
+        pool = ModelPool(self.load_bot)
+        old_bot, _ = pool.get('reddit')
+        pool.reload('reddit').result()
+        new_bot, _ = pool.get('reddit')
+        self.assertIsNot(old_bot, new_bot)
+        self.assertTrue(old_bot.frozen)
+        self.assertFalse(new_bot.frozen)
+        pool.close()
+
+    def test_load_failure(self):
+        pool = ModelPool(self.load_bot)
+        self.assertRaises(ValueError, pool.get, 'missing')
+        self.assertRaises(ValueError, pool.get, 'missing')
+        self.assertEqual(pool.loaded(), [])
+        pool.close()
+
+    def test_concurrent_requests(self):
+        """Concurrent first requests share a single load."""
+        pool = ModelPool(self.load_bot)
+        responses = []
+        threads = [threading.Thread(
+            target=lambda: responses.append(pool('reddit', 'hi')))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(responses, ['reddit: hi'] * 8)
+        self.assertEqual(self.loads, ['reddit'])
+        pool.close()
+
+    def test_in_use_not_unloaded(self):
+        """Bots in use are neither evicted nor closed until released."""
+        pool = ModelPool(self.load_bot, memory_budget=1)
+        entry = pool.acquire('reddit')
+        pool.get('cornell')
+        # Over the budget, since reddit is in use.
+        self.assertEqual(pool.loaded(), ['reddit', 'cornell'])
+        pool.reload('reddit').result()
+        self.assertFalse(entry[0].frozen)
+        self.assertEqual(entry[1]('hi'), 'reddit: hi')
+        pool.release(entry)
+        self.assertTrue(entry[0].frozen)
+        pool.close()
+
+    def test_load_timeout(self):
+        """Requests don't wait for slow loads, which go on in the
+        background."""
+        loaded = threading.Event()
+
+        def load_bot(name):
+            loaded.wait(5)
+            return FakeBot(name)
+
+        pool = ModelPool(load_bot, load_timeout=0.01)
+        with self.assertRaises(ModelLoading):
+            pool('reddit', 'hi')
+        loaded.set()
+        pool.preload(['reddit'])[0].result()
+        self.assertEqual(pool('reddit', 'hi'), 'reddit: hi')
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
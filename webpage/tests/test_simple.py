@@ -27,3 +27,19 @@ class TestSimple(unittest.TestCase):
     def test_app_is_testing(self):
         """Ensure we can access the right config specifications."""
         self.assertTrue(current_app.config['TESTING'])
+
+    def test_server_sent_event(self):
+        from deepchat.main.views import server_sent_event
+        self.assertEqual(server_sent_event({'response': 'Hi'}),
+                         'data: {"response": "Hi"}\n\n')
+        self.assertEqual(server_sent_event({'response': 'Hi'}, event='done'),
+                         'event: done\ndata: {"response": "Hi"}\n\n')
+
+    def test_chat_stream_rejects(self):
+        """Requests that can't be answered fail before the stream starts."""
+        client = self.app.test_client()
+        self.assertEqual(client.get('/chat/cornell/stream').status_code, 400)
+        self.assertEqual(client.get('/chat/cornell/stream?user_message=%20')
+                         .status_code, 400)
+        self.assertEqual(client.get('/chat/nobody/stream?user_message=hi')
+                         .status_code, 404)
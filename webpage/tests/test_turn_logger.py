@@ -0,0 +1,59 @@
+"""Unit tests for the background logging of chat turns."""
+
+import unittest
+from datetime import datetime
+from deepchat import create_app, db
+from deepchat.models import User, Chatbot, Conversation, Turn
+
+CHATBOT_PARAMS = dict(dataset='cornell',
+                      base_cell='GRUCell',
+                      encoder='BasicEncoder',
+                      decoder='BasicDecoder',
+                      learning_rate=0.002,
+                      num_layers=1,
+                      state_size=512)
+
+
+class TestTurnLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.logger = self.app.turn_logger
+
+    def tearDown(self):
+        self.logger.close()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_turns_are_written(self):
+        start_time = datetime.utcnow()
+        for i in range(5):
+            self.logger.log('Anon', 'cornell', start_time,
+                            'hi %d' % i, 'hello %d' % i,
+                            chatbot_params=CHATBOT_PARAMS)
+        self.logger.flush()
+        self.assertEqual(User.query.count(), 1)
+        self.assertEqual(Chatbot.query.count(), 1)
+        self.assertEqual(Conversation.query.count(), 1)
+        turns = Turn.query.order_by(Turn.id).all()
+        self.assertEqual([t.user_message for t in turns],
+                         ['hi %d' % i for i in range(5)])
+        self.assertEqual(turns[0].conversation.chatbot.name, 'cornell')
+
+    def test_close_flushes(self):
+        self.logger.log('Anon', 'cornell', datetime.utcnow(), 'hi', 'hello',
+                        chatbot_params=CHATBOT_PARAMS)
+        self.logger.close()
+        self.assertEqual(Turn.query.count(), 1)
+        # Turns logged after close are dropped, without failing the request.
+        with self.assertLogs(level='WARNING'):
+            self.logger.log('Anon', 'cornell', datetime.utcnow(), 'hi', 'bye')
+        self.assertEqual(Turn.query.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Unit tests for the pool of bot worker processes."""
+
+import os
+import threading
+import time
+import unittest
+from functools import partial
+from deepchat.model_pool import ModelPool
+from deepchat.worker_pool import WorkerPool, WorkerError, split_cpus
+
+
+# Bots are loaded in the worker processes, so they must be importable there.
+class EchoBot:
+
+    def __init__(self, name, delay=0.0):
+        if name == 'missing':
+            raise ValueError('No frozen model for %s.' % name)
+        self.name = name
+        self.delay = delay
+        self.memory_size = 1
+        self.config = {'dataset': name, 'model_params': {}}
+
+    def respond_batch(self, sentences):
+        if 'fail' in sentences:
+            raise ValueError('bad batch')
+        time.sleep(self.delay)
+        # Tell which worker responded.
+        return ['%d: %s' % (os.getpid(), s) for s in sentences]
+
+    def freeze(self):
+        pass
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_respond_batch(self):
+        pool = WorkerPool('reddit', EchoBot, num_workers=2)
+        self.assertEqual(pool.memory_size, 2)
+        self.assertEqual(pool.config['dataset'], 'reddit')
+        responses = pool.respond_batch(['hi', 'bye'])
+        self.assertEqual([r.split(': ')[1] for r in responses], ['hi', 'bye'])
+        pool.freeze()
+        with self.assertRaises(RuntimeError):
+            pool.respond_batch(['hi'])
+
+    def test_load_balancing(self):
+        """Concurrent batches are spread across the workers."""
+        pool = WorkerPool('reddit', partial(EchoBot, delay=0.2),
+                          num_workers=2)
+        responses = [None] * 4
+
+        def request(i):
+            responses[i] = pool.respond_batch(['sentence %d' % i])[0]
+
+        threads = [threading.Thread(target=request, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pool.freeze()
+        self.assertEqual([r.split(': ')[1] for r in responses],
+                         ['sentence %d' % i for i in range(4)])
+        pids = {r.split(': ')[0] for r in responses}
+        self.assertEqual(len(pids), 2)
+        self.assertNotIn(str(os.getpid()), pids)
+
+    def test_errors(self):
+        with self.assertRaises(WorkerError):
+            WorkerPool('missing', EchoBot, num_workers=2)
+        pool = WorkerPool('reddit', EchoBot, num_workers=1)
+        with self.assertRaises(WorkerError):
+            pool.respond_batch(['fail'])
+        # The worker keeps serving after a failed batch.
+        self.assertEqual(len(pool.respond_batch(['hi'])), 1)
+        pool.freeze()
+
+    def test_model_pool(self):
+        pool = ModelPool(partial(WorkerPool, load_bot=EchoBot, num_workers=2))
+        self.assertTrue(pool('reddit', 'hi').endswith(': hi'))
+        bot, worker = pool.get('reddit')
+        self.assertEqual(bot.concurrency, 2)
+        pool.close()
+
+    def test_split_cpus(self):
+        cpu_sets = split_cpus(3, cpus=range(8))
+        self.assertEqual([len(cpus) for cpus in cpu_sets], [3, 3, 2])
+        self.assertEqual(set.union(*cpu_sets), set(range(8)))
+        with self.assertRaises(ValueError):
+            split_cpus(4, cpus=[0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()